@@ -0,0 +1,3 @@
+#!/usr/bin/env python
+from lsst.pipe.tasks.multiBand import MultiBandPatchTask
+MultiBandPatchTask.parseAndRun()
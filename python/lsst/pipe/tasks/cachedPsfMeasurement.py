@@ -0,0 +1,194 @@
+#
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsstcorp.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+from collections import OrderedDict
+
+import numpy
+
+from lsst.pex.config import Field
+from lsst.pipe.base import Struct
+from lsst.meas.algorithms import KernelPsf
+from lsst.meas.base import SingleFrameMeasurementConfig, SingleFrameMeasurementTask
+import lsst.afw.geom as afwGeom
+import lsst.afw.math as afwMath
+import lsst.pex.exceptions as pexExceptions
+
+__all__ = ["PsfImageCache", "CachedPsfMeasurementConfig", "CachedPsfMeasurementTask"]
+
+
+class PsfImageCache:
+    """Cache of the images of a PSF, evaluated at positions snapped to a grid
+
+    Each position is snapped to the nearest point of a grid, so a point within half the grid spacing (in
+    each dimension) of another uses the same image; points exactly half way between two grid points are
+    snapped to the upper one. The PSF is evaluated at the grid point, and the image is held as a KernelPsf,
+    which is cheap to evaluate. The least-recently used images are evicted when the cache is full.
+
+    Where the PSF cannot be evaluated at the grid point (e.g., a CoaddPsf with no inputs there), the
+    original PSF is used, so that it is evaluated exactly.
+    """
+
+    def __init__(self, psf, gridSize, capacity):
+        """Construct
+
+        @param psf: PSF to evaluate
+        @param gridSize: Spacing (pixels) of the grid to which positions are snapped
+        @param capacity: Maximum number of images to hold
+        """
+        self.psf = psf
+        self.gridSize = gridSize
+        self.capacity = capacity
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def getKey(self, position):
+        """Return the indices of the grid point nearest a position"""
+        return (int(numpy.floor(position.getX()/self.gridSize + 0.5)),
+                int(numpy.floor(position.getY()/self.gridSize + 0.5)))
+
+    def getCenter(self, key):
+        """Return the position of a grid point"""
+        return afwGeom.Point2D(key[0]*self.gridSize, key[1]*self.gridSize)
+
+    def get(self, position):
+        """Return a PSF that is the original PSF evaluated at the grid point nearest a position
+
+        @param position: Position (lsst.afw.geom.Point2D) of interest
+        @return PSF (KernelPsf, or the original PSF if it cannot be evaluated at the grid point)
+        """
+        key = self.getKey(position)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return self._cache[key]
+        self.misses += 1
+        center = self.getCenter(key)
+        try:
+            psf = KernelPsf(afwMath.FixedKernel(self.psf.computeKernelImage(center)), center)
+        except pexExceptions.Exception:
+            psf = self.psf
+        self._cache[key] = psf
+        if len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+        return psf
+
+    def __len__(self):
+        return len(self._cache)
+
+    def getStats(self):
+        """Return the number of hits, misses and evictions, as a Struct"""
+        return Struct(hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+
+class CachedPsfMeasurementConfig(SingleFrameMeasurementConfig):
+    psfCacheGridSize = Field(
+        dtype=float,
+        default=0.0,
+        check=lambda x: x >= 0.0,
+        doc=("Spacing (pixels) of the grid to which the position of each source is snapped for evaluating "
+             "the PSF; 0 to evaluate the PSF exactly. The PSF is evaluated once at each grid point, and "
+             "the image is used for all sources within half the spacing of it.")
+    )
+    psfCacheCapacity = Field(
+        dtype=int,
+        default=1000,
+        check=lambda x: x > 0,
+        doc="Maximum number of PSF images to cache; the least-recently used are evicted"
+    )
+
+
+class CachedPsfMeasurementTask(SingleFrameMeasurementTask):
+    """Single-frame measurement, with the PSF cached at positions snapped to a grid
+
+    Evaluating the PSF of a coadd (a CoaddPsf) is expensive, because it sums the warped PSFs of all the
+    inputs, and the measurement plugins evaluate it at the position of nearly every source. If
+    config.psfCacheGridSize is non-zero, each source is measured with the PSF of the exposure replaced by
+    an image of the PSF at the grid point nearest the source's peak, taken from a PsfImageCache. The
+    numbers of cache hits, misses and evictions are recorded in the task metadata, and are available as
+    psfCacheStats after each run.
+    """
+    ConfigClass = CachedPsfMeasurementConfig
+
+    def __init__(self, *args, **kwargs):
+        SingleFrameMeasurementTask.__init__(self, *args, **kwargs)
+        self.psfCache = None
+        self.psfCacheStats = None
+
+    def runPlugins(self, noiseReplacer, measCat, exposure, beginOrder=None, endOrder=None):
+        """Call the plugins for each source, with the PSF of the exposure cached
+
+        @param noiseReplacer: Object to replace the sources with noise
+        @param measCat: Catalog of sources to measure, sorted by parent
+        @param exposure: Exposure on which to measure
+        @param beginOrder: Beginning execution order (inclusive); None for the beginning
+        @param endOrder: Ending execution order (exclusive); None for the end
+        """
+        self.psfCacheStats = None
+        if self.config.psfCacheGridSize <= 0.0:
+            SingleFrameMeasurementTask.runPlugins(self, noiseReplacer, measCat, exposure,
+                                                  beginOrder=beginOrder, endOrder=endOrder)
+            return
+        self.psfCache = PsfImageCache(exposure.getPsf(), self.config.psfCacheGridSize,
+                                      self.config.psfCacheCapacity)
+        try:
+            SingleFrameMeasurementTask.runPlugins(self, noiseReplacer, measCat, exposure,
+                                                  beginOrder=beginOrder, endOrder=endOrder)
+            self.psfCacheStats = self.psfCache.getStats()
+            self.recordPsfCacheStats(self.psfCacheStats)
+        finally:
+            self.psfCache = None
+
+    def callMeasure(self, measRecord, *args, **kwds):
+        """Call the plugins for a source, with the PSF of the exposure taken from the cache
+
+        The PSF is evaluated at the grid point nearest the first peak of the source's footprint; sources
+        without peaks are measured with the original PSF.
+
+        @param measRecord: Record of the source to measure
+        @param args: Positional arguments for the plugins, starting with the exposure
+        @param kwds: Keyword arguments for the plugins
+        """
+        footprint = measRecord.getFootprint()
+        if self.psfCache is None or footprint is None or len(footprint.getPeaks()) == 0:
+            SingleFrameMeasurementTask.callMeasure(self, measRecord, *args, **kwds)
+            return
+        exposure = args[0]
+        psf = exposure.getPsf()
+        exposure.setPsf(self.psfCache.get(footprint.getPeaks()[0].getF()))
+        try:
+            SingleFrameMeasurementTask.callMeasure(self, measRecord, *args, **kwds)
+        finally:
+            exposure.setPsf(psf)
+
+    def recordPsfCacheStats(self, stats):
+        """Record the statistics of the PSF cache in the metadata
+
+        @param stats: Struct with the number of hits, misses and evictions
+        """
+        total = stats.hits + stats.misses
+        self.log.info("PSF cache: %d hits, %d misses (hit rate %.3f), %d evictions" %
+                      (stats.hits, stats.misses, stats.hits/total if total > 0 else 0.0, stats.evictions))
+        self.metadata.set("psfCacheHits", stats.hits)
+        self.metadata.set("psfCacheMisses", stats.misses)
+        self.metadata.set("psfCacheEvictions", stats.evictions)
@@ -37,6 +37,7 @@ from lsst.meas.base import (SingleFrameMeasurementTask, ApplyApCorrTask,
 from lsst.meas.deblender import SourceDeblendTask
 from .fakes import BaseFakeSourcesTask
 from .photoCal import PhotoCalTask
+from .selectImages import PsfQualityConfig, computePsfQuality, setPsfQualityMetadata, setPsfSizeMetadata
 
 __all__ = ["CalibrateConfig", "CalibrateTask"]
 
@@ -167,6 +168,17 @@ class CalibrateConfig(pexConfig.Config):
             "retargeted)"
     )
 
+    doPsfQualitySummary = pexConfig.Field(
+        dtype=bool,
+        default=True,
+        doc="Record a summary of the PSF model size and quality in the calexp metadata, for use by "
+            "image selection?"
+    )
+    psfQuality = pexConfig.ConfigField(
+        dtype=PsfQualityConfig,
+        doc="Columns used to summarise the quality of the PSF model"
+    )
+
     def setDefaults(self):
         pexConfig.Config.setDefaults(self)
         # aperture correction should already be measured
@@ -582,6 +594,9 @@ class CalibrateTask(pipeBase.CmdLineTask):
                 self.copyIcSourceFields(icSourceCat=icSourceCat,
                                         sourceCat=sourceCat)
 
+        if self.config.doPsfQualitySummary:
+            self.setPsfQualityMetadata(exposure=exposure, sourceCat=sourceCat)
+
         frame = getDebugFrame(self._display, "calibrate")
         if frame:
             displayAstrometry(
@@ -662,6 +677,38 @@ class CalibrateTask(pipeBase.CmdLineTask):
         except Exception as e:
             self.log.warn("Could not set exposure metadata: %s" % (e,))
 
+    def setPsfQualityMetadata(self, exposure, sourceCat):
+        """!Record a summary of the PSF model size and quality in the exposure metadata
+
+        The size of the PSF model is used by BestSeeingWcsSelectImagesTask,
+        and the quality summary (see
+        lsst.pipe.tasks.selectImages.computePsfQuality) by
+        PsfWcsSelectImagesTask, which can then avoid reading the calexp and
+        source catalog. Continues without recording the quality summary if it
+        cannot be computed (e.g., the PSF star flags are not present).
+
+        @param[in,out] exposure  exposure whose metadata is to be set
+        @param[in] sourceCat  catalog of measured sources
+        """
+        if exposure.getPsf() is not None:
+            try:
+                setPsfSizeMetadata(exposure.getMetadata(), exposure.getPsf())
+            except Exception as e:
+                self.log.warn("Unable to record PSF size: %s" % (e,))
+
+        config = self.config.psfQuality
+        try:
+            quality = computePsfQuality(sourceCat, config.starSelection, config.starShape, config.psfShape)
+        except Exception as e:
+            self.log.info("Not recording PSF quality summary: %s" % (e,))
+            return
+        if not all(math.isfinite(value) for value in (quality.medianE, quality.scatterSize,
+                                                      quality.scaledScatterSize)):
+            self.log.warn("PSF quality summary is not finite; not recording it")
+            return
+        setPsfQualityMetadata(exposure.getMetadata(), quality, config.starSelection, config.starShape,
+                              config.psfShape)
+
     def copyIcSourceFields(self, icSourceCat, sourceCat):
         """!Match sources in icSourceCat and sourceCat and copy the specified fields
 
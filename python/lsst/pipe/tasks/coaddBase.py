@@ -19,6 +19,10 @@
 # the GNU General Public License along with this program.  If not,
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
 import lsst.pex.config as pexConfig
 import lsst.afw.geom as afwGeom
 import lsst.afw.image as afwImage
@@ -29,6 +33,7 @@ from lsst.afw.fits import FitsError
 from lsst.coadd.utils import CoaddDataIdContainer
 from .selectImages import WcsSelectImagesTask, SelectStruct
 from .coaddInputRecorder import CoaddInputRecorderTask
+from .coaddHelpers import writeFileAtomically
 from .scaleVariance import ScaleVarianceTask
 
 try:
@@ -81,6 +86,20 @@ class CoaddBaseConfig(pexConfig.Config):
         default=21,
         check=lambda x: x % 2 == 1
     )
+    numSelectHeaderThreads = pexConfig.RangeField(
+        dtype=int,
+        doc="Number of threads with which to read the headers of the --selectId inputs",
+        default=1,
+        min=1,
+    )
+    selectHeaderCache = pexConfig.Field(
+        dtype=str,
+        doc="Name of file in which to cache the Wcs and bbox of the --selectId inputs between "
+            "invocations; entries are invalidated when the modification time of the calexp changes. "
+            "If None, no cache is used.",
+        default=None,
+        optional=True,
+    )
 
 
 class CoaddTaskRunner(pipeBase.TaskRunner):
@@ -236,18 +255,79 @@ class SelectDataIdContainer(pipeBase.DataIdContainer):
     """
 
     def makeDataRefList(self, namespace):
-        """Add a dataList containing useful information for selecting images"""
+        """Add a dataList containing useful information for selecting images
+
+        The headers are read with config.numSelectHeaderThreads threads. If
+        config.selectHeaderCache is set, the Wcs and bbox of each input are
+        taken from that cache when the calexp has not been modified since it
+        was cached, and the cache is updated with any headers that were read.
+        """
         super(SelectDataIdContainer, self).makeDataRefList(namespace)
-        self.dataList = []
-        for ref in self.refList:
+        numThreads = getattr(namespace.config, "numSelectHeaderThreads", 1)
+        cacheFile = getattr(namespace.config, "selectHeaderCache", None)
+        cache = _readSelectHeaderCache(cacheFile) if cacheFile else {}
+        updates = {}
+
+        def readHeader(ref):
+            """Return a SelectStruct for a data reference, or None if the header is unusable"""
+            key = tuple(sorted(ref.dataId.items()))
+            mtime = None
+            if cacheFile:
+                filename = ref.get("calexp_filename")[0]
+                try:
+                    mtime = os.stat(filename).st_mtime
+                except OSError:
+                    mtime = None
+                entry = cache.get(key)
+                if entry is not None and mtime is not None and entry["mtime"] == mtime:
+                    x0, y0, width, height = entry["bbox"]
+                    bbox = afwGeom.Box2I(afwGeom.Point2I(x0, y0), afwGeom.Extent2I(width, height))
+                    return SelectStruct(dataRef=ref, wcs=afwGeom.SkyWcs.readString(entry["wcs"]), bbox=bbox)
             try:
                 md = ref.get("calexp_md", immediate=True)
                 wcs = afwGeom.makeSkyWcs(md)
-                data = SelectStruct(dataRef=ref, wcs=wcs, bbox=afwImage.bboxFromMetadata(md))
-            except FitsError as e:
+                bbox = afwImage.bboxFromMetadata(md)
+            except FitsError:
                 namespace.log.warn("Unable to construct Wcs from %s" % (ref.dataId))
-                continue
-            self.dataList.append(data)
+                return None
+            if mtime is not None:
+                updates[key] = dict(mtime=mtime, wcs=wcs.writeString(),
+                                    bbox=(bbox.getMinX(), bbox.getMinY(), bbox.getWidth(), bbox.getHeight()))
+            return SelectStruct(dataRef=ref, wcs=wcs, bbox=bbox)
+
+        if numThreads > 1:
+            with ThreadPoolExecutor(max_workers=numThreads) as executor:
+                results = list(executor.map(readHeader, self.refList))
+        else:
+            results = [readHeader(ref) for ref in self.refList]
+        self.dataList = [data for data in results if data is not None]
+
+        if updates:
+            cache.update(updates)
+            _writeSelectHeaderCache(cacheFile, cache)
+
+
+def _readSelectHeaderCache(filename):
+    """Read the cache of input headers written by _writeSelectHeaderCache
+
+    @param[in] filename  name of cache file
+    @return dict of <sorted dataId items>: <dict with mtime, wcs, bbox>; empty if the cache is unreadable
+    """
+    try:
+        with open(filename, "rb") as fd:
+            return pickle.load(fd)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+        return {}
+
+
+def _writeSelectHeaderCache(filename, cache):
+    """Atomically write the cache of input headers
+
+    @param[in] filename  name of cache file
+    @param[in] cache     dict of <sorted dataId items>: <dict with mtime, wcs, bbox>
+    """
+    writeFileAtomically(filename,
+                        lambda outFile: pickle.dump(cache, outFile, protocol=pickle.HIGHEST_PROTOCOL))
 
 
 def getSkyInfo(coaddName, patchRef):
@@ -19,6 +19,12 @@
 # the GNU General Public License along with this program.  If not,
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
+import hashlib
+import io
+import json
+import os
+import tempfile
+
 from lsst.pipe.base import Struct
 
 """Helper functions for coaddition.
@@ -107,3 +113,119 @@ def getGroupDataRef(butler, datasetType, groupTuple, keys):
     """
     dataId = getGroupDataId(groupTuple, keys)
     return butler.dataRef(datasetType=datasetType, dataId=dataId)
+
+
+def writeFileAtomically(filename, writeContents, binary=True):
+    """Write a file atomically.
+
+    The contents are written to a temporary file in the same directory, which
+    is flushed to disk and then renamed to the target, so that readers see
+    either the old or the new contents of the file, never a partial file.
+
+    @param filename: Name of file to write; its directory is created if necessary
+    @param writeContents: Callable that writes the contents to the file object it is passed
+    @param binary: Write in binary mode?
+    """
+    dirname = os.path.dirname(filename) or "."
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    fd, tmpName = tempfile.mkstemp(dir=dirname, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb" if binary else "w") as outFile:
+            writeContents(outFile)
+            outFile.flush()
+            os.fsync(outFile.fileno())
+        os.rename(tmpName, filename)
+    except Exception:
+        os.unlink(tmpName)
+        raise
+
+
+def getConfigHash(config):
+    """Return a hash of a config that changes whenever any config value changes
+
+    @param config: Config to hash (lsst.pex.config.Config)
+    @return hexadecimal digest string
+    """
+    stream = io.StringIO()
+    config.saveToStream(stream)
+    return hashlib.md5(stream.getvalue().encode()).hexdigest()
+
+
+class WarpManifest:
+    """Record of the warps that have been completely written for a patch
+
+    The manifest is a small JSON file, written atomically (write to a
+    temporary file in the same directory, then rename) after each warp has
+    been persisted.  An entry therefore guarantees that the warp was written
+    in full, unlike a bare existence check, which cannot distinguish a good
+    warp from one truncated by a killed job.  Each entry records the warp
+    data identifier, the data identifiers of its inputs, the datasets written
+    and a hash of the configuration used, so that stale entries can be
+    recognised and the warp redone.
+    """
+
+    def __init__(self, filename, entries=None):
+        """Construct
+
+        @param filename: Path of the manifest file
+        @param entries: Dict of <warp key>: <entry dict>, or None for an empty manifest
+        """
+        self.filename = filename
+        self.entries = entries if entries is not None else {}
+
+    @classmethod
+    def read(cls, filename):
+        """Read a manifest from file
+
+        A missing or unreadable file yields an empty manifest.
+
+        @param filename: Path of the manifest file
+        @return WarpManifest
+        """
+        try:
+            with open(filename) as fd:
+                entries = json.load(fd)
+        except (IOError, OSError, ValueError):
+            entries = None
+        return cls(filename, entries)
+
+    @staticmethod
+    def makeKey(dataId):
+        """Return a string key for a data identifier"""
+        return json.dumps(dict(dataId), sort_keys=True, default=str)
+
+    @staticmethod
+    def makeInputs(dataRefList):
+        """Return a canonical list of input data identifiers"""
+        return sorted(WarpManifest.makeKey(dataRef.dataId) for dataRef in dataRefList)
+
+    def isComplete(self, dataId, inputs, configHash):
+        """Is the warp recorded as complete and up-to-date?
+
+        @param dataId: Data identifier of the warp
+        @param inputs: List of input keys, from makeInputs
+        @param configHash: Hash of the current config, from getConfigHash
+        @return True if the warp was written with the same inputs and config
+        """
+        entry = self.entries.get(self.makeKey(dataId))
+        if entry is None:
+            return False
+        return entry["inputs"] == inputs and entry["configHash"] == configHash
+
+    def add(self, dataId, inputs, configHash, datasets):
+        """Record a completed warp and write the manifest
+
+        @param dataId: Data identifier of the warp
+        @param inputs: List of input keys, from makeInputs
+        @param configHash: Hash of the config used, from getConfigHash
+        @param datasets: List of dataset types written for this warp
+        """
+        self.entries[self.makeKey(dataId)] = dict(inputs=inputs, configHash=configHash,
+                                                  datasets=list(datasets))
+        self.write()
+
+    def write(self):
+        """Write the manifest atomically"""
+        writeFileAtomically(self.filename, lambda outFile: json.dump(self.entries, outFile, sort_keys=True),
+                            binary=False)
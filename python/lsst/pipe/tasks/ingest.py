@@ -1,15 +1,18 @@
+import collections
 import os
 import shutil
 import tempfile
 import sqlite3
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from fnmatch import fnmatch
-from glob import glob
+from glob import iglob, has_magic
 from contextlib import contextmanager
 
 from lsst.pex.config import Config, Field, DictField, ListField, ConfigurableField
 import lsst.pex.exceptions
-from lsst.afw.fits import readMetadata
-from lsst.pipe.base import Task, InputOnlyArgumentParser
+from lsst.afw.fits import readMetadata, Fits
+from lsst.pipe.base import Task, Struct, InputOnlyArgumentParser
 from lsst.afw.fits import DEFAULT_HDU
 
 
@@ -63,25 +66,47 @@ class ParseTask(Task):
             # No extensions to worry about
             return phuInfo, [phuInfo]
         # Look in the provided extensions
-        extnames = set(self.config.extnames)
-        extnum = 0
         infoList = []
-        while len(extnames) > 0:
-            extnum += 1
-            try:
-                md = readMetadata(filename, extnum)
-            except Exception as e:
-                self.log.warn("Error reading %s extensions %s: %s" % (filename, extnames, e))
-                break
-            ext = self.getExtensionName(md)
-            if ext in extnames:
-                hduInfo = self.getInfoFromMetadata(md, info=phuInfo.copy())
-                # We need the HDU number when registering MEF files.
-                hduInfo["hdu"] = extnum
-                infoList.append(hduInfo)
-                extnames.discard(ext)
+        for extnum, md in self.readExtensionMetadata(filename, self.config.extnames):
+            hduInfo = self.getInfoFromMetadata(md, info=phuInfo.copy())
+            # We need the HDU number when registering MEF files.
+            hduInfo["hdu"] = extnum
+            infoList.append(hduInfo)
         return phuInfo, infoList
 
+    def readExtensionMetadata(self, filename, extnames):
+        """Read the headers of the named extensions of a file
+
+        The file is opened once, and the extension headers are read in turn
+        until all the named extensions have been found, rather than opening
+        the file again for each extension.
+
+        @param filename    Name of file to inspect
+        @param extnames    Names of extensions to find
+        @return list of (HDU number, FITS header) for the extensions found, in HDU order
+        """
+        extnames = set(extnames)
+        found = []
+        fits = Fits(filename, "r")
+        try:
+            numHdus = fits.countHdus()
+            for extnum in range(1, numHdus):
+                if len(extnames) == 0:
+                    break
+                fits.setHdu(extnum)
+                md = readMetadata(fits)
+                ext = self.getExtensionName(md)
+                if ext in extnames:
+                    found.append((extnum, md))
+                    extnames.discard(ext)
+        except Exception as e:
+            self.log.warn("Error reading %s extensions %s: %s" % (filename, extnames, e))
+        finally:
+            fits.closeFile()
+        if len(extnames) > 0:
+            self.log.warn("Unable to find extensions %s in %s" % (extnames, filename))
+        return found
+
     @staticmethod
     def getExtensionName(md):
         """ Get the name of an extension.
@@ -193,48 +218,90 @@ class RegisterConfig(Config):
                       doc="List of columns for raw_visit table")
     ignore = Field(dtype=bool, default=False, doc="Ignore duplicates in the table?")
     permissions = Field(dtype=int, default=0o664, doc="Permissions mode for registry; 0o664 = rw-rw-r--")
+    batchSize = Field(dtype=int, default=10000, check=lambda x: x > 0,
+                      doc="Number of rows to accumulate before inserting them into the registry together")
+    inPlace = Field(dtype=bool, default=False,
+                    doc="Update an existing registry in place, within a single transaction and using a "
+                        "write-ahead log, rather than updating a copy and renaming it over the original? "
+                        "This avoids copying large registries, but the registry directory must be writable "
+                        "and on a filesystem that supports sqlite locking (not NFS).")
+    manifest = Field(dtype=bool, default=True,
+                     doc="Record the path, size and modification time of each file ingested in a manifest "
+                         "table, so that unchanged files may be skipped without being read when ignoring "
+                         "files already ingested?")
 
 
 class RegistryContext:
     """Context manager to provide a registry
 
-    An existing registry is copied, so that it may continue
+    By default, an existing registry is copied, so that it may continue
     to be used while we add to this new registry.  Finally,
     the new registry is moved into the right place.
+
+    Alternatively (inPlace=True), the registry is updated in place: all
+    changes are made in a single transaction, which is committed only if
+    the context exits without an exception, and otherwise rolled back.
+    This relies on sqlite's own atomicity for crash safety, and avoids
+    copying the entire registry. The write-ahead log journal is used while
+    updating, so that readers are not blocked.
     """
 
-    def __init__(self, registryName, createTableFunc, forceCreateTables, permissions):
+    def __init__(self, registryName, createTableFunc, forceCreateTables, permissions, inPlace=False,
+                 updateTableFunc=None):
         """Construct a context manager
 
         @param registryName: Name of registry file
         @param createTableFunc: Function to create tables
         @param forceCreateTables: Force the (re-)creation of tables?
         @param permissions: Permissions to set on database file
+        @param inPlace: Update the registry in place, rather than a copy?
+        @param updateTableFunc: Function to bring existing tables up to date (e.g., add indexes), or None
         """
         self.registryName = registryName
         self.permissions = permissions
+        self.inPlace = inPlace
 
-        updateFile = tempfile.NamedTemporaryFile(prefix=registryName, dir=os.path.dirname(self.registryName),
-                                                 delete=False)
-        self.updateName = updateFile.name
-
-        haveTable = False
-        if os.path.exists(registryName):
-            assertCanCopy(registryName, self.updateName)
-            os.chmod(self.updateName, os.stat(registryName).st_mode)
-            shutil.copyfile(registryName, self.updateName)
-            haveTable = True
-
-        self.conn = sqlite3.connect(self.updateName)
+        if inPlace:
+            haveTable = os.path.exists(registryName)
+            self.updateName = registryName
+            self.conn = sqlite3.connect(registryName)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        else:
+            updateFile = tempfile.NamedTemporaryFile(prefix=registryName,
+                                                     dir=os.path.dirname(self.registryName), delete=False)
+            self.updateName = updateFile.name
+
+            haveTable = False
+            if os.path.exists(registryName):
+                assertCanCopy(registryName, self.updateName)
+                os.chmod(self.updateName, os.stat(registryName).st_mode)
+                shutil.copyfile(registryName, self.updateName)
+                haveTable = True
+
+            self.conn = sqlite3.connect(self.updateName)
         if not haveTable or forceCreateTables:
             createTableFunc(self.conn)
-        os.chmod(self.updateName, self.permissions)
+        elif updateTableFunc is not None:
+            updateTableFunc(self.conn)
+        if not haveTable or not inPlace:
+            os.chmod(self.updateName, self.permissions)
 
     def __enter__(self):
         """Provide the 'as' value"""
         return self.conn
 
     def __exit__(self, excType, excValue, traceback):
+        if self.inPlace:
+            if excType is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+            # Return to the default journal, so the registry may be read without write access;
+            # this is a no-op if other connections are open.
+            self.conn.execute("PRAGMA journal_mode=DELETE")
+            self.conn.close()
+            return False  # Don't suppress any exceptions
+
         self.conn.commit()
         self.conn.close()
         if excType is None:
@@ -260,6 +327,7 @@ class RegisterTask(Task):
     ConfigClass = RegisterConfig
     placeHolder = '?'  # Placeholder for parameter substitution; this value suitable for sqlite3
     typemap = {'text': str, 'int': int, 'double': float}  # Mapping database type --> python type
+    visitChunkSize = 500  # Number of visits per statement when updating the visit table
 
     def openRegistry(self, directory, create=False, dryrun=False, name="registry.sqlite3"):
         """Open the registry and return the connection handle.
@@ -274,7 +342,8 @@ class RegisterTask(Task):
             return fakeContext()
 
         registryName = os.path.join(directory, name)
-        context = RegistryContext(registryName, self.createTable, create, self.config.permissions)
+        context = RegistryContext(registryName, self.createTable, create, self.config.permissions,
+                                  inPlace=self.config.inPlace, updateTableFunc=self.updateTables)
         return context
 
     def createTable(self, conn, table=None):
@@ -301,8 +370,92 @@ class RegisterTask(Task):
         cmd += ")"
         conn.cursor().execute(cmd)
 
+        self.createIndexes(conn, table=table)
+        if self.config.manifest:
+            self.createManifest(conn, table=table)
+        conn.commit()
+
+    def updateTables(self, conn):
+        """Bring the tables of an existing registry up to date
+
+        This adds any indexes and tables that were introduced after the
+        registry was created.
+
+        @param conn    Database connection
+        """
+        self.createIndexes(conn)
+        if self.config.manifest:
+            self.createManifest(conn)
+
+    def createIndexes(self, conn, table=None):
+        """Create the indexes supporting registry updates
+
+        The unique constraint on the file table already provides an index on
+        the unique columns, which serves the duplicate checks. Here we add
+        an index on the visit column, which serves the update of the visit
+        table. Existing indexes are left untouched, so this also serves to
+        migrate registries created before the index was added.
+
+        @param conn    Database connection
+        @param table   Name of table in database
+        """
+        if table is None:
+            table = self.config.table
+        if "visit" in self.config.columns:
+            conn.cursor().execute("CREATE INDEX IF NOT EXISTS %s_visit_idx ON %s (visit)" % (table, table))
+        conn.commit()
+
+    def createManifest(self, conn, table=None):
+        """Create the manifest table (typically 'raw_manifest'), if not already present
+
+        The manifest records the path, size and modification time of each
+        file ingested.
+
+        @param conn    Database connection
+        @param table   Name of file table in database
+        """
+        if table is None:
+            table = self.config.table
+        conn.cursor().execute("CREATE TABLE IF NOT EXISTS %s_manifest "
+                              "(path TEXT PRIMARY KEY, size BIGINT, mtime DOUBLE PRECISION)" % table)
         conn.commit()
 
+    def readManifest(self, conn, table=None):
+        """Read the manifest of files ingested
+
+        @param conn    Database connection
+        @param table   Name of file table in database
+        @return Dict of <path>: <(size, mtime)>
+        """
+        if table is None:
+            table = self.config.table
+        cursor = conn.cursor()
+        cursor.execute("SELECT path, size, mtime FROM %s_manifest" % table)
+        return {path: (size, mtime) for path, size, mtime in cursor.fetchall()}
+
+    def getManifestInsertSql(self, table):
+        """Return the SQL statement for recording a file in the manifest
+
+        @param table   Name of file table in database
+        @return SQL statement with placeholders for the path, size and mtime
+        """
+        return "INSERT OR REPLACE INTO %s_manifest (path, size, mtime) VALUES (%s)" % (
+            table, ",".join([self.placeHolder] * 3))
+
+    def addManifest(self, conn, entries, dryrun=False, table=None):
+        """Record files in the manifest
+
+        @param conn    Database connection
+        @param entries  List of (path, size, mtime) for the files
+        @param dryrun  Don't do anything permanent?
+        @param table   Name of file table in database
+        """
+        if table is None:
+            table = self.config.table
+        if dryrun or len(entries) == 0:
+            return
+        conn.cursor().executemany(self.getManifestInsertSql(table), entries)
+
     def check(self, conn, info, table=None):
         """Check for the presence of a row already
 
@@ -322,6 +475,19 @@ class RegisterTask(Task):
             return True
         return False
 
+    def getUniqueKey(self, info):
+        """Return the values of the unique columns for a row
+
+        This identifies rows that check would report as duplicates, so that
+        rows that have not yet been added to the registry may be checked too.
+
+        @param info    File properties
+        @return tuple of the values of the unique columns, or None if duplicates are not checked
+        """
+        if self.config.ignore or len(self.config.unique) == 0:
+            return None
+        return tuple(self.typemap[self.config.columns[col]](info[col]) for col in self.config.unique)
+
     def addRow(self, conn, info, dryrun=False, create=False, table=None):
         """Add a row to the file table (typically 'raw').
 
@@ -329,29 +495,53 @@ class RegisterTask(Task):
         @param info    File properties to add to database
         @param table   Name of table in database
         """
-        if table is None:
-            table = self.config.table
-        sql = "INSERT INTO %s (%s) SELECT " % (table, ",".join(self.config.columns))
+        self.addRows(conn, [info], dryrun=dryrun, create=create, table=table)
+
+    def getInsertSql(self, table):
+        """Return the SQL statement for inserting a row into the file table
+
+        If the 'ignore' configuration option is set, rows that duplicate
+        the unique columns of an existing row are silently skipped.
+
+        @param table   Name of table in database
+        @return SQL statement with placeholders for the values of all columns
+        """
+        sql = "INSERT OR IGNORE" if self.config.ignore else "INSERT"
+        sql += " INTO %s (%s) VALUES (" % (table, ",".join(self.config.columns))
         sql += ",".join([self.placeHolder] * len(self.config.columns))
-        values = [self.typemap[tt](info[col]) for col, tt in self.config.columns.items()]
+        sql += ")"
+        return sql
 
-        if self.config.ignore:
-            sql += " WHERE NOT EXISTS (SELECT 1 FROM %s WHERE " % table
-            sql += " AND ".join(["%s=%s" % (col, self.placeHolder) for col in self.config.unique])
-            sql += ")"
-            values += [info[col] for col in self.config.unique]
+    def addRows(self, conn, infoList, dryrun=False, create=False, table=None):
+        """Add many rows to the file table (typically 'raw') in bulk.
 
+        This is equivalent to calling addRow for each row, but the rows are
+        inserted with a single statement execution.
+
+        @param conn    Database connection
+        @param infoList  List of file properties to add to database
+        @param table   Name of table in database
+        """
+        if table is None:
+            table = self.config.table
+        if len(infoList) == 0:
+            return
+        sql = self.getInsertSql(table)
+        valuesList = [[self.typemap[tt](info[col]) for col, tt in self.config.columns.items()] for
+                      info in infoList]
         if dryrun:
-            print("Would execute: '%s' with %s" % (sql, ",".join([str(value) for value in values])))
+            for values in valuesList:
+                print("Would execute: '%s' with %s" % (sql, ",".join([str(value) for value in values])))
         else:
-            conn.cursor().execute(sql, values)
+            conn.cursor().executemany(sql, valuesList)
 
-    def addVisits(self, conn, dryrun=False, table=None):
+    def addVisits(self, conn, dryrun=False, table=None, visits=None):
         """Generate the visits table (typically 'raw_visits') from the
         file table (typically 'raw').
 
         @param conn    Database connection
         @param table   Name of table in database
+        @param visits  Visits to add (e.g., those touched by the current ingest), or None for all visits
         """
         if table is None:
             table = self.config.table
@@ -360,10 +550,23 @@ class RegisterTask(Task):
         sql += " FROM %s AS vv1" % table
         sql += " WHERE NOT EXISTS "
         sql += "(SELECT vv2.visit FROM %s_visit AS vv2 WHERE vv1.visit = vv2.visit)" % (table,)
-        if dryrun:
-            print("Would execute: %s" % sql)
-        else:
-            conn.cursor().execute(sql)
+        if visits is None:
+            if dryrun:
+                print("Would execute: %s" % sql)
+            else:
+                conn.cursor().execute(sql)
+            return
+
+        visitType = self.typemap[self.config.columns["visit"]]
+        visits = sorted(set(visitType(visit) for visit in visits))
+        # Chunk the list of visits to stay within the database's limit on the number of parameters
+        for start in range(0, len(visits), self.visitChunkSize):
+            values = visits[start:start + self.visitChunkSize]
+            chunkSql = sql + " AND vv1.visit IN (%s)" % ",".join([self.placeHolder] * len(values))
+            if dryrun:
+                print("Would execute: '%s' with %s" % (chunkSql, ",".join([str(value) for value in values])))
+            else:
+                conn.cursor().execute(chunkSql, values)
 
 
 class IngestConfig(Config):
@@ -372,6 +575,10 @@ class IngestConfig(Config):
     register = ConfigurableField(target=RegisterTask, doc="Registry entry")
     allowError = Field(dtype=bool, default=False, doc="Allow error in ingestion?")
     clobber = Field(dtype=bool, default=False, doc="Clobber existing file?")
+    transferThreads = Field(dtype=int, default=1, check=lambda x: x > 0,
+                            doc="Number of threads with which to deliver (copy/move/link) files to the "
+                                "repository, concurrently with examining further files; 1 delivers each "
+                                "file as soon as it has been examined.")
 
 
 class IngestTask(Task):
@@ -466,71 +673,422 @@ class IngestTask(Task):
                 return True
         return False
 
-    def expandFiles(self, fileNameList):
-        """!Expand a set of filenames and globs, returning a list of filenames
+    def expandFiles(self, fileNameList, badFileList=None):
+        """!Expand a set of filenames and globs, yielding filenames as they are found
 
         @param fileNameList A list of files and glob patterns
+        @param badFileList List of bad file patterns; matching files are skipped as they are found
+
+        Recursive patterns, in which "**" matches any number of directories,
+        are expanded by walking the directory tree (see iterRecursiveGlob),
+        so that files may be processed before the walk is complete.
 
         N.b. globs obey Posix semantics, so a pattern that matches nothing is returned unchanged
         """
-        filenameList = []
         for globPattern in fileNameList:
-            files = glob(globPattern)
+            if "**" in globPattern:
+                files = iterRecursiveGlob(globPattern)
+            else:
+                files = iglob(globPattern)
 
-            if not files:               # posix behaviour is to return pattern unchanged
-                self.log.warn("%s doesn't match any file" % globPattern)
-                continue
+            found = False
+            for filename in files:
+                found = True
+                if self.isBadFile(filename, badFileList):
+                    self.log.info("Skipping declared bad file %s" % filename)
+                    continue
+                yield filename
 
-            filenameList.extend(files)
+            if not found:               # posix behaviour is to return pattern unchanged
+                self.log.warn("%s doesn't match any file" % globPattern)
 
-        return filenameList
+    def prepareFile(self, infile, butler, badFileList=None, badIdList=None):
+        """!Examine a single file and determine its destination
 
-    def runFile(self, infile, registry, args):
-        """!Examine and ingest a single file
+        This neither touches the registry nor delivers the file, so it may
+        be run in parallel for many files.
 
         @param infile: File to process
-        @param args: Parsed command-line arguments
-        @return parsed information from FITS HDUs or None
+        @param butler: Data butler
+        @param badFileList: List of bad file patterns
+        @param badIdList: List of bad data identifiers
+        @return Struct with infile, fileInfo, hduInfoList, outfile, manifestEntry (path, size, mtime);
+            or None if the file is to be skipped
         """
-        if self.isBadFile(infile, args.badFile):
+        if self.isBadFile(infile, badFileList):
             self.log.info("Skipping declared bad file %s" % infile)
             return None
         try:
+            stat = os.stat(infile)  # before delivery, which may move the file
             fileInfo, hduInfoList = self.parse.getInfo(infile)
         except Exception as e:
             if not self.config.allowError:
                 raise
             self.log.warn("Error parsing %s (%s); skipping" % (infile, e))
             return None
-        if self.isBadId(fileInfo, args.badId.idList):
+        if self.isBadId(fileInfo, badIdList):
             self.log.info("Skipping declared bad file %s: %s" % (infile, fileInfo))
-            return
-        if registry is not None and self.register.check(registry, fileInfo):
+            return None
+        outfile = self.parse.getDestination(butler, fileInfo, infile)
+        return Struct(infile=infile, fileInfo=fileInfo, hduInfoList=hduInfoList, outfile=outfile,
+                      manifestEntry=(os.path.abspath(infile), stat.st_size, stat.st_mtime))
+
+    def skipIngested(self, filenameList, manifest):
+        """!Skip files recorded in the manifest, if they are unchanged
+
+        A file is considered unchanged if its size and modification time
+        match those recorded when it was ingested. Only the file's status
+        is examined; it is not opened.
+
+        @param filenameList: Iterable of files to process
+        @param manifest: Dict of <path>: <(size, mtime)>, from RegisterTask.readManifest
+        @return generator of files not already ingested
+        """
+        for infile in filenameList:
+            entry = manifest.get(os.path.abspath(infile))
+            if entry is not None:
+                try:
+                    stat = os.stat(infile)
+                except OSError:
+                    stat = None
+                if stat is not None and entry == (stat.st_size, stat.st_mtime):
+                    self.log.info("Skipping %s: already ingested" % infile)
+                    continue
+            yield infile
+
+    def prepareFiles(self, filenameList, args):
+        """!Examine files and determine their destinations
+
+        With more than one process (--processes), the files are examined by a
+        pool of worker processes; results are nevertheless returned in the
+        order of the input files. Files are drawn from filenameList only as
+        the workers need them (at most four per process are in flight), so a
+        lazy iterable is not exhausted ahead of the examination.
+
+        @param filenameList: Iterable of files to process
+        @param args: Parsed command-line arguments
+        @return generator of (infile, result of prepareFile, error message or None)
+        """
+        badIdList = args.badId.idList
+        processes = getattr(args, "processes", 1)
+        if processes > 1:
+            pool = multiprocessing.Pool(processes, _initPrepareWorker,
+                                        (self, args.butler, args.badFile, badIdList))
+            maxInFlight = 4*processes
+            pending = collections.deque()  # AsyncResult of each file, in input order
+            try:
+                for infile in filenameList:
+                    pending.append(pool.apply_async(_prepareFileInWorker, (infile,)))
+                    while pending and (len(pending) > maxInFlight or pending[0].ready()):
+                        yield pending.popleft().get()
+                while pending:
+                    yield pending.popleft().get()
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            for infile in filenameList:
+                try:
+                    yield infile, self.prepareFile(infile, args.butler, args.badFile, badIdList), None
+                except Exception as exc:
+                    yield infile, None, str(exc)
+
+    def checkPrepared(self, prepared, registry, args, staged=None, inFlight=None):
+        """!Check the registry for a file examined by prepareFile
+
+        @param prepared: Result of prepareFile
+        @param registry: Registry connection, or None
+        @param args: Parsed command-line arguments
+        @param staged: Set of unique keys (see RegisterTask.getUniqueKey) of rows staged for
+            the registry but not yet added, or None
+        @param inFlight: Collection of unique keys of files being delivered, whose rows are
+            not yet staged, or None
+        @return whether the file should be delivered
+        """
+        if self.isIngested(prepared.fileInfo, registry, staged, inFlight):
             if args.ignoreIngested:
-                return None
-            self.log.warn("%s: already ingested: %s" % (infile, fileInfo))
-        outfile = self.parse.getDestination(args.butler, fileInfo, infile)
-        if not self.ingest(infile, outfile, mode=args.mode, dryrun=args.dryrun):
+                return False
+            self.log.warn("%s: already ingested: %s" % (prepared.infile, prepared.fileInfo))
+        return True
+
+    def isIngested(self, info, registry, staged=None, inFlight=None):
+        """!Return whether a row is in the registry, or staged to be added to it
+
+        @param info: File properties
+        @param registry: Registry connection, or None
+        @param staged: Set of unique keys (see RegisterTask.getUniqueKey) of rows staged for
+            the registry but not yet added, or None
+        @param inFlight: Collection of unique keys of files being delivered, whose rows are
+            not yet staged, or None
+        """
+        if staged or inFlight:
+            key = self.register.getUniqueKey(info)
+            if key is not None and ((staged and key in staged) or (inFlight and key in inFlight)):
+                return True
+        return registry is not None and self.register.check(registry, info)
+
+    def ingestPrepared(self, prepared, registry, args, staged=None):
+        """!Check the registry for, and deliver, a file examined by prepareFile
+
+        @param prepared: Result of prepareFile
+        @param registry: Registry connection, or None
+        @param args: Parsed command-line arguments
+        @param staged: Set of unique keys of rows staged for the registry, or None
+        @return parsed information from FITS HDUs or None
+        """
+        if not self.checkPrepared(prepared, registry, args, staged):
             return None
-        return hduInfoList
+        if not self.ingest(prepared.infile, prepared.outfile, mode=args.mode, dryrun=args.dryrun):
+            return None
+        return prepared.hduInfoList
+
+    def deliverFiles(self, preparedIterable, registry, args, staged=None):
+        """!Check the registry for, and deliver, files examined by prepareFiles
+
+        With more than one transfer thread (config.transferThreads), the files
+        are delivered by a pool of threads while further files are examined.
+        The number of deliveries in flight is bounded, and results are
+        nevertheless returned in the order of the input files. The registry
+        is only used from the calling thread. A file is treated as ingested if
+        a file with the same unique key is being delivered, exactly as if the
+        earlier file's rows had been staged, as they are when delivering
+        serially.
+
+        @param preparedIterable: Iterable of results of prepareFiles
+        @param registry: Registry connection, or None
+        @param args: Parsed command-line arguments
+        @param staged: Set of unique keys of rows staged for the registry, or None
+        @return generator of (infile, result of prepareFile, parsed information from FITS HDUs
+            or None if the file was not delivered, error message or None)
+        """
+        threads = self.config.transferThreads
+        if threads == 1:
+            for infile, prepared, error in preparedIterable:
+                if error is not None or prepared is None:
+                    yield infile, prepared, None, error
+                    continue
+                try:
+                    yield infile, prepared, self.ingestPrepared(prepared, registry, args, staged), None
+                except Exception as exc:
+                    yield infile, prepared, None, str(exc)
+            return
+
+        def finish(transfer):
+            infile, prepared, future, error, key = transfer
+            if future is None:
+                return infile, prepared, None, error
+            try:
+                delivered = future.result()
+            except Exception as exc:
+                return infile, prepared, None, str(exc)
+            return infile, prepared, prepared.hduInfoList if delivered else None, None
+
+        def release(key):
+            if key is not None:
+                inFlight[key] -= 1
+                if inFlight[key] == 0:
+                    del inFlight[key]
+
+        maxInFlight = 2*threads
+        transfers = collections.deque()  # (infile, prepared, future or None, error, key), in input order
+        inFlight = collections.Counter()  # unique keys of files submitted, but not yet returned and staged
+        with ThreadPoolExecutor(threads) as executor:
+            for infile, prepared, error in preparedIterable:
+                future = None
+                key = None
+                if error is None and prepared is not None:
+                    try:
+                        if self.checkPrepared(prepared, registry, args, staged, inFlight):
+                            future = executor.submit(self.ingest, prepared.infile, prepared.outfile,
+                                                     mode=args.mode, dryrun=args.dryrun)
+                            key = self.register.getUniqueKey(prepared.fileInfo)
+                            if key is not None:
+                                inFlight[key] += 1
+                    except Exception as exc:
+                        error = str(exc)
+                transfers.append((infile, prepared, future, error, key))
+                while transfers:
+                    future = transfers[0][2]
+                    if len(transfers) <= maxInFlight and future is not None and not future.done():
+                        break
+                    transfer = transfers.popleft()
+                    yield finish(transfer)
+                    release(transfer[4])  # the caller has staged the rows of the file
+            while transfers:
+                transfer = transfers.popleft()
+                yield finish(transfer)
+                release(transfer[4])
+
+    def runFile(self, infile, registry, args):
+        """!Examine and ingest a single file
+
+        @param infile: File to process
+        @param args: Parsed command-line arguments
+        @return parsed information from FITS HDUs or None
+        """
+        prepared = self.prepareFile(infile, args.butler, args.badFile, args.badId.idList)
+        if prepared is None:
+            return None
+        return self.ingestPrepared(prepared, registry, args)
 
     def run(self, args):
-        """Ingest all specified files and add them to the registry"""
-        filenameList = self.expandFiles(args.files)
+        """Ingest all specified files and add them to the registry
+
+        Files are examined (see prepareFiles) in parallel if more than one
+        process is requested, and delivered (see deliverFiles) by a pool of
+        threads if config.transferThreads is more than one, but only this
+        thread writes to the registry, and it does so in the order of the
+        input files. Rows are added to the registry in batches of
+        register.config.batchSize, and only for files that were delivered.
+
+        Files whose rows duplicate (see RegisterTask.check) rows staged
+        earlier in the same run are treated as already ingested, and the
+        duplicate rows are not added.
+
+        If the register.config.manifest is set, the files ingested are
+        recorded in the registry, and with --ignore-ingested, files recorded
+        there are skipped without being read if they are unchanged.
+        """
+        filenameList = self.expandFiles(args.files, args.badFile)
         root = args.input
+        useManifest = self.register.config.manifest and not args.dryrun
         context = self.register.openRegistry(root, create=args.create, dryrun=args.dryrun)
         with context as registry:
-            for infile in filenameList:
-                try:
-                    hduInfoList = self.runFile(infile, registry, args)
-                except Exception as exc:
-                    self.log.warn("Failed to ingest file %s: %s", infile, exc)
+            if useManifest and args.ignoreIngested:
+                filenameList = self.skipIngested(filenameList, self.register.readManifest(registry))
+            pending = []  # rows to be added to the registry
+            staged = set()  # unique keys of the rows added in this run
+            pendingManifest = []  # files to be recorded in the manifest
+            visits = set() if "visit" in self.register.config.columns else None  # visits touched
+            preparedIterable = self.prepareFiles(filenameList, args)
+            delivered = self.deliverFiles(preparedIterable, registry, args, staged)
+            for infile, prepared, hduInfoList, error in delivered:
+                if error is not None:
+                    self.log.warn("Failed to ingest file %s: %s", infile, error)
                     continue
                 if hduInfoList is None:
                     continue
+                numStaged = 0
                 for info in hduInfoList:
-                    self.register.addRow(registry, info, dryrun=args.dryrun, create=args.create)
-            self.register.addVisits(registry, dryrun=args.dryrun)
+                    key = self.register.getUniqueKey(info)
+                    if key is not None:
+                        if key in staged:
+                            self.log.warn("%s: duplicates a file already ingested in this run; "
+                                          "not registering %s" % (infile, info))
+                            continue
+                        staged.add(key)
+                    pending.append(info)
+                    numStaged += 1
+                if useManifest and numStaged > 0:
+                    # A file whose rows were all dropped as duplicates was not ingested
+                    pendingManifest.append(prepared.manifestEntry)
+                if visits is not None:
+                    visits.update(info["visit"] for info in hduInfoList)
+                if len(pending) >= self.register.config.batchSize:
+                    self.register.addRows(registry, pending, dryrun=args.dryrun, create=args.create)
+                    self.register.addManifest(registry, pendingManifest, dryrun=args.dryrun)
+                    pending = []
+                    pendingManifest = []
+            self.register.addRows(registry, pending, dryrun=args.dryrun, create=args.create)
+            self.register.addManifest(registry, pendingManifest, dryrun=args.dryrun)
+            self.register.addVisits(registry, dryrun=args.dryrun, visits=visits)
+
+
+_prepareWorkerState = None
+
+
+def _initPrepareWorker(task, butler, badFileList, badIdList):
+    """Initialise a worker process for IngestTask.prepareFiles
+
+    @param task: IngestTask to use for examining files
+    @param butler: Data butler
+    @param badFileList: List of bad file patterns
+    @param badIdList: List of bad data identifiers
+    """
+    global _prepareWorkerState
+    _prepareWorkerState = (task, butler, badFileList, badIdList)
+
+
+def _prepareFileInWorker(infile):
+    """Examine a file in a worker process for IngestTask.prepareFiles
+
+    @param infile: File to process
+    @return (infile, result of IngestTask.prepareFile, error message or None)
+    """
+    task, butler, badFileList, badIdList = _prepareWorkerState
+    try:
+        return infile, task.prepareFile(infile, butler, badFileList, badIdList), None
+    except Exception as exc:
+        return infile, None, str(exc)
+
+
+def iterRecursiveGlob(pattern):
+    """Yield the files matching a recursive glob pattern, as they are found
+
+    The directory tree is walked with os.scandir, descending only into
+    directories that can lead to a match. A path component of "**" matches
+    any number (including zero) of directories. As with glob, wildcards do
+    not match names starting with ".". Only files (not directories) are
+    yielded, in sorted order within each directory.
+
+    @param pattern: Glob pattern, e.g., "raw/**/*.fits"
+    @return generator of matching filenames
+    """
+    components = pattern.split(os.sep)
+    # The leading components without wildcards give the directory from which to walk
+    numFixed = 0
+    while numFixed < len(components) - 1 and not has_magic(components[numFixed]):
+        numFixed += 1
+    prefix = os.sep.join(components[:numFixed])
+    if numFixed > 0:
+        prefix += os.sep  # Also covers an absolute path, for which the first component is empty
+    components = components[numFixed:]
+    if not os.path.isdir(prefix or os.curdir):
+        return
+
+    def expand(states):
+        """Add the states reached by "**" matching zero directories"""
+        states = set(states)
+        for ii in sorted(states):
+            while ii < len(components) - 1 and components[ii] == "**":
+                ii += 1
+                states.add(ii)
+        return states
+
+    def match(name, component):
+        if name.startswith(".") and not component.startswith("."):
+            return False
+        return fnmatch(name, component)
+
+    def walk(directory, states):
+        try:
+            with os.scandir(directory or os.curdir) as scanner:
+                entries = sorted(scanner, key=lambda entry: entry.name)
+        except OSError:
+            return
+        for entry in entries:
+            isDir = entry.is_dir()
+            isMatch = False
+            nextStates = set()
+            for ii in states:
+                component = components[ii]
+                if component == "**":
+                    if isDir and not entry.name.startswith("."):
+                        nextStates.add(ii)
+                    if ii == len(components) - 1 and not entry.name.startswith("."):
+                        isMatch = True
+                elif match(entry.name, component):
+                    if ii == len(components) - 1:
+                        isMatch = True
+                    elif isDir:
+                        nextStates.add(ii + 1)
+            path = directory + entry.name
+            if isMatch and not isDir:
+                yield path
+            if isDir and nextStates:
+                yield from walk(path + os.sep, expand(nextStates))
+
+    yield from walk(prefix, expand({0}))
 
 
 def assertCanCopy(fromPath, toPath):
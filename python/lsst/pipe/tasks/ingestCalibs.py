@@ -1,5 +1,6 @@
 import collections
 import datetime
+import itertools
 import sqlite3
 
 from lsst.afw.fits import readMetadata
@@ -74,6 +75,10 @@ class CalibsRegisterConfig(RegisterConfig):
                                         "taken until it is superseded by the next; validity in other tables "
                                         "is calculated by applying the validity range.")
 
+    def setDefaults(self):
+        RegisterConfig.setDefaults(self)
+        self.manifest = False  # IngestCalibsTask does not use the manifest
+
 
 class CalibsRegisterTask(RegisterTask):
     """Task that will generate the calibration registry for the Mapper"""
@@ -88,30 +93,126 @@ class CalibsRegisterTask(RegisterTask):
         for table in self.config.tables:
             RegisterTask.createTable(self, conn, table=table)
 
+    def createIndexes(self, conn, table=None):
+        """Create the indexes supporting registry updates
+
+        In addition to the indexes of the file tables, an index on the
+        detector columns and calibration date serves the update of the
+        validity ranges. When updating all tables, those that do not exist
+        (e.g., in a registry created before the table was configured) are
+        skipped.
+
+        @param conn: Database connection
+        @param table: Name of table in database, or None for all existing tables
+        """
+        cursor = conn.cursor()
+        if table is not None:
+            tables = [table]
+        else:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+            existing = set(row[0] for row in cursor.fetchall())
+            tables = [name for name in self.config.tables if name in existing]
+        for table in tables:
+            RegisterTask.createIndexes(self, conn, table=table)
+            columns = list(self.config.detector) + [self.config.calibDate]
+            cursor.execute("CREATE INDEX IF NOT EXISTS %s_calibDate_idx ON %s (%s)" %
+                           (table, table, ", ".join(columns)))
+        conn.commit()
+
     def addRow(self, conn, info, *args, **kwargs):
         """Add a row to the file table"""
         info[self.config.validStart] = None
         info[self.config.validEnd] = None
         RegisterTask.addRow(self, conn, info, *args, **kwargs)
 
-    def updateValidityRanges(self, conn, validity):
+    def addRows(self, conn, infoList, *args, **kwargs):
+        """Add many rows to the file table in bulk"""
+        for info in infoList:
+            info[self.config.validStart] = None
+            info[self.config.validEnd] = None
+        RegisterTask.addRows(self, conn, infoList, *args, **kwargs)
+
+    def updateValidityRanges(self, conn, validity, detectors=None):
         """Loop over all tables, filters, and ccdnums,
         and update the validity ranges in the registry.
 
+        The rows of each table are read with a single query, the validity
+        ranges are calculated for each detector, and only the rows whose
+        ranges have changed are updated, with a single statement execution.
+
         @param conn: Database connection
         @param validity: Validity range (days)
+        @param detectors: Dict of <table>: <iterable of detector tuples> (values of the columns
+            in self.config.detector), restricting the update to the detectors touched by an
+            ingest; or None to update all detectors in all tables.
         """
         conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
         for table in self.config.tables:
-            sql = "SELECT DISTINCT %s FROM %s" % (", ".join(self.config.detector), table)
-            cursor.execute(sql)
-            rows = cursor.fetchall()
-            for row in rows:
-                self.fixSubsetValidity(conn, table, row, validity)
+            if detectors is None:
+                self.updateTableValidity(conn, table, validity)
+            elif detectors.get(table):
+                self.updateTableValidity(conn, table, validity, detectors[table])
 
-    def fixSubsetValidity(self, conn, table, detectorData, validity):
-        """Update the validity ranges among selected rows in the registry.
+    def updateTableValidity(self, conn, table, validity, detectorList=None):
+        """Update the validity ranges in a table of the registry.
+
+        @param conn: Database connection
+        @param table: Name of table to be updated
+        @param validity: Validity range (days)
+        @param detectorList: Iterable of detector tuples (values of the columns in
+            self.config.detector) to update, or None to update all detectors
+        """
+        detectorColumns = list(self.config.detector)
+        columns = ["id"] + detectorColumns + [self.config.calibDate, self.config.validStart,
+                                              self.config.validEnd]
+        sql = "SELECT %s FROM %s" % (", ".join("%s.%s" % (table, col) for col in columns), table)
+        cursor = conn.cursor()
+        if detectorList is not None:
+            # Join against a temporary table of the detectors to update
+            touched = "%s_touched" % table
+            cursor.execute("DROP TABLE IF EXISTS temp.%s" % touched)
+            cursor.execute("CREATE TEMP TABLE %s (%s)" %
+                           (touched, ", ".join("%s %s" % (col, self.config.columns[col]) for
+                                               col in detectorColumns)))
+            cursor.executemany("INSERT INTO temp.%s VALUES (%s)" %
+                               (touched, ", ".join(["?"]*len(detectorColumns))),
+                               set(tuple(detector) for detector in detectorList))
+            sql += " JOIN temp.%s USING (%s)" % (touched, ", ".join(detectorColumns))
+        sql += " ORDER BY " + ", ".join(["%s.%s" % (table, col) for
+                                         col in detectorColumns + [self.config.calibDate]])
+        cursor.execute(sql)
+        rows = cursor.fetchall()
+        if detectorList is not None:
+            cursor.execute("DROP TABLE temp.%s" % touched)
+
+        def getDetector(row):
+            return tuple(row[col] for col in detectorColumns)
+
+        updates = []
+        for detectorData, detectorRows in itertools.groupby(rows, getDetector):
+            detectorRows = list(detectorRows)
+            try:
+                calibDates = [_convertToDate(row[self.config.calibDate]) for row in detectorRows]
+            except Exception:
+                det = " ".join("%s=%s" % (k, v) for k, v in zip(detectorColumns, detectorData))
+                # Sqlite returns unicode strings, which cannot be passed through SWIG.
+                self.log.warn(str("Skipped setting the validity overlaps for %s %s: missing calibration "
+                                  "dates" % (table, det)))
+                continue
+            valids = self.calculateValidity(table, calibDates, validity)
+            for row, calibDate in zip(detectorRows, calibDates):
+                validStart = valids[calibDate][0].isoformat()
+                validEnd = valids[calibDate][1].isoformat()
+                if row[self.config.validStart] != validStart or row[self.config.validEnd] != validEnd:
+                    updates.append((validStart, validEnd, row["id"]))
+
+        sql = "UPDATE %s" % table
+        sql += " SET %s=?, %s=?" % (self.config.validStart, self.config.validEnd)
+        sql += " WHERE id=?"
+        cursor.executemany(sql, updates)
+
+    def calculateValidity(self, table, calibDates, validity):
+        """Calculate the validity ranges for the calibrations of a detector.
 
         For defects, the products are valid from their start date until
         they are superseded by subsequent defect data.
@@ -120,28 +221,12 @@ class CalibsRegisterTask(RegisterTask):
         so that the calibration data with whose date is nearest the date
         of the observation is used.
 
-        @param conn: Database connection
-        @param table: Name of table to be selected
-        @param detectorData: Values identifying a detector (from columns in self.config.detector)
+        @param table: Name of table
+        @param calibDates: Calibration dates (datetime.date) of the detector's calibrations
         @param validity: Validity range (days)
+        @return Dict of <calibration date>: <[validity start, validity end]>
         """
-        columns = ", ".join([self.config.calibDate, self.config.validStart, self.config.validEnd])
-        sql = "SELECT id, %s FROM %s" % (columns, table)
-        sql += " WHERE " + " AND ".join(col + "=?" for col in self.config.detector)
-        sql += " ORDER BY " + self.config.calibDate
-        cursor = conn.cursor()
-        cursor.execute(sql, detectorData)
-        rows = cursor.fetchall()
-
-        try:
-            valids = collections.OrderedDict([(_convertToDate(row[self.config.calibDate]), [None, None]) for
-                                              row in rows])
-        except Exception as e:
-            det = " ".join("%s=%s" % (k, v) for k, v in zip(self.config.detector, detectorData))
-            # Sqlite returns unicode strings, which cannot be passed through SWIG.
-            self.log.warn(str("Skipped setting the validity overlaps for %s %s: missing calibration dates" %
-                              (table, det)))
-            return
+        valids = collections.OrderedDict([(dd, [None, None]) for dd in sorted(calibDates)])
         dates = list(valids.keys())
         if table in self.config.validityUntilSuperseded:
             # A calib is valid until it is superseded
@@ -162,17 +247,18 @@ class CalibsRegisterTask(RegisterTask):
                     nextDate = dates[i + 1]
                     valids[nextDate][0] = midpoint + datetime.timedelta(1)
                     valids[date][1] = midpoint
-            del midpoints
-        del dates
-        # Update the validity data in the registry
-        for row in rows:
-            calibDate = _convertToDate(row[self.config.calibDate])
-            validStart = valids[calibDate][0].isoformat()
-            validEnd = valids[calibDate][1].isoformat()
-            sql = "UPDATE %s" % table
-            sql += " SET %s=?, %s=?" % (self.config.validStart, self.config.validEnd)
-            sql += " WHERE id=?"
-            conn.execute(sql, (validStart, validEnd, row["id"]))
+        return valids
+
+    def fixSubsetValidity(self, conn, table, detectorData, validity):
+        """Update the validity ranges among selected rows in the registry.
+
+        @param conn: Database connection
+        @param table: Name of table to be selected
+        @param detectorData: Values identifying a detector (from columns in self.config.detector)
+        @param validity: Validity range (days)
+        """
+        conn.row_factory = sqlite3.Row
+        self.updateTableValidity(conn, table, validity, [detectorData])
 
 
 class IngestCalibsArgumentParser(InputOnlyArgumentParser):
@@ -215,6 +301,7 @@ class IngestCalibsTask(IngestTask):
         calibRoot = args.calib if args.calib is not None else args.output
         filenameList = self.expandFiles(args.files)
         with self.register.openRegistry(calibRoot, create=args.create, dryrun=args.dryrun) as registry:
+            detectors = collections.defaultdict(set)  # detectors touched, for each table
             for infile in filenameList:
                 fileInfo, hduInfoList = self.parse.getInfo(infile)
                 if args.calibType is None:
@@ -241,7 +328,8 @@ class IngestCalibsTask(IngestTask):
                 for info in hduInfoList:
                     self.register.addRow(registry, info, dryrun=args.dryrun,
                                          create=args.create, table=calibType)
+                    detectors[calibType].add(tuple(info[col] for col in self.register.config.detector))
             if not args.dryrun:
-                self.register.updateValidityRanges(registry, args.validity)
+                self.register.updateValidityRanges(registry, args.validity, detectors=detectors)
             else:
                 self.log.info("Would update validity ranges here, but dryrun")
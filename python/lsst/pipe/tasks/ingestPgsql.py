@@ -1,3 +1,5 @@
+import csv
+import io
 import os
 
 from lsst.pex.config import ConfigurableField
@@ -14,12 +16,13 @@ except ImportError:
 class PgsqlRegistryContext(RegistryContext):
     """Context manager to provide a pgsql registry
     """
-    def __init__(self, registryName, createTableFunc, forceCreateTables):
+    def __init__(self, registryName, createTableFunc, forceCreateTables, updateTableFunc=None):
         """Construct a context manager
 
         @param registryName: Name of registry file
         @param createTableFunc: Function to create tables
         @param forceCreateTables: Force the (re-)creation of tables?
+        @param updateTableFunc: Function to bring existing tables up to date (e.g., add indexes), or None
         """
         self.registryName = registryName
         data = PgsqlRegistry.readYaml(registryName)
@@ -39,6 +42,8 @@ class PgsqlRegistryContext(RegistryContext):
             for tt in tables:
                 cur.execute("DROP TABLE %s CASCADE" % tt)
             createTableFunc(self.conn)
+        elif updateTableFunc is not None:
+            updateTableFunc(self.conn)
 
     def __exit__(self, excType, excValue, traceback):
         self.conn.commit()
@@ -49,6 +54,74 @@ class PgsqlRegistryContext(RegistryContext):
 class PgsqlRegisterTask(RegisterTask):
     placeHolder = "%s"
 
+    def getInsertSql(self, table):
+        """Return the SQL statement for inserting a row into the file table
+
+        PostgreSQL has no "INSERT OR IGNORE"; duplicates of the unique
+        columns are skipped with "ON CONFLICT DO NOTHING" instead.
+
+        @param table   Name of table in database
+        @return SQL statement with placeholders for the values of all columns
+        """
+        sql = "INSERT INTO %s (%s) VALUES (" % (table, ",".join(self.config.columns))
+        sql += ",".join([self.placeHolder] * len(self.config.columns))
+        sql += ")"
+        if self.config.ignore:
+            sql += " ON CONFLICT DO NOTHING"
+        return sql
+
+    def addRows(self, conn, infoList, dryrun=False, create=False, table=None):
+        """Add many rows to the file table (typically 'raw') in bulk.
+
+        The rows are streamed to the server with "COPY FROM STDIN" into a
+        temporary staging table, and then merged into the file table with a
+        single "INSERT ... SELECT", which skips duplicates if the 'ignore'
+        configuration option is set.
+
+        @param conn    Database connection
+        @param infoList  List of file properties to add to database
+        @param table   Name of table in database
+        """
+        if table is None:
+            table = self.config.table
+        if len(infoList) == 0:
+            return
+        if dryrun:
+            RegisterTask.addRows(self, conn, infoList, dryrun=dryrun, create=create, table=table)
+            return
+
+        columns = ",".join(self.config.columns)
+        staging = "%s_staging" % table
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)  # Empty strings are quoted, not NULL
+        for info in infoList:
+            writer.writerow([self.typemap[tt](info[col]) for col, tt in self.config.columns.items()])
+        buffer.seek(0)
+
+        cur = conn.cursor()
+        cur.execute("DROP TABLE IF EXISTS %s" % staging)
+        cur.execute("CREATE TEMP TABLE %s AS SELECT %s FROM %s WITH NO DATA" % (staging, columns, table))
+        cur.copy_expert("COPY %s (%s) FROM STDIN WITH (FORMAT csv)" % (staging, columns), buffer)
+        sql = "INSERT INTO %s (%s) SELECT %s FROM %s" % (table, columns, columns, staging)
+        if self.config.ignore:
+            sql += " ON CONFLICT DO NOTHING"
+        cur.execute(sql)
+        cur.execute("DROP TABLE %s" % staging)
+
+    def getManifestInsertSql(self, table):
+        """Return the SQL statement for recording a file in the manifest
+
+        PostgreSQL has no "INSERT OR REPLACE"; an existing record for the
+        path is updated with "ON CONFLICT DO UPDATE" instead.
+
+        @param table   Name of file table in database
+        @return SQL statement with placeholders for the path, size and mtime
+        """
+        sql = "INSERT INTO %s_manifest (path, size, mtime) VALUES (%s)" % (
+            table, ",".join([self.placeHolder] * 3))
+        sql += " ON CONFLICT (path) DO UPDATE SET size=EXCLUDED.size, mtime=EXCLUDED.mtime"
+        return sql
+
     def openRegistry(self, directory, create=False, dryrun=False):
         """Open the registry and return the connection handle.
 
@@ -60,7 +133,8 @@ class PgsqlRegisterTask(RegisterTask):
         if dryrun:
             return fakeContext()
         registryName = os.path.join(directory, "registry.pgsql")
-        return PgsqlRegistryContext(registryName, self.createTable, create)
+        return PgsqlRegistryContext(registryName, self.createTable, create,
+                                    updateTableFunc=self.updateTables)
 
     def createTable(self, conn, table=None):
         """Create the registry tables
@@ -98,6 +172,9 @@ class PgsqlRegisterTask(RegisterTask):
         cmd += ")"
         cur.execute(cmd)
         del cur
+        self.createIndexes(conn, table=table)
+        if self.config.manifest:
+            self.createManifest(conn, table=table)
         conn.commit()
 
 
@@ -19,6 +19,8 @@
 # the GNU General Public License along with this program.  If not,
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
+import os
+
 import numpy
 
 import lsst.pex.config as pexConfig
@@ -29,7 +31,7 @@ import lsst.log as log
 from lsst.meas.algorithms import CoaddPsf, CoaddPsfConfig
 from .coaddBase import CoaddBaseTask
 from .warpAndPsfMatch import WarpAndPsfMatchTask
-from .coaddHelpers import groupPatchExposures, getGroupDataRef
+from .coaddHelpers import groupPatchExposures, getGroupDataRef, getConfigHash, WarpManifest
 
 __all__ = ["MakeCoaddTempExpTask"]
 
@@ -66,6 +68,12 @@ class MakeCoaddTempExpConfig(CoaddBaseTask.ConfigClass):
         default=False,
     )
     doApplySkyCorr = pexConfig.Field(dtype=bool, default=False, doc="Apply sky correction?")
+    useManifest = pexConfig.Field(
+        doc="Record completed warps in a per-patch manifest, and use it to decide which warps to "
+            "skip when reuse=True? If no manifest exists, fall back to checking for the outputs.",
+        dtype=bool,
+        default=True,
+    )
 
     def validate(self):
         CoaddBaseTask.ConfigClass.validate(self)
@@ -120,7 +128,13 @@ class MakeCoaddTempExpTask(CoaddBaseTask):
 
     This task has one special keyword argument: passing reuse=True will cause
     the task to skip the creation of warps that are already present in the
-    output repositories.
+    output repositories. If `config.useManifest` is set, the warps that were
+    completely written (with the same inputs and configuration) are recorded
+    in a per-patch manifest, which is read once instead of checking each warp
+    for existence; warps that are missing from the manifest or stale are redone.
+    If the manifest for a patch is empty (e.g., the warps were written before
+    the manifest was used), the warps are checked for existence instead, and
+    those found are recorded in the manifest.
 
     @section pipe_tasks_makeCoaddTempExp_IO  Invoking the Task
 
@@ -287,14 +301,35 @@ class MakeCoaddTempExpTask(CoaddBaseTask):
                                         primaryWarpDataset)
         self.log.info("Processing %d warp exposures for patch %s", len(groupData.groups), patchRef.dataId)
 
+        manifest = None
+        checkManifest = False  # Use the manifest, rather than the outputs, to decide what to skip?
+        configHash = getConfigHash(self.config) if self.config.useManifest else None
+
         dataRefList = []
         for i, (tempExpTuple, calexpRefList) in enumerate(groupData.groups.items()):
             tempExpRef = getGroupDataRef(patchRef.getButler(), primaryWarpDataset,
                                          tempExpTuple, groupData.keys)
-            if self.reuse and tempExpRef.datasetExists(datasetType=primaryWarpDataset, write=True):
-                self.log.info("Skipping makeCoaddTempExp for %s; output already exists.", tempExpRef.dataId)
-                dataRefList.append(tempExpRef)
-                continue
+            inputs = None
+            if self.config.useManifest:
+                if manifest is None:
+                    manifest = WarpManifest.read(self.getManifestFilename(patchRef, tempExpRef,
+                                                                          primaryWarpDataset))
+                    checkManifest = bool(manifest.entries)
+                inputs = WarpManifest.makeInputs(calexpRefList)
+            if self.reuse:
+                if checkManifest:
+                    exists = manifest.isComplete(tempExpRef.dataId, inputs, configHash)
+                else:
+                    exists = tempExpRef.datasetExists(datasetType=primaryWarpDataset, write=True)
+                    if exists and manifest is not None:
+                        # Record the existing warp, so that it is not redone once the manifest is in use
+                        manifest.add(tempExpRef.dataId, inputs, configHash,
+                                     self.getExistingWarpDatasets(tempExpRef))
+                if exists:
+                    self.log.info("Skipping makeCoaddTempExp for %s; output already exists.",
+                                  tempExpRef.dataId)
+                    dataRefList.append(tempExpRef)
+                    continue
             self.log.info("Processing Warp %d/%d: id=%s", i, len(groupData.groups), tempExpRef.dataId)
 
             # TODO: mappers should define a way to go from the "grouping keys" to a numeric ID (#2776).
@@ -317,9 +352,38 @@ class MakeCoaddTempExpTask(CoaddBaseTask):
                     if exposure is not None:
                         self.log.info("Persisting %s" % self.getTempExpDatasetName(warpType))
                         tempExpRef.put(exposure, self.getTempExpDatasetName(warpType))
+                if manifest is not None and any(exps.values()):
+                    manifest.add(tempExpRef.dataId, inputs, configHash,
+                                 [self.getTempExpDatasetName(warpType) for warpType, exposure in exps.items()
+                                  if exposure is not None])
 
         return dataRefList
 
+    def getExistingWarpDatasets(self, tempExpRef):
+        """Return the names of the warp datasets that exist for a warp
+
+        @param tempExpRef: data reference for the warp
+        @return list of names of the existing warp datasets of the types configured
+        """
+        warpTypes = [warpType for warpType, make in (("direct", self.config.makeDirect),
+                                                     ("psfMatched", self.config.makePsfMatched)) if make]
+        return [self.getTempExpDatasetName(warpType) for warpType in warpTypes if
+                tempExpRef.datasetExists(datasetType=self.getTempExpDatasetName(warpType), write=True)]
+
+    def getManifestFilename(self, patchRef, tempExpRef, datasetName):
+        """Return the filename of the manifest of completed warps for a patch
+
+        The manifest lives alongside the warps themselves.
+
+        @param patchRef: data reference for sky map patch
+        @param tempExpRef: data reference for any warp in the patch
+        @param datasetName: name of the primary warp dataset
+        @return manifest filename
+        """
+        warpFilename = tempExpRef.get(datasetName + "_filename")[0]
+        patchName = "-".join(str(patchRef.dataId[key]) for key in sorted(patchRef.dataId.keys()))
+        return os.path.join(os.path.dirname(warpFilename), "%s-manifest-%s.json" % (datasetName, patchName))
+
     def createTempExp(self, calexpRefList, skyInfo, visitId=0):
         """Create a Warp from inputs
 
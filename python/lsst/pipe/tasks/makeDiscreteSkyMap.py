@@ -29,6 +29,7 @@ import lsst.pex.config as pexConfig
 import lsst.pipe.base as pipeBase
 from lsst.skymap import DiscreteSkyMap, BaseSkyMap
 from lsst.pipe.base import ArgumentParser
+from .selectImages import projectCorners
 
 
 class MakeDiscreteSkyMapConfig(pexConfig.Config):
@@ -138,17 +139,24 @@ class MakeDiscreteSkyMapTask(pipeBase.CmdLineTask):
                     - skyMap: the constructed SkyMap
         """
         self.log.info("Extracting bounding boxes of %d images" % len(dataRefList))
-        points = []
+        wcsList = []
+        bboxList = []
+        usedDataRefList = []
         for dataRef in dataRefList:
             if not dataRef.datasetExists("calexp"):
                 self.log.warn("CalExp for %s does not exist: ignoring" % (dataRef.dataId,))
                 continue
             md = dataRef.get("calexp_md", immediate=True)
-            wcs = afwGeom.makeSkyWcs(md)
+            wcsList.append(afwGeom.makeSkyWcs(md))
             # nb: don't need to worry about xy0 because Exposure saves Wcs with CRPIX shifted by (-x0, -y0).
-            boxI = afwImage.bboxFromMetadata(md)
-            boxD = afwGeom.Box2D(boxI)
-            points.extend(wcs.pixelToSky(corner).getVector() for corner in boxD.getCorners())
+            bboxList.append(afwImage.bboxFromMetadata(md))
+            usedDataRefList.append(dataRef)
+        projected = projectCorners(wcsList, bboxList)
+        for dataRef, valid in zip(usedDataRefList, projected.valid):
+            if not valid:
+                self.log.warn("Unable to project corners of %s onto the sky: ignoring" % (dataRef.dataId,))
+        points = [lsst.sphgeom.UnitVector3d(*vector) for
+                  vector in projected.vectors[projected.valid].reshape(-1, 3)]
         if len(points) == 0:
             raise RuntimeError("No data found from which to compute convex hull")
         self.log.info("Computing spherical convex hull")
@@ -20,13 +20,17 @@
 # the GNU General Public License along with this program.  If not,
 # see <https://www.lsstcorp.org/LegalNotices/>.
 #
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy
 
 from lsst.coadd.utils.coaddDataIdContainer import ExistingCoaddDataIdContainer
 from lsst.pipe.base import CmdLineTask, Struct, TaskRunner, ArgumentParser, ButlerInitializedTaskRunner
 from lsst.pex.config import Config, Field, ListField, ConfigurableField, RangeField, ConfigField
 from lsst.meas.algorithms import DynamicDetectionTask, SkyObjectsTask
-from lsst.meas.base import SingleFrameMeasurementTask, ApplyApCorrTask, CatalogCalculationTask
+from lsst.meas.base import ApplyApCorrTask, CatalogCalculationTask
+from lsst.meas.base import NoiseReplacer, DummyNoiseReplacer
 from lsst.meas.deblender import SourceDeblendTask
 from lsst.pipe.tasks.coaddBase import getSkyInfo
 from lsst.pipe.tasks.scaleVariance import ScaleVarianceTask
@@ -34,6 +38,7 @@ from lsst.meas.astrom import DirectMatchTask, denormalizeMatches
 from lsst.pipe.tasks.fakes import BaseFakeSourcesTask
 from lsst.pipe.tasks.setPrimaryFlags import SetPrimaryFlagsTask
 from lsst.pipe.tasks.propagateVisitFlags import PropagateVisitFlagsTask
+from lsst.pipe.tasks.cachedPsfMeasurement import CachedPsfMeasurementTask
 import lsst.afw.image as afwImage
 import lsst.afw.table as afwTable
 import lsst.afw.math as afwMath
@@ -385,6 +390,12 @@ class MergeSourcesConfig(Config):
     priorityList = ListField(dtype=str, default=[],
                              doc="Priority-ordered list of bands for the merge.")
     coaddName = Field(dtype=str, default="deep", doc="Name of coadd")
+    readThreads = Field(dtype=int, default=1, check=lambda x: x > 0,
+                        doc="Number of threads with which to read the input catalogs for the bands "
+                            "concurrently; 1 reads them one after another.")
+    readFootprints = Field(dtype=bool, default=True,
+                           doc="Read the footprints of the input sources? They are required to merge "
+                               "detections, and to provide footprints in the merged catalog.")
 
     def validate(self):
         Config.validate(self)
@@ -468,22 +479,40 @@ class MergeSourcesTask(CmdLineTask):
 
         @param[in] patchRefList list of data references for each filter
         """
-        catalogs = dict(self.readCatalog(patchRef) for patchRef in patchRefList)
+        catalogs = dict(self.readCatalogs(patchRefList))
         mergedCatalog = self.mergeCatalogs(catalogs, patchRefList[0])
         self.write(patchRefList[0], mergedCatalog)
 
+    def readCatalogs(self, patchRefList):
+        """!
+        @brief Read the input catalogs for all bands.
+
+        The catalogs are read concurrently on a pool of config.readThreads threads, so that the time
+        to read them all is that of the slowest.
+
+        @param[in]  patchRefList   list of data references for each filter
+        @return list of tuples consisting of the filter name and the catalog, in the order of patchRefList
+        """
+        numThreads = min(self.config.readThreads, len(patchRefList))
+        if numThreads <= 1:
+            return [self.readCatalog(patchRef) for patchRef in patchRefList]
+        with ThreadPoolExecutor(numThreads) as executor:
+            return list(executor.map(self.readCatalog, patchRefList))
+
     def readCatalog(self, patchRef):
         """!
         @brief Read input catalog.
 
         We read the input dataset provided by the 'inputDataset'
-        class variable.
+        class variable. The footprints are not read unless config.readFootprints.
 
         @param[in]  patchRef   data reference for patch
         @return tuple consisting of the filter name and the catalog
         """
         filterName = patchRef.dataId["filter"]
-        catalog = patchRef.get(self.config.coaddName + "Coadd_" + self.inputDataset, immediate=True)
+        kwargs = {} if self.config.readFootprints else dict(flags=afwTable.SOURCE_IO_NO_FOOTPRINTS)
+        catalog = patchRef.get(self.config.coaddName + "Coadd_" + self.inputDataset, immediate=True,
+                               **kwargs)
         self.log.info("Read %d sources for filter %s: %s" % (len(catalog), filterName, patchRef.dataId))
         return filterName, catalog
 
@@ -580,6 +609,11 @@ class MergeDetectionsConfig(MergeSourcesConfig):
         MergeSourcesConfig.setDefaults(self)
         self.skyObjects.avoidMask = ["DETECTED"]  # Nothing else is available in our custom mask
 
+    def validate(self):
+        MergeSourcesConfig.validate(self)
+        if not self.readFootprints:
+            raise RuntimeError("Footprints must be read to merge detections")
+
 
 ## @addtogroup LSST_task_documentation
 ## @{
@@ -755,24 +789,32 @@ class MergeDetectionsTask(MergeSourcesTask):
         """
         keys = [item.key for item in self.merged.getPeakSchema().extract("merge_peak_*").values()]
         assert len(keys) > 0, "Error finding flags that associate peaks with their detection bands."
+        config = self.config.cullPeaks
         totalPeaks = 0
         culledPeaks = 0
         for parentSource in catalog:
-            # Make a list copy so we can clear the attached PeakCatalog and append the ones we're keeping
-            # to it (which is easier than deleting as we iterate).
-            keptPeaks = parentSource.getFootprint().getPeaks()
-            oldPeaks = list(keptPeaks)
-            keptPeaks.clear()
-            familySize = len(oldPeaks)
+            peaks = parentSource.getFootprint().getPeaks()
+            familySize = len(peaks)
             totalPeaks += familySize
-            for rank, peak in enumerate(oldPeaks):
-                if ((rank < self.config.cullPeaks.rankSufficient) or
-                    (sum([peak.get(k) for k in keys]) >= self.config.cullPeaks.nBandsSufficient) or
-                    (rank < self.config.cullPeaks.rankConsidered and
-                     rank < self.config.cullPeaks.rankNormalizedConsidered * familySize)):
-                    keptPeaks.append(peak)
-                else:
-                    culledPeaks += 1
+            if familySize <= config.rankSufficient:
+                continue  # We always keep this many peaks
+            # Decide which peaks to keep from the columns of the (sorted) PeakCatalog
+            columns = peaks if peaks.isContiguous() else peaks.copy(deep=True)
+            nBands = numpy.zeros(familySize, dtype=int)
+            for key in keys:
+                nBands += columns.get(key)
+            rank = numpy.arange(familySize)
+            keep = rank < config.rankSufficient
+            keep |= nBands >= config.nBandsSufficient
+            keep |= (rank < config.rankConsidered) & (rank < config.rankNormalizedConsidered*familySize)
+            numKept = numpy.count_nonzero(keep)
+            if numKept == familySize:
+                continue
+            culledPeaks += familySize - numKept
+            # Replace the contents of the attached PeakCatalog with the peaks we're keeping, in one go
+            keptPeaks = peaks.subset(keep)
+            peaks.clear()
+            peaks.extend(keptPeaks, deep=False)
         self.log.info("Culled %d of %d peaks" % (culledPeaks, totalPeaks))
 
     def getSchemaCatalogs(self):
@@ -826,7 +868,8 @@ class MeasureMergedCoaddSourcesConfig(Config):
     """
     doDeblend = Field(dtype=bool, default=True, doc="Deblend sources?")
     deblend = ConfigurableField(target=SourceDeblendTask, doc="Deblend sources")
-    measurement = ConfigurableField(target=SingleFrameMeasurementTask, doc="Source measurement")
+    measurement = ConfigurableField(target=CachedPsfMeasurementTask,
+                                    doc="Source measurement, optionally with a cache of the PSF")
     setPrimaryFlags = ConfigurableField(target=SetPrimaryFlagsTask, doc="Set flags for primary tract/patch")
     doPropagateFlags = Field(
         dtype=bool, default=True,
@@ -865,6 +908,20 @@ class MeasureMergedCoaddSourcesConfig(Config):
         target=CatalogCalculationTask,
         doc="Subtask to run catalogCalculation plugins on catalog"
     )
+    numProcesses = Field(
+        dtype=int,
+        default=1,
+        check=lambda x: x > 0,
+        doc=("Number of processes with which to deblend and measure the families of sources in a patch. "
+             "The worker processes are forked, so they share the coadd rather than copying it, and the "
+             "results are identical to deblending and measuring in a single process.")
+    )
+    numPartitionsPerProcess = Field(
+        dtype=int,
+        default=4,
+        check=lambda x: x > 0,
+        doc="Number of groups of families into which to divide the work for each process, to balance the load"
+    )
 
     def setDefaults(self):
         Config.setDefaults(self)
@@ -934,7 +991,8 @@ class MeasureMergedCoaddSourcesTask(CmdLineTask):
       <DT> @ref SourceDeblendTask_ "deblend"
       <DD> Deblend all the sources from the master catalog.</DD>
       <DT> @ref SingleFrameMeasurementTask_ "measurement"
-      <DD> Measure source properties of deblended sources.</DD>
+      <DD> Measure source properties of deblended sources. The default, CachedPsfMeasurementTask, may cache
+      the PSF at positions snapped to a grid (see CachedPsfMeasurementConfig.psfCacheGridSize).</DD>
       <DT> @ref SetPrimaryFlagsTask_ "setPrimaryFlags"
       <DD> Set flag 'is-primary' as well as related flags on sources. 'is-primary' is set for sources that are
       not at the edge of the field and that have either not been deblended or are the children of deblended
@@ -1068,12 +1126,36 @@ class MeasureMergedCoaddSourcesTask(CmdLineTask):
         Deblend each source in every coadd and measure. Set 'is-primary' and related flags. Propagate flags
         from individual visits. Optionally match the sources to a reference catalog and write the matches.
         Finally, write the deblended sources and measurements out.
+
+        The work is done by @ref runMeasurement.
         """
         exposure = patchRef.get(self.config.coaddName + "Coadd_calexp", immediate=True)
-        exposure.getPsf().setCacheCapacity(psfCache)
         sources = self.readSources(patchRef)
+        sources = self.runMeasurement(patchRef, exposure, sources, psfCache=psfCache)
+        if self.config.doMatchSources:
+            self.writeMatches(patchRef, exposure, sources)
+        self.write(patchRef, sources)
+
+    def runMeasurement(self, patchRef, exposure, sources, psfCache=100):
+        """!
+        @brief Deblend and measure sources on an exposure, without writing the results.
+
+        If config.numProcesses is more than one, the deblending and measurement are divided among worker
+        processes by family of sources (see deblendFamilies and measureFamilies).
+
+        @param[in] patchRef: Patch reference, for the identifiers, sky map and visit inputs
+        @param[in,out] exposure: Coadd on which to measure
+        @param[in] sources: Catalog of merged detections, as returned by @ref readSources
+        @param[in] psfCache: Size of the PSF cache
+        @return Contiguous catalog of the measured sources
+        """
+        exposure.getPsf().setCacheCapacity(psfCache)
+        exposureId = self.getExposureId(patchRef)
         if self.config.doDeblend:
-            self.deblend.run(exposure, sources)
+            if self.config.numProcesses > 1:
+                self.deblendFamilies(exposure, sources)
+            else:
+                self.deblend.run(exposure, sources)
 
             bigKey = sources.schema["deblend_parentTooBig"].asKey()
             # catalog is non-contiguous so can't extract column
@@ -1085,7 +1167,10 @@ class MeasureMergedCoaddSourcesTask(CmdLineTask):
         table = sources.getTable()
         table.setMetadata(self.algMetadata)  # Capture algorithm metadata to write out to the source catalog.
 
-        self.measurement.run(sources, exposure, exposureId=self.getExposureId(patchRef))
+        if self.config.numProcesses > 1:
+            self.measureFamilies(sources, exposure, exposureId=exposureId)
+        else:
+            self.measurement.run(sources, exposure, exposureId=exposureId)
 
         if self.config.doApCorr:
             self.applyApCorr.run(
@@ -1109,9 +1194,150 @@ class MeasureMergedCoaddSourcesTask(CmdLineTask):
         if self.config.doPropagateFlags:
             self.propagateFlags.run(patchRef.getButler(), sources, self.propagateFlags.getCcdInputs(exposure),
                                     exposure.getWcs())
-        if self.config.doMatchSources:
-            self.writeMatches(patchRef, exposure, sources)
-        self.write(patchRef, sources)
+        return sources
+
+    def makeFamilyPool(self, exposure, sources, exposureId=None):
+        """!
+        @brief Make a pool of worker processes for deblending or measuring families of sources.
+
+        The workers are forked, so the exposure and catalog are shared with them (copy-on-write) rather
+        than copied; any changes the workers make to them are private.
+
+        @param[in] exposure: Exposure on which to deblend or measure
+        @param[in] sources: Source catalog
+        @param[in] exposureId: Exposure identifier, for seeding the noise replacement
+        @return multiprocessing.Pool
+        """
+        context = multiprocessing.get_context("fork")
+        return context.Pool(self.config.numProcesses, _initFamilyWorker,
+                            (self, exposure, sources, exposureId))
+
+    def deblendFamilies(self, exposure, sources):
+        """!
+        @brief Deblend sources in worker processes.
+
+        The parents are divided into contiguous groups, which are deblended in worker processes. The parents
+        are then updated in place, and the children are appended to the catalog in the order of their
+        parents, taking their IDs from the catalog's IdFactory, so the result is the same as that of
+        deblending in a single process.
+
+        @param[in] exposure: Exposure on which to deblend
+        @param[in,out] sources: Catalog of parent sources, to which the children are appended
+        """
+        numPartitions = self.config.numProcesses*self.config.numPartitionsPerProcess
+        partitions = partitionFamilies([source.getFootprint().getArea() for source in sources], numPartitions)
+        pool = self.makeFamilyPool(exposure, sources)
+        try:
+            results = pool.map(_deblendFamiliesInWorker, partitions, chunksize=1)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        for (start, stop), result in zip(partitions, results):
+            for index, parent in enumerate(result[:stop - start], start):
+                sources[index].assign(parent)
+        for (start, stop), result in zip(partitions, results):
+            for child in result[stop - start:]:
+                record = sources.addNew()  # Take the next ID, as the deblender would
+                childId = record.getId()
+                record.assign(child)
+                record.setId(childId)
+
+    def measureFamilies(self, sources, exposure, exposureId=None):
+        """!
+        @brief Measure sources in worker processes.
+
+        The families (a parent and its children) are divided into contiguous groups, which are measured in
+        worker processes (see measureFamiliesInPlace), and the measurements are then copied back into the
+        catalog. The result is the same as that of SingleFrameMeasurementTask.run. If the measurement caches
+        the PSF (see CachedPsfMeasurementTask), each worker has its own cache, and their statistics are
+        combined in the measurement metadata.
+
+        @param[in,out] sources: Catalog of sources to measure
+        @param[in] exposure: Exposure on which to measure
+        @param[in] exposureId: Exposure identifier, for seeding the noise replacement
+        """
+        indices = {source.getId(): index for index, source in enumerate(sources)}
+        families = []
+        children = {}
+        for index, source in enumerate(sources):
+            if source.getParent() == 0:
+                family = [index]
+                families.append(family)
+                children[source.getId()] = family
+            else:
+                children[source.getParent()].append(index)
+        weights = [sources[family[0]].getFootprint().getArea()*len(family) for family in families]
+        numPartitions = self.config.numProcesses*self.config.numPartitionsPerProcess
+        partitions = [families[start:stop] for start, stop in partitionFamilies(weights, numPartitions)]
+
+        self.log.info("Measuring %d sources (%d parents, %d children) in %d processes" %
+                      (len(sources), len(families), len(sources) - len(families), self.config.numProcesses))
+        self.addNoiseMetadata(sources, exposureId)
+        pool = self.makeFamilyPool(exposure, sources, exposureId)
+        psfCacheStats = []
+        try:
+            for measured, stats in pool.imap(_measureFamiliesInWorker, partitions, chunksize=1):
+                for record in measured:
+                    sources[indices[record.getId()]].assign(record)
+                if stats is not None:
+                    psfCacheStats.append(stats)
+        finally:
+            pool.terminate()
+            pool.join()
+        if psfCacheStats:
+            self.measurement.recordPsfCacheStats(Struct(hits=sum(s.hits for s in psfCacheStats),
+                                                        misses=sum(s.misses for s in psfCacheStats),
+                                                        evictions=sum(s.evictions for s in psfCacheStats)))
+
+    def measureFamiliesInPlace(self, sources, exposure, families, exposureId=None):
+        """!
+        @brief Measure selected families of sources.
+
+        This follows SingleFrameMeasurementTask.run, except that only the selected families are measured.
+        All sources are replaced by noise, exactly as for measuring the entire catalog, and the families
+        are measured by SingleFrameMeasurementTask.runPlugins, so that the measurements are the same.
+
+        @param[in,out] sources: Catalog of all sources, sorted by parent
+        @param[in,out] exposure: Exposure on which to measure; the pixels are restored on return
+        @param[in] families: List of families to measure, each a list of indices into the catalog of a
+            parent followed by its children
+        @param[in] exposureId: Exposure identifier, for seeding the noise replacement
+        @return Catalog of the measured sources, in the order of the full catalog
+        """
+        measurement = self.measurement
+        if measurement.config.doReplaceWithNoise:
+            footprints = {source.getId(): (source.getParent(), source.getFootprint()) for source in sources}
+            noiseReplacer = NoiseReplacer(measurement.config.noiseReplacer, exposure, footprints,
+                                          log=measurement.log, exposureId=exposureId)
+        else:
+            noiseReplacer = DummyNoiseReplacer()
+
+        # A subset of a catalog sorted by parent remains sorted, as runPlugins requires
+        measured = afwTable.SourceCatalog(sources.getTable())
+        for index in sorted(index for family in families for index in family):
+            measured.append(sources[index])
+        measurement.runPlugins(noiseReplacer, measured, exposure)
+        return measured
+
+    def addNoiseMetadata(self, sources, exposureId=None):
+        """!
+        @brief Record the noise replacement parameters in the catalog metadata.
+
+        This is done by SingleFrameMeasurementTask.run, but worker processes cannot update the metadata.
+
+        @param[in,out] sources: Catalog of sources
+        @param[in] exposureId: Exposure identifier, for seeding the noise replacement
+        """
+        algMetadata = sources.getMetadata()
+        if algMetadata is None or not self.measurement.config.doReplaceWithNoise:
+            return
+        noiseConfig = self.measurement.config.noiseReplacer
+        algMetadata.addInt("NOISE_SEED_MULTIPLIER", noiseConfig.noiseSeedMultiplier)
+        algMetadata.addString("NOISE_SOURCE", noiseConfig.noiseSource)
+        algMetadata.addDouble("NOISE_OFFSET", noiseConfig.noiseOffset)
+        if exposureId is not None:
+            algMetadata.addLong("NOISE_EXPOSURE_ID", exposureId)
 
     def readSources(self, dataRef):
         """!
@@ -1125,6 +1351,16 @@ class MeasureMergedCoaddSourcesTask(CmdLineTask):
         """
         merged = dataRef.get(self.config.coaddName + "Coadd_mergeDet", immediate=True)
         self.log.info("Read %d detections: %s" % (len(merged), dataRef.dataId))
+        return self.prepareSources(dataRef, merged)
+
+    def prepareSources(self, dataRef, merged):
+        """!
+        @brief Convert a catalog of merged detections to the schema of the measurements.
+
+        @param[in] dataRef: Data reference, for the source identifiers
+        @param[in] merged: Catalog of merged detections
+        @return Catalog of sources, ready to be measured in-place
+        """
         idFactory = self.makeIdFactory(dataRef)
         for s in merged:
             idFactory.notify(s.getId())
@@ -1166,6 +1402,64 @@ class MeasureMergedCoaddSourcesTask(CmdLineTask):
         return int(dataRef.get(self.config.coaddName + "CoaddId"))
 
 
+def partitionFamilies(weights, numPartitions):
+    """!
+    @brief Divide a sequence of families into contiguous groups of similar total weight.
+
+    @param[in] weights: Weight (e.g., the number of pixels) of each family
+    @param[in] numPartitions: Maximum number of groups
+    @return list of (start, stop) indices of each group
+    """
+    if len(weights) == 0:
+        return []
+    cumulative = numpy.cumsum(numpy.asarray(weights, dtype=float))
+    targets = cumulative[-1]*numpy.arange(1, numPartitions)/numPartitions
+    cuts = numpy.searchsorted(cumulative, targets, side="left") + 1  # Group ends with family reaching target
+    bounds = numpy.unique(numpy.concatenate([[0], cuts, [len(weights)]]))
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+_familyWorkerState = None
+
+
+def _initFamilyWorker(task, exposure, sources, exposureId):
+    """Initialise a worker process for MeasureMergedCoaddSourcesTask.deblendFamilies/measureFamilies
+
+    @param task: MeasureMergedCoaddSourcesTask to use for deblending and measuring
+    @param exposure: Exposure on which to deblend or measure
+    @param sources: Source catalog
+    @param exposureId: Exposure identifier, for seeding the noise replacement
+    """
+    global _familyWorkerState
+    _familyWorkerState = (task, exposure, sources, exposureId)
+
+
+def _deblendFamiliesInWorker(bounds):
+    """Deblend a contiguous group of parents in a worker process
+
+    @param bounds: (start, stop) indices of the parents
+    @return Catalog of the parents, followed by their children
+    """
+    task, exposure, sources, exposureId = _familyWorkerState
+    start, stop = bounds
+    subset = afwTable.SourceCatalog(sources.getTable())
+    subset.extend(sources[start:stop], deep=True)
+    task.deblend.run(exposure, subset)
+    return subset
+
+
+def _measureFamiliesInWorker(families):
+    """Measure a group of families in a worker process
+
+    @param families: List of families, each a list of indices of a parent followed by its children
+    @return Catalog of the measured sources, and the statistics of the PSF cache (or None if the
+        measurement does not cache the PSF)
+    """
+    task, exposure, sources, exposureId = _familyWorkerState
+    measured = task.measureFamiliesInPlace(sources, exposure, families, exposureId=exposureId)
+    return measured, getattr(task.measurement, "psfCacheStats", None)
+
+
 class MergeMeasurementsConfig(MergeSourcesConfig):
     """!
     @anchor MergeMeasurementsConfig_
@@ -1334,95 +1628,285 @@ class MergeMeasurementsTask(MergeSourcesTask):
         merge_footprint flag for that band is is True.
 
         For child sources, the logic is the same, except that we use the merge_peak flags.
+
+        The choice is made for all sources at once, from the columns of the input catalogs, and the
+        chosen records are copied in bulk.
         """
         # Put catalogs, filters in priority order
         orderedCatalogs = [catalogs[band] for band in self.config.priorityList if band in catalogs.keys()]
         orderedKeys = [self.flagKeys[band] for band in self.config.priorityList if band in catalogs.keys()]
 
-        mergedCatalog = afwTable.SourceCatalog(self.schema)
-        mergedCatalog.reserve(len(orderedCatalogs[0]))
+        numRecords = len(orderedCatalogs[0])
+        for inputCatalog in orderedCatalogs:
+            if len(inputCatalog) != numRecords:
+                raise ValueError("Mismatch between catalog sizes: %s != %s" %
+                                 (numRecords, len(inputCatalog)))
+
+        # Column access requires contiguous catalogs
+        orderedCatalogs = [catalog if catalog.isContiguous() else catalog.copy(deep=True) for
+                           catalog in orderedCatalogs]
 
         idKey = orderedCatalogs[0].table.getIdKey()
         for catalog in orderedCatalogs[1:]:
             if numpy.any(orderedCatalogs[0].get(idKey) != catalog.get(idKey)):
                 raise ValueError("Error in inputs to MergeCoaddMeasurements: source IDs do not match")
 
-        # This first zip iterates over all the catalogs simultaneously, yielding a sequence of one
-        # record for each band, in priority order.
-        for orderedRecords in zip(*orderedCatalogs):
-
-            maxSNRecord = None
-            maxSNFlagKeys = None
-            maxSN = 0.
-            priorityRecord = None
-            priorityFlagKeys = None
-            prioritySN = 0.
-            hasPseudoFilter = False
-
-            # Now we iterate over those record-band pairs, keeping track of the priority and the
-            # largest S/N band.
-            for inputRecord, flagKeys in zip(orderedRecords, orderedKeys):
-                parent = (inputRecord.getParent() == 0 and inputRecord.get(flagKeys.footprint))
-                child = (inputRecord.getParent() != 0 and inputRecord.get(flagKeys.peak))
-
-                if not (parent or child):
-                    for pseudoFilterKey in self.pseudoFilterKeys:
-                        if inputRecord.get(pseudoFilterKey):
-                            hasPseudoFilter = True
-                            priorityRecord = inputRecord
-                            priorityFlagKeys = flagKeys
-                            break
-                    if hasPseudoFilter:
-                        break
-
-                isBad = any(inputRecord.get(flag) for flag in self.badFlags)
-                if isBad or inputRecord.get(self.fluxFlagKey) or inputRecord.get(self.fluxErrKey) == 0:
-                    sn = 0.
-                else:
-                    sn = inputRecord.get(self.fluxKey)/inputRecord.get(self.fluxErrKey)
-                if numpy.isnan(sn) or sn < 0.:
-                    sn = 0.
-                if (parent or child) and priorityRecord is None:
-                    priorityRecord = inputRecord
-                    priorityFlagKeys = flagKeys
-                    prioritySN = sn
-                if sn > maxSN:
-                    maxSNRecord = inputRecord
-                    maxSNFlagKeys = flagKeys
-                    maxSN = sn
-
-            # If the priority band has a low S/N we would like to choose the band with the highest S/N as
-            # the reference band instead.  However, we only want to choose the highest S/N band if it is
-            # significantly better than the priority band.  Therefore, to choose a band other than the
-            # priority, we require that the priority S/N is below the minimum threshold and that the
-            # difference between the priority and highest S/N is larger than the difference threshold.
-            #
-            # For pseudo code objects we always choose the first band in the priority list.
-            bestRecord = None
-            bestFlagKeys = None
-            if hasPseudoFilter:
-                bestRecord = priorityRecord
-                bestFlagKeys = priorityFlagKeys
-            elif (prioritySN < self.config.minSN and (maxSN - prioritySN) > self.config.minSNDiff and
-                  maxSNRecord is not None):
-                bestRecord = maxSNRecord
-                bestFlagKeys = maxSNFlagKeys
-            elif priorityRecord is not None:
-                bestRecord = priorityRecord
-                bestFlagKeys = priorityFlagKeys
-
-            if bestRecord is not None and bestFlagKeys is not None:
-                outputRecord = mergedCatalog.addNew()
-                outputRecord.assign(bestRecord, self.schemaMapper)
-                outputRecord.set(bestFlagKeys.output, True)
-            else:  # if we didn't find any records
-                raise ValueError("Error in inputs to MergeCoaddMeasurements: no valid reference for %s" %
-                                 inputRecord.getId())
-
-        # more checking for sane inputs, since zip silently iterates over the smallest sequence
-        for inputCatalog in orderedCatalogs:
-            if len(mergedCatalog) != len(inputCatalog):
-                raise ValueError("Mismatch between catalog sizes: %s != %s" %
-                                 (len(mergedCatalog), len(orderedCatalogs)))
+        # Gather, for each band (in priority order) and record, whether the record was detected in that
+        # band (merge_footprint flag for parents, merge_peak flag for children), whether it is flagged as
+        # a pseudo-filter detection, and its S/N.
+        numBands = len(orderedCatalogs)
+        detected = numpy.zeros((numBands, numRecords), dtype=bool)
+        pseudo = numpy.zeros((numBands, numRecords), dtype=bool)
+        sn = numpy.zeros((numBands, numRecords), dtype=numpy.float64)
+        parentKey = orderedCatalogs[0].table.getParentKey()
+        for ii, (catalog, flagKeys) in enumerate(zip(orderedCatalogs, orderedKeys)):
+            isParent = catalog.get(parentKey) == 0
+            detected[ii] = numpy.where(isParent, catalog.get(flagKeys.footprint), catalog.get(flagKeys.peak))
+            for pseudoFilterKey in self.pseudoFilterKeys:
+                pseudo[ii] |= catalog.get(pseudoFilterKey)
+
+            flux = catalog.get(self.fluxKey).astype(numpy.float64)
+            fluxErr = catalog.get(self.fluxErrKey).astype(numpy.float64)
+            isBad = catalog.get(self.fluxFlagKey) | (fluxErr == 0)
+            for flag in self.badFlags:
+                isBad |= catalog.get(catalog.schema.find(flag).key)
+            with numpy.errstate(invalid="ignore", divide="ignore"):
+                bandSN = numpy.where(isBad, 0.0, flux/fluxErr)
+            bandSN[numpy.isnan(bandSN) | (bandSN < 0.0)] = 0.0
+            sn[ii] = bandSN
+
+        # The priority band is the first band in which the record was detected, and the maximum S/N band
+        # is the first band with the largest (positive) S/N.
+        #
+        # If the priority band has a low S/N we would like to choose the band with the highest S/N as
+        # the reference band instead.  However, we only want to choose the highest S/N band if it is
+        # significantly better than the priority band.  Therefore, to choose a band other than the
+        # priority, we require that the priority S/N is below the minimum threshold and that the
+        # difference between the priority and highest S/N is larger than the difference threshold.
+        #
+        # For pseudo code objects (not detected in a band, but flagged as a pseudo-filter detection) we
+        # always choose the first such band, regardless of S/N.
+        indices = numpy.arange(numRecords)
+        hasPriority = detected.any(axis=0)
+        priorityBand = numpy.argmax(detected, axis=0)
+        prioritySN = numpy.where(hasPriority, sn[priorityBand, indices], 0.0)
+        maxBand = numpy.argmax(sn, axis=0)
+        maxSN = sn[maxBand, indices]
+        useMax = (prioritySN < self.config.minSN) & (maxSN - prioritySN > self.config.minSNDiff)
+        useMax &= maxSN > 0.0
+        isPseudo = pseudo & ~detected
+        hasPseudo = isPseudo.any(axis=0)
+        pseudoBand = numpy.argmax(isPseudo, axis=0)
+
+        bestBand = numpy.where(hasPriority, priorityBand, -1)
+        bestBand = numpy.where(useMax, maxBand, bestBand)
+        bestBand = numpy.where(hasPseudo, pseudoBand, bestBand)
+
+        missing = numpy.flatnonzero(bestBand < 0)
+        if len(missing) > 0:  # if we didn't find any records
+            raise ValueError("Error in inputs to MergeCoaddMeasurements: no valid reference for %s" %
+                             orderedCatalogs[0][int(missing[0])].getId())
+
+        # Copy the chosen records in bulk, preserving their order: each run of consecutive records
+        # chosen from the same band is copied at once.
+        mergedCatalog = afwTable.SourceCatalog(self.schema)
+        mergedCatalog.reserve(numRecords)
+        if numRecords > 0:
+            runStarts = numpy.concatenate([[0], numpy.flatnonzero(numpy.diff(bestBand)) + 1])
+            runEnds = numpy.concatenate([runStarts[1:], [numRecords]])
+            for start, end in zip(runStarts, runEnds):
+                mergedCatalog.extend(orderedCatalogs[bestBand[start]][int(start):int(end)],
+                                     mapper=self.schemaMapper)
+        outputKeys = [flagKeys.output for flagKeys in orderedKeys]
+        for outputRecord, band in zip(mergedCatalog, bestBand):
+            outputRecord.set(outputKeys[band], True)
 
         return mergedCatalog
+
+
+class MultiBandPatchRunner(MergeSourcesRunner):
+    """!
+    @brief Task runner for the @ref MultiBandPatchTask_ "MultiBandPatchTask".
+
+    The patch references for all filters are provided together, along with the psfCache setting.
+    """
+    @staticmethod
+    def getTargetList(parsedCmd, **kwargs):
+        return MergeSourcesRunner.getTargetList(parsedCmd, psfCache=parsedCmd.psfCache)
+
+
+class MultiBandPatchConfig(Config):
+    """!
+    @anchor MultiBandPatchConfig_
+
+    @brief Configuration for processing all bands of a patch in memory.
+    """
+    coaddName = Field(dtype=str, default="deep", doc="Name of coadd")
+    detectCoaddSources = ConfigurableField(target=DetectCoaddSourcesTask, doc="Detect sources in each band")
+    mergeCoaddDetections = ConfigurableField(target=MergeDetectionsTask, doc="Merge detections")
+    measureCoaddSources = ConfigurableField(target=MeasureMergedCoaddSourcesTask,
+                                            doc="Deblend and measure merged detections in each band")
+    mergeCoaddMeasurements = ConfigurableField(target=MergeMeasurementsTask, doc="Merge measurements")
+    doWriteCheckpoints = Field(dtype=bool, default=False,
+                               doc="Write the intermediate catalogs of detections (det and mergeDet)? They "
+                                   "are not required to continue processing, but allow the individual "
+                                   "steps to be rerun.")
+
+    def validate(self):
+        Config.validate(self)
+        for name in ("detectCoaddSources", "mergeCoaddDetections", "measureCoaddSources",
+                     "mergeCoaddMeasurements"):
+            if getattr(self, name).coaddName != self.coaddName:
+                raise RuntimeError("%s.coaddName (%s) does not match coaddName (%s)" %
+                                   (name, getattr(self, name).coaddName, self.coaddName))
+
+
+## @addtogroup LSST_task_documentation
+## @{
+## @page MultiBandPatchTask
+## @ref MultiBandPatchTask_ "MultiBandPatchTask"
+## @copybrief MultiBandPatchTask
+## @}
+
+
+class MultiBandPatchTask(CmdLineTask):
+    """!
+    @anchor MultiBandPatchTask_
+
+    @brief Detect, merge, measure and merge measurements for all bands of a patch in memory.
+
+    This does the work of @ref DetectCoaddSourcesTask_ "DetectCoaddSourcesTask",
+    @ref MergeDetectionsTask_ "MergeDetectionsTask",
+    @ref MeasureMergedCoaddSourcesTask_ "MeasureMergedCoaddSourcesTask" and
+    @ref MergeMeasurementsTask_ "MergeMeasurementsTask" for one patch, passing the coadds and catalogs
+    from one step to the next in memory instead of writing them out and reading them back. Only the final
+    products are written: the calexp and its background, the meas catalogs (and matches) for each band,
+    and the ref catalog. The det and mergeDet catalogs are written only if config.doWriteCheckpoints.
+
+    The coadds for all bands are held in memory between detection and measurement.
+
+    Usage:
+    @code
+    multiBandPatch.py $CI_HSC_DIR/DATA --id patch=5,4 tract=0 filter=HSC-I^HSC-R
+    @endcode
+    """
+    _DefaultName = "multiBandPatch"
+    ConfigClass = MultiBandPatchConfig
+    RunnerClass = MultiBandPatchRunner
+
+    @classmethod
+    def _makeArgumentParser(cls):
+        parser = ArgumentParser(name=cls._DefaultName)
+        parser.add_id_argument("--id", "deepCoadd", ContainerClass=ExistingCoaddDataIdContainer,
+                               help="data ID, e.g. --id tract=12345 patch=1,2 filter=g^r^i")
+        parser.add_argument("--psfCache", type=int, default=100, help="Size of CoaddPsf cache")
+        return parser
+
+    def __init__(self, butler=None, refObjLoader=None, **kwargs):
+        """!
+        @brief Initialize the task, creating the subtasks with the schemas of the preceding steps.
+
+        Keyword arguments (in addition to those forwarded to CmdLineTask.__init__):
+        @param[in] butler: a butler used to construct the reference catalog loader, if refObjLoader is None
+        @param[in] refObjLoader: an instance of LoadReferenceObjectsTasks that supplies an external reference
+            catalog to the measurement subtask
+        """
+        CmdLineTask.__init__(self, **kwargs)
+        self.makeSubtask("detectCoaddSources")
+        # MergeDetectionsTask adds fields to its schema, which must not leak into the detections
+        self.makeSubtask("mergeCoaddDetections", schema=afwTable.Schema(self.detectCoaddSources.schema))
+        self.makeSubtask("measureCoaddSources", butler=butler, schema=self.mergeCoaddDetections.schema,
+                         peakSchema=self.mergeCoaddDetections.merged.getPeakSchema(),
+                         refObjLoader=refObjLoader)
+        self.makeSubtask("mergeCoaddMeasurements", schema=self.measureCoaddSources.schema)
+
+    def _getConfigName(self):
+        """!Disable persistence of config
+
+        No mapper defines a config dataset for this task; the configs of the individual steps are
+        available as the subtask configs (e.g., config.measureCoaddSources).
+        """
+        return None
+
+    def _getMetadataName(self):
+        """!Disable persistence of metadata
+
+        No mapper defines a metadata dataset for this task.
+        """
+        return None
+
+    def run(self, patchRefList, psfCache=100):
+        """!
+        @brief Process all bands of a patch.
+
+        @param[in] patchRefList: list of data references for each filter
+        @param[in] psfCache: Size of the CoaddPsf cache for measurement
+        @return a pipe.base.Struct with fields
+        - mergeDet: catalog of merged detections
+        - meas: dict mapping filter name to catalog of measurements
+        - ref: catalog of reference sources
+        """
+        coaddName = self.config.coaddName + "Coadd"
+        detect = self.detectCoaddSources
+        exposures = {}
+        detections = {}
+        for patchRef in patchRefList:
+            filterName = patchRef.dataId["filter"]
+            exposure = patchRef.get(coaddName, immediate=True)
+            expId = int(patchRef.get(coaddName + "Id"))
+            results = detect.runDetection(exposure, detect.makeIdFactory(patchRef), expId=expId)
+            if self.config.doWriteCheckpoints:
+                detect.write(exposure, results, patchRef)
+            else:
+                patchRef.put(results.backgrounds, coaddName + "_calexp_background")
+                patchRef.put(exposure, coaddName + "_calexp")
+            self.log.info("Detected %d sources for filter %s: %s" %
+                          (len(results.sources), filterName, patchRef.dataId))
+            exposures[filterName] = exposure
+            detections[filterName] = results.sources
+
+        mergeDetections = self.mergeCoaddDetections
+        mergeDet = mergeDetections.mergeCatalogs(detections, patchRefList[0])
+        if self.config.doWriteCheckpoints:
+            mergeDetections.write(patchRefList[0], mergeDet)
+        del detections
+
+        measure = self.measureCoaddSources
+        measurements = {}
+        for patchRef in patchRefList:
+            filterName = patchRef.dataId["filter"]
+            exposure = exposures.pop(filterName)
+            sources = measure.prepareSources(patchRef, self.copyDetections(mergeDet))
+            sources = measure.runMeasurement(patchRef, exposure, sources, psfCache=psfCache)
+            if measure.config.doMatchSources:
+                measure.writeMatches(patchRef, exposure, sources)
+            measure.write(patchRef, sources)
+            measurements[filterName] = sources
+            del exposure
+
+        mergeMeasurements = self.mergeCoaddMeasurements
+        ref = mergeMeasurements.mergeCatalogs(measurements, patchRefList[0])
+        mergeMeasurements.write(patchRefList[0], ref)
+        return Struct(mergeDet=mergeDet, meas=measurements, ref=ref)
+
+    @staticmethod
+    def copyDetections(catalog):
+        """!
+        @brief Copy a catalog of detections, including the footprints and their peaks.
+
+        A deep copy of a catalog shares the footprints of the original, but deblending and measuring a
+        band may modify them, so each band is given its own copy, as if it had been read separately.
+
+        @param[in] catalog: Catalog of merged detections
+        @return copy of the catalog
+        """
+        copy = catalog.copy(deep=True)
+        for record in copy:
+            original = record.getFootprint()
+            if original is None:
+                continue
+            footprint = afwDetect.Footprint(original.spans, original.getPeaks().getSchema(),
+                                            original.getRegion())
+            footprint.getPeaks().extend(original.getPeaks(), deep=True)
+            record.setFootprint(footprint)
+        return copy
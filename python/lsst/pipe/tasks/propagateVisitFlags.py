@@ -20,9 +20,11 @@
 # the GNU General Public License along with this program.  If not,
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy
 from lsst.pex.config import Config, Field, DictField
-from lsst.pipe.base import Task
+from lsst.pipe.base import Task, Struct
 import lsst.afw.geom as afwGeom
 import lsst.afw.table as afwTable
 
@@ -33,6 +35,86 @@ class PropagateVisitFlagsConfig(Config):
                       default={"calib_psfCandidate": 0.2, "calib_psfUsed": 0.2, },
                       doc="Source catalog flags to propagate, with the threshold of relative occurrence.")
     matchRadius = Field(dtype=float, default=0.2, doc="Source matching radius (arcsec)")
+    readThreads = Field(dtype=int, default=1, check=lambda x: x > 0,
+                        doc="Number of threads with which to read the input source catalogs concurrently")
+
+
+def polygonContains(vertices, x, y):
+    """!Return whether each point is inside a polygon
+
+    @param[in] vertices  List of (x, y) vertices of the polygon
+    @param[in] x  x coordinates of the points (array)
+    @param[in] y  y coordinates of the points (array)
+    @return boolean array, true for points inside the polygon
+    """
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    inside = numpy.zeros(x.shape, dtype=bool)
+    for (x1, y1), (x2, y2) in zip(vertices, vertices[1:] + vertices[:1]):
+        # Count crossings of a ray from each point in the +x direction
+        crosses = (y1 > y) != (y2 > y)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            xCross = x1 + (y - y1)*(x2 - x1)/(y2 - y1)
+        inside ^= crosses & (x < xCross)
+    return inside
+
+
+class CoaddSourceIndex(object):
+    """!Spatial index of coadd sources, for matching input sources to them
+
+    The sources are hashed on a grid in the space of unit vectors, with cells
+    the size of the matching radius, so the coadd sources within the radius of
+    a position are found by examining only the 27 cells around it.  The index
+    is built once, and reused for each input catalog and flag.
+    """
+    _neighbours = numpy.array([(i, j, k) for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)])
+
+    def __init__(self, ra, dec, radius):
+        """!Construct the index
+
+        @param[in] ra  Right ascension of the coadd sources (radians; array)
+        @param[in] dec  Declination of the coadd sources (radians; array)
+        @param[in] radius  Matching radius (lsst.afw.geom.Angle)
+        """
+        self._vectors = self.toUnitVectors(ra, dec)
+        self._chord = 2.0*numpy.sin(0.5*radius.asRadians())  # Chord length corresponding to radius
+        self._cells = {}
+        for index, cell in enumerate(map(tuple, self.getCells(self._vectors))):
+            self._cells.setdefault(cell, []).append(index)
+
+    @staticmethod
+    def toUnitVectors(ra, dec):
+        """!Convert arrays of celestial coordinates (radians) to an Nx3 array of unit vectors"""
+        ra = numpy.asarray(ra, dtype=float)
+        dec = numpy.asarray(dec, dtype=float)
+        cosDec = numpy.cos(dec)
+        return numpy.stack([cosDec*numpy.cos(ra), cosDec*numpy.sin(ra), numpy.sin(dec)], axis=-1)
+
+    def getCells(self, vectors):
+        """!Return the indices of the grid cells containing the provided unit vectors"""
+        return numpy.floor(vectors/self._chord).astype(numpy.int64)
+
+    def match(self, ra, dec):
+        """!Find all coadd sources within the matching radius of each position
+
+        @param[in] ra  Right ascension of the positions to match (radians; array)
+        @param[in] dec  Declination of the positions to match (radians; array)
+        @return array of the indices of the matching coadd sources, with one
+            entry for each matching pair
+        """
+        vectors = self.toUnitVectors(ra, dec)
+        matched = []
+        for vector, cell in zip(vectors, self.getCells(vectors)):
+            candidates = [index for offset in self._neighbours for
+                          index in self._cells.get(tuple(cell + offset), ())]
+            if not candidates:
+                continue
+            candidates = numpy.array(candidates)
+            distance2 = ((self._vectors[candidates] - vector)**2).sum(axis=1)
+            matched.append(candidates[distance2 <= self._chord**2])
+        if not matched:
+            return numpy.array([], dtype=int)
+        return numpy.concatenate(matched)
 
 
 ## \addtogroup LSST_task_documentation
@@ -130,6 +212,88 @@ task.run(butler, coaddCatalog, ccdInputs, coaddExposure.getWcs())
         self._keys = dict((f, self.schema.addField(f, type="Flag", doc="Propagated from visits")) for
                           f in self.config.flags)
 
+    def makeIndex(self, coaddSources):
+        """!Build a spatial index of the coadd sources, for matching the input sources
+
+        @param[in] coaddSources  Source catalog from the coadd (need not be contiguous)
+        @return CoaddSourceIndex, which identifies the coadd sources by their row in coaddSources
+        """
+        if coaddSources.isContiguous():
+            ra = coaddSources.get("coord_ra")
+            dec = coaddSources.get("coord_dec")
+        else:
+            ra = [s.getRa().asRadians() for s in coaddSources]
+            dec = [s.getDec().asRadians() for s in coaddSources]
+        return CoaddSourceIndex(ra, dec, self.config.matchRadius*afwGeom.arcseconds)
+
+    def countOverlaps(self, coaddSources, ccdInputs, coaddWcs):
+        """!Count the input CCDs that overlap each coadd source
+
+        This is equivalent to the length of ccdInputs.subsetContaining for the
+        centroid of each source (including the valid polygons), but each CCD
+        is tested against all sources at once.
+
+        @param[in] coaddSources  Source catalog from the coadd
+        @param[in] ccdInputs  Table of CCDs that contribute to the coadd
+        @param[in] coaddWcs  Wcs for coadd
+        @return array of the number of overlapping CCDs for each source
+        """
+        if coaddSources.isContiguous():
+            pixels = numpy.array([coaddSources.getX(), coaddSources.getY()], dtype=float)
+        else:
+            pixels = numpy.array([[s.getX() for s in coaddSources], [s.getY() for s in coaddSources]],
+                                 dtype=float).reshape(2, len(coaddSources))
+        sky = coaddWcs.getTransform().applyForward(pixels)
+        numOverlaps = numpy.zeros(len(coaddSources), dtype=int)
+        for ccdRecord in ccdInputs:
+            x, y = ccdRecord.getWcs().getTransform().applyInverse(sky)
+            bbox = afwGeom.Box2D(ccdRecord.getBBox())
+            contained = (x >= bbox.getMinX()) & (x < bbox.getMaxX())
+            contained &= (y >= bbox.getMinY()) & (y < bbox.getMaxY())
+            polygon = ccdRecord.getValidPolygon()
+            if polygon is not None and contained.any():
+                vertices = [(point.getX(), point.getY()) for point in polygon.getVertices()]
+                contained[contained] = polygonContains(vertices, x[contained], y[contained])
+            numOverlaps += contained
+        return numOverlaps
+
+    def readInputs(self, butler, ccdInputs):
+        """!Read the positions and flags of the sources in each input CCD
+
+        The catalogs are read concurrently on config.readThreads threads,
+        without their footprints, and only the columns needed for the
+        propagation are retained.
+
+        @param[in] butler  Data butler, for retrieving the input source catalogs
+        @param[in] ccdInputs  Table of CCDs that contribute to the coadd
+        @return iterable of the results of readInput for each CCD
+        """
+        numThreads = min(self.config.readThreads, len(ccdInputs))
+        if numThreads <= 1:
+            return (self.readInput(butler, ccdRecord) for ccdRecord in ccdInputs)
+        with ThreadPoolExecutor(numThreads) as executor:
+            return list(executor.map(lambda ccdRecord: self.readInput(butler, ccdRecord), ccdInputs))
+
+    def readInput(self, butler, ccdRecord):
+        """!Read the positions and flags of the sources in an input CCD
+
+        The celestial coordinates are calculated from the centroids using the
+        Wcs of the CCD, transforming all sources at once.
+
+        @param[in] butler  Data butler, for retrieving the input source catalog
+        @param[in] ccdRecord  Record for the CCD from the table of CCD inputs
+        @return Struct with ra, dec (radians) and flags (dict of flag name to
+            boolean array) of the sources
+        """
+        ccdSources = butler.get("src", visit=int(ccdRecord.get("visit")), ccd=int(ccdRecord.get("ccd")),
+                                flags=afwTable.SOURCE_IO_NO_FOOTPRINTS, immediate=True)
+        if not ccdSources.isContiguous():
+            ccdSources = ccdSources.copy(deep=True)
+        flags = dict((f, ccdSources.get(f).copy()) for f in self._keys)
+        pixels = numpy.array([ccdSources.getX(), ccdSources.getY()], dtype=float)
+        ra, dec = ccdRecord.getWcs().getTransform().applyForward(pixels)
+        return Struct(ra=ra, dec=dec, flags=flags)
+
     @staticmethod
     def getCcdInputs(coaddExposure):
         """!Convenience method to retrieve the CCD inputs table from a coadd exposure"""
@@ -165,38 +329,27 @@ task.run(butler, coaddCatalog, ccdInputs, coaddExposure.getWcs())
             return
 
         flags = self._keys.keys()
-        visitKey = ccdInputs.schema.find("visit").key
-        ccdKey = ccdInputs.schema.find("ccd").key
-        radius = self.config.matchRadius*afwGeom.arcseconds
 
         self.log.info("Propagating flags %s from inputs" % (flags,))
 
         counts = dict((f, numpy.zeros(len(coaddSources), dtype=int)) for f in flags)
-        indices = numpy.array([s.getId() for s in coaddSources])  # Allowing for non-contiguous data
+        index = self.makeIndex(coaddSources)
 
         # Accumulate counts of flags being set
-        for ccdRecord in ccdInputs:
-            v = ccdRecord.get(visitKey)
-            c = ccdRecord.get(ccdKey)
-            ccdSources = butler.get("src", visit=int(v), ccd=int(c), immediate=True)
-            for sourceRecord in ccdSources:
-                sourceRecord.updateCoord(ccdRecord.getWcs())
+        for inputs in self.readInputs(butler, ccdInputs):
             for flag in flags:
-                # We assume that the flags will be relatively rare, so it is more efficient to match
-                # against a subset of the input catalog for each flag than it is to match once against
-                # the entire catalog.  It would be best to have built a kd-tree on coaddSources and
-                # keep reusing that for the matching, but we don't have a suitable implementation.
-                mc = afwTable.MatchControl()
-                mc.findOnlyClosest = False
-                matches = afwTable.matchRaDec(coaddSources, ccdSources[ccdSources.get(flag)], radius, mc)
-                for m in matches:
-                    index = (numpy.where(indices == m.first.getId()))[0][0]
-                    counts[flag][index] += 1
+                # We assume that the flags will be relatively rare, so we match only the flagged sources
+                select = inputs.flags[flag]
+                numpy.add.at(counts[flag], index.match(inputs.ra[select], inputs.dec[select]), 1)
 
         # Apply threshold
+        numOverlaps = self.countOverlaps(coaddSources, ccdInputs, coaddWcs)
         for f in flags:
             key = self._keys[f]
-            for s, num in zip(coaddSources, counts[f]):
-                numOverlaps = len(ccdInputs.subsetContaining(s.getCentroid(), coaddWcs, True))
-                s.setFlag(key, bool(num > numOverlaps*self.config.flags[f]))
-            self.log.info("Propagated %d sources with flag %s" % (sum(s.get(key) for s in coaddSources), f))
+            values = counts[f] > numOverlaps*self.config.flags[f]
+            if coaddSources.isContiguous():
+                coaddSources.columns.set_bool_array(key, values)
+            else:
+                for s, value in zip(coaddSources, values):
+                    s.setFlag(key, bool(value))
+            self.log.info("Propagated %d sources with flag %s" % (values.sum(), f))
@@ -19,15 +19,22 @@
 # the GNU General Public License along with this program.  If not,
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
+import hashlib
+import pickle
+
 import numpy as np
 import lsst.sphgeom
 import lsst.pex.config as pexConfig
 import lsst.pex.exceptions as pexExceptions
 import lsst.afw.geom as afwGeom
+import lsst.afw.table as afwTable
 import lsst.pipe.base as pipeBase
+from .coaddHelpers import writeFileAtomically
 
 __all__ = ["BaseSelectImagesTask", "BaseExposureInfo", "WcsSelectImagesTask", "PsfWcsSelectImagesTask",
-           "DatabaseSelectImagesConfig", "BestSeeingWcsSelectImagesTask"]
+           "DatabaseSelectImagesConfig", "BestSeeingWcsSelectImagesTask", "SkyPolygonIndex",
+           "PsfQualityConfig", "computePsfQuality", "setPsfQualityMetadata", "getPsfQualityFromMetadata",
+           "setPsfSizeMetadata", "getPsfSizeFromMetadata", "projectCorners"]
 
 
 class DatabaseSelectImagesConfig(pexConfig.Config):
@@ -167,8 +174,251 @@ class SelectStruct(pipeBase.Struct):
         super(SelectStruct, self).__init__(dataRef=dataRef, wcs=wcs, bbox=bbox)
 
 
+def projectCorners(wcsList, bboxList):
+    """Project the corners of many images onto the sky in bulk
+
+    The pixel positions of the corners of all the images are computed as
+    arrays, each Wcs is applied to the four corners of its image in a single
+    call, and the conversion to unit vectors is vectorized, avoiding the
+    overhead of projecting and converting one corner at a time.
+
+    @param wcsList: List of Wcs (lsst.afw.geom.SkyWcs), one per image
+    @param bboxList: List of integer bounding boxes (lsst.afw.geom.Box2I), one per image
+    @return a pipeBase Struct containing:
+    - ra, dec: ICRS coordinates (radians) of the corners, shape (N, 4), in the order
+        of lsst.afw.geom.Box2D.getCorners; NaN where the projection failed
+    - vectors: unit vectors of the corners, shape (N, 4, 3)
+    - valid: boolean array of whether the projection succeeded for all corners, shape (N,)
+    """
+    num = len(wcsList)
+    if len(bboxList) != num:
+        raise RuntimeError("Number of Wcs (%d) and bboxes (%d) do not match" % (num, len(bboxList)))
+    # Box2D(Box2I) extends the box by half a pixel on each side
+    minX = np.array([bbox.getMinX() for bbox in bboxList], dtype=float) - 0.5
+    minY = np.array([bbox.getMinY() for bbox in bboxList], dtype=float) - 0.5
+    maxX = np.array([bbox.getMaxX() for bbox in bboxList], dtype=float) + 0.5
+    maxY = np.array([bbox.getMaxY() for bbox in bboxList], dtype=float) + 0.5
+    xCorners = np.stack([minX, maxX, maxX, minX], axis=1)
+    yCorners = np.stack([minY, minY, maxY, maxY], axis=1)
+
+    ra = np.full((num, 4), np.nan)
+    dec = np.full((num, 4), np.nan)
+    for i, wcs in enumerate(wcsList):
+        try:
+            ra[i], dec[i] = wcs.pixelToSkyArray(xCorners[i], yCorners[i], degrees=False)
+        except (pexExceptions.DomainError, pexExceptions.RuntimeError):
+            # Protecting ourselves from awful Wcs solutions in input images
+            continue
+    valid = np.all(np.isfinite(ra) & np.isfinite(dec), axis=1)
+
+    cosDec = np.cos(dec)
+    vectors = np.stack([cosDec*np.cos(ra), cosDec*np.sin(ra), np.sin(dec)], axis=2)
+    return pipeBase.Struct(ra=ra, dec=dec, vectors=vectors, valid=valid)
+
+
+def _makeIndexKey(selectDataList):
+    """Return a hashable key identifying the images in a list of SelectStruct
+
+    The key includes the bbox and a hash of the Wcs of each image as well as
+    its dataId, so that a persisted index is not used for images whose Wcs
+    has changed (e.g., after recalibration).
+    """
+    return tuple((tuple(sorted(data.dataRef.dataId.items())),
+                  (data.bbox.getMinX(), data.bbox.getMinY(), data.bbox.getWidth(), data.bbox.getHeight()),
+                  hashlib.sha1(data.wcs.writeString().encode()).hexdigest())
+                 for data in selectDataList)
+
+
+class SkyPolygonIndex:
+    """Spatial index of the sky polygons of a list of images
+
+    The corners of each image are projected onto the sky once, when the index
+    is built, and each image polygon is registered in the trixels of an HTM
+    pixelization that cover it.  Selecting the images that overlap a region
+    then only requires the exact polygon intersection test for the images
+    that share a trixel with the region, rather than for every image.
+
+    The index may be persisted with `write` and restored with `read`, so that
+    it need only be built once for a given set of inputs.
+    """
+
+    def __init__(self, key, corners, pixels, level):
+        """Construct
+
+        Use `build` or `read` rather than constructing directly.
+
+        @param key: Key identifying the indexed images (see _makeIndexKey)
+        @param corners: List (one per image) of the ICRS coordinates of the image
+            corners, as (ra, dec) tuples in radians, or None if the image has no usable polygon
+        @param pixels: Dict of <HTM pixel index>: <list of image indices>
+        @param level: HTM subdivision level
+        """
+        self.key = key
+        self.corners = corners
+        self.pixels = pixels
+        self.level = level
+        self._polygons = {}
+
+    @classmethod
+    def build(cls, selectDataList, level, log=None, key=None):
+        """Build an index from a list of SelectStruct
+
+        @param selectDataList: List of SelectStruct, to index
+        @param level: HTM subdivision level
+        @param log: Log for reporting images that cannot be indexed, or None
+        @param key: Key identifying the images (see _makeIndexKey), or None to compute it
+        @return SkyPolygonIndex
+        """
+        pixelization = lsst.sphgeom.HtmPixelization(level)
+        projected = projectCorners([data.wcs for data in selectDataList],
+                                   [data.bbox for data in selectDataList])
+        corners = []
+        pixels = {}
+        polygons = {}
+        for index, data in enumerate(selectDataList):
+            if not projected.valid[index]:
+                if log is not None:
+                    log.debug("WCS error in testing calexp %s: deselecting", data.dataRef.dataId)
+                corners.append(None)
+                continue
+            imagePoly = lsst.sphgeom.ConvexPolygon.convexHull(
+                [lsst.sphgeom.UnitVector3d(*vector) for vector in projected.vectors[index]])
+            if imagePoly is None:
+                if log is not None:
+                    log.debug("Unable to create polygon from image %s: deselecting", data.dataRef.dataId)
+                corners.append(None)
+                continue
+            corners.append(list(zip(projected.ra[index].tolist(), projected.dec[index].tolist())))
+            polygons[index] = imagePoly
+            for begin, end in pixelization.envelope(imagePoly):
+                for pixel in range(begin, end):
+                    pixels.setdefault(pixel, []).append(index)
+        if key is None:
+            key = _makeIndexKey(selectDataList)
+        skyIndex = cls(key, corners, pixels, level)
+        skyIndex._polygons = polygons
+        return skyIndex
+
+    @classmethod
+    def read(cls, filename):
+        """Read a persisted index
+
+        @param filename: Name of file written by `write`
+        @return SkyPolygonIndex, or None if the file does not exist or cannot be read
+        """
+        try:
+            with open(filename, "rb") as fd:
+                state = pickle.load(fd)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return cls(**state)
+
+    def write(self, filename):
+        """Persist the index atomically
+
+        @param filename: Name of file to write
+        """
+        state = dict(key=self.key, corners=self.corners, pixels=self.pixels, level=self.level)
+        writeFileAtomically(filename, lambda outFile: pickle.dump(state, outFile,
+                                                                  protocol=pickle.HIGHEST_PROTOCOL))
+
+    def getCoordList(self, index):
+        """Return the ICRS coordinates of the corners of an image
+
+        @param index: Index of image in the list used to build the index
+        @return list of lsst.afw.geom.SpherePoint
+        """
+        return [afwGeom.SpherePoint(ra, dec, afwGeom.radians) for ra, dec in self.corners[index]]
+
+    def getPolygon(self, index):
+        """Return the sky polygon of an image
+
+        @param index: Index of image in the list used to build the index
+        @return lsst.sphgeom.ConvexPolygon
+        """
+        polygon = self._polygons.get(index)
+        if polygon is None:
+            polygon = lsst.sphgeom.ConvexPolygon.convexHull(
+                [lsst.sphgeom.UnitVector3d(lsst.sphgeom.LonLat.fromRadians(ra, dec)) for
+                 ra, dec in self.corners[index]])
+            self._polygons[index] = polygon
+        return polygon
+
+    def query(self, region):
+        """Return the images that overlap a region
+
+        @param region: Sky region (lsst.sphgeom.Region, e.g., ConvexPolygon)
+        @return sorted list of indices of the images whose polygons intersect the region
+        """
+        pixelization = lsst.sphgeom.HtmPixelization(self.level)
+        candidates = set()
+        for begin, end in pixelization.envelope(region):
+            for pixel in range(begin, end):
+                candidates.update(self.pixels.get(pixel, ()))
+        # "intersects" also covers "contains" or "is contained by"
+        return [index for index in sorted(candidates) if region.intersects(self.getPolygon(index))]
+
+
+class WcsSelectImagesConfig(pexConfig.Config):
+    """Configuration for WcsSelectImagesTask"""
+    htmLevel = pexConfig.RangeField(
+        doc="HTM subdivision level of the spatial index of the image polygons",
+        dtype=int,
+        default=8,
+        min=0,
+        max=20,
+    )
+    indexFile = pexConfig.Field(
+        doc="Name of file in which to persist the spatial index of the image polygons, so that it need "
+            "only be built once for a given set of inputs; if None, the index is only kept in memory",
+        dtype=str,
+        default=None,
+        optional=True,
+    )
+
+
 class WcsSelectImagesTask(BaseSelectImagesTask):
     """Select images using their Wcs"""
+    ConfigClass = WcsSelectImagesConfig
+
+    def __init__(self, *args, **kwargs):
+        BaseSelectImagesTask.__init__(self, *args, **kwargs)
+        self._index = None
+        self._indexedList = None
+
+    def getIndex(self, selectDataList):
+        """Return a spatial index of the sky polygons of the images
+
+        The index is built on first use and retained, so that it is shared
+        between all patches processed with the same inputs. The same list
+        object is taken to hold the same inputs, so the key identifying the
+        inputs is only computed for a new list. If config.indexFile is set,
+        the index is read from that file when it matches the inputs, and
+        written there otherwise.
+
+        @param selectDataList: List of SelectStruct, to index
+        @return SkyPolygonIndex
+        """
+        level = self.config.htmLevel
+        if self._index is not None and self._index.level == level and selectDataList is self._indexedList:
+            return self._index
+        key = _makeIndexKey(selectDataList)
+        if self._index is not None and self._index.level == level and self._index.key == key:
+            self._indexedList = selectDataList
+            return self._index
+
+        index = None
+        if self.config.indexFile is not None:
+            index = SkyPolygonIndex.read(self.config.indexFile)
+            if index is not None and (index.key != key or index.level != level):
+                index = None
+        if index is None:
+            index = SkyPolygonIndex.build(selectDataList, level, log=self.log, key=key)
+            if self.config.indexFile is not None:
+                index.write(self.config.indexFile)
+        self._index = index
+        self._indexedList = selectDataList
+        return index
 
     def runDataRef(self, dataRef, coordList, makeDataRefList=True, selectDataList=[]):
         """Select images in the selectDataList that overlap the patch
@@ -181,6 +431,9 @@ class WcsSelectImagesTask(BaseSelectImagesTask):
         directly because the standard for the inputs to ConvexPolygon
         are pretty high and we don't want to be responsible for reaching them.
 
+        The image polygons are held in a SkyPolygonIndex (see getIndex), so
+        only the images near the patch need to be tested.
+
         @param dataRef: Data reference for coadd/tempExp (with tract, patch)
         @param coordList: List of ICRS coordinates (lsst.afw.geom.SpherePoint) specifying boundary of patch
         @param makeDataRefList: Construct a list of data references?
@@ -192,26 +445,12 @@ class WcsSelectImagesTask(BaseSelectImagesTask):
         patchVertices = [coord.getVector() for coord in coordList]
         patchPoly = lsst.sphgeom.ConvexPolygon.convexHull(patchVertices)
 
-        for data in selectDataList:
-            dataRef = data.dataRef
-            imageWcs = data.wcs
-            imageBox = data.bbox
-
-            try:
-                imageCorners = [imageWcs.pixelToSky(pix) for pix in afwGeom.Box2D(imageBox).getCorners()]
-            except (pexExceptions.DomainError, pexExceptions.RuntimeError) as e:
-                # Protecting ourselves from awful Wcs solutions in input images
-                self.log.debug("WCS error in testing calexp %s (%s): deselecting", dataRef.dataId, e)
-                continue
-
-            imagePoly = lsst.sphgeom.ConvexPolygon.convexHull([coord.getVector() for coord in imageCorners])
-            if imagePoly is None:
-                self.log.debug("Unable to create polygon from image %s: deselecting", dataRef.dataId)
-                continue
-            if patchPoly.intersects(imagePoly):  # "intersects" also covers "contains" or "is contained by"
-                self.log.info("Selecting calexp %s" % dataRef.dataId)
-                dataRefList.append(dataRef)
-                exposureInfoList.append(BaseExposureInfo(dataRef.dataId, imageCorners))
+        index = self.getIndex(selectDataList)
+        for i in index.query(patchPoly):
+            dataRef = selectDataList[i].dataRef
+            self.log.info("Selecting calexp %s" % dataRef.dataId)
+            dataRefList.append(dataRef)
+            exposureInfoList.append(BaseExposureInfo(dataRef.dataId, index.getCoordList(i)))
 
         return pipeBase.Struct(
             dataRefList=dataRefList if makeDataRefList else None,
@@ -219,7 +458,26 @@ class WcsSelectImagesTask(BaseSelectImagesTask):
         )
 
 
-class PsfWcsSelectImagesConfig(pexConfig.Config):
+class PsfQualityConfig(pexConfig.Config):
+    """Columns used to summarise the quality of the PSF model of an exposure"""
+    starSelection = pexConfig.Field(
+        doc="select star with this field",
+        dtype=str,
+        default='calib_psfUsed'
+    )
+    starShape = pexConfig.Field(
+        doc="name of star shape",
+        dtype=str,
+        default='base_SdssShape'
+    )
+    psfShape = pexConfig.Field(
+        doc="name of psf shape",
+        dtype=str,
+        default='base_SdssShape_psf'
+    )
+
+
+class PsfWcsSelectImagesConfig(WcsSelectImagesConfig, PsfQualityConfig):
     maxEllipResidual = pexConfig.Field(
         doc="Maximum median ellipticity residual",
         dtype=float,
@@ -237,21 +495,6 @@ class PsfWcsSelectImagesConfig(pexConfig.Config):
         default=0.009,
         optional=True,
     )
-    starSelection = pexConfig.Field(
-        doc="select star with this field",
-        dtype=str,
-        default='calib_psfUsed'
-    )
-    starShape = pexConfig.Field(
-        doc="name of star shape",
-        dtype=str,
-        default='base_SdssShape'
-    )
-    psfShape = pexConfig.Field(
-        doc="name of psf shape",
-        dtype=str,
-        default='base_SdssShape_psf'
-    )
 
 
 def sigmaMad(array):
@@ -259,12 +502,154 @@ def sigmaMad(array):
     return 1.4826*np.median(np.abs(array - np.median(array)))
 
 
+def computePsfQuality(srcCatalog, starSelection, starShape, psfShape):
+    """Compute a summary of the quality of the PSF model from the shapes of the PSF stars
+
+    @param srcCatalog: Catalog of sources, with star selection flag and star and PSF shapes
+    @param starSelection: Name of flag selecting the stars to use
+    @param starShape: Name of star shape
+    @param psfShape: Name of psf shape
+    @return a pipeBase Struct containing:
+    - medianE: magnitude of the median ellipticity residual
+    - scatterSize: robust scatter of the size residuals
+    - scaledScatterSize: robust scatter of the size residuals, scaled by the square of the median size
+    """
+    mask = srcCatalog[starSelection]
+
+    starXX = srcCatalog[starShape+'_xx'][mask]
+    starYY = srcCatalog[starShape+'_yy'][mask]
+    starXY = srcCatalog[starShape+'_xy'][mask]
+    psfXX = srcCatalog[psfShape+'_xx'][mask]
+    psfYY = srcCatalog[psfShape+'_yy'][mask]
+    psfXY = srcCatalog[psfShape+'_xy'][mask]
+
+    starSize = np.power(starXX*starYY - starXY**2, 0.25)
+    starE1 = (starXX - starYY)/(starXX + starYY)
+    starE2 = 2*starXY/(starXX + starYY)
+    medianSize = np.median(starSize)
+
+    psfSize = np.power(psfXX*psfYY - psfXY**2, 0.25)
+    psfE1 = (psfXX - psfYY)/(psfXX + psfYY)
+    psfE2 = 2*psfXY/(psfXX + psfYY)
+
+    medianE1 = np.abs(np.median(starE1 - psfE1))
+    medianE2 = np.abs(np.median(starE2 - psfE2))
+    medianE = np.sqrt(medianE1**2 + medianE2**2)
+
+    scatterSize = sigmaMad(starSize - psfSize)
+    scaledScatterSize = scatterSize/medianSize**2
+
+    return pipeBase.Struct(
+        medianE=medianE,
+        scatterSize=scatterSize,
+        scaledScatterSize=scaledScatterSize,
+    )
+
+
+def _getPsfQualityColumns(starSelection, starShape, psfShape):
+    """Return the description of the columns used for the PSF quality summary in exposure metadata"""
+    return ",".join((starSelection, starShape, psfShape))
+
+
+def setPsfQualityMetadata(metadata, quality, starSelection, starShape, psfShape):
+    """Record a PSF quality summary in exposure metadata
+
+    This allows image selection to use the summary by reading only the
+    exposure header, rather than the source catalog.
+
+    @param metadata: Exposure metadata (lsst.daf.base.PropertySet) to update
+    @param quality: PSF quality summary, from computePsfQuality
+    @param starSelection: Name of flag used to select the stars
+    @param starShape: Name of star shape used
+    @param psfShape: Name of psf shape used
+    """
+    metadata.set("PSF_QUALITY_COLUMNS", _getPsfQualityColumns(starSelection, starShape, psfShape))
+    metadata.set("PSF_QUALITY_MEDIAN_E", float(quality.medianE))
+    metadata.set("PSF_QUALITY_SIZE_SCATTER", float(quality.scatterSize))
+    metadata.set("PSF_QUALITY_SCALED_SIZE_SCATTER", float(quality.scaledScatterSize))
+
+
+def getPsfQualityFromMetadata(metadata, starSelection, starShape, psfShape):
+    """Retrieve a PSF quality summary recorded by setPsfQualityMetadata
+
+    @param metadata: Exposure metadata (lsst.daf.base.PropertySet)
+    @param starSelection: Name of flag to select the stars
+    @param starShape: Name of star shape
+    @param psfShape: Name of psf shape
+    @return PSF quality summary (as from computePsfQuality), or None if the metadata
+        has no summary computed from the requested columns
+    """
+    if not metadata.exists("PSF_QUALITY_COLUMNS"):
+        return None
+    if metadata.getScalar("PSF_QUALITY_COLUMNS") != _getPsfQualityColumns(starSelection, starShape, psfShape):
+        return None
+    return pipeBase.Struct(
+        medianE=metadata.getScalar("PSF_QUALITY_MEDIAN_E"),
+        scatterSize=metadata.getScalar("PSF_QUALITY_SIZE_SCATTER"),
+        scaledScatterSize=metadata.getScalar("PSF_QUALITY_SCALED_SIZE_SCATTER"),
+    )
+
+
+def setPsfSizeMetadata(metadata, psf):
+    """Record the size of the PSF model in exposure metadata
+
+    This allows image selection by seeing to read only the exposure header.
+
+    @param metadata: Exposure metadata (lsst.daf.base.PropertySet) to update
+    @param psf: PSF model (lsst.afw.detection.Psf)
+    """
+    metadata.set("PSF_DETERMINANT_RADIUS", psf.computeShape().getDeterminantRadius())
+
+
+def getPsfSizeFromMetadata(metadata):
+    """Retrieve the size of the PSF model recorded by setPsfSizeMetadata
+
+    @param metadata: Exposure metadata (lsst.daf.base.PropertySet)
+    @return determinant radius of the PSF model (pixels), or None if not recorded
+    """
+    if not metadata.exists("PSF_DETERMINANT_RADIUS"):
+        return None
+    return metadata.getScalar("PSF_DETERMINANT_RADIUS")
+
+
 class PsfWcsSelectImagesTask(WcsSelectImagesTask):
     """Select images using their Wcs and cuts on the PSF properties"""
 
     ConfigClass = PsfWcsSelectImagesConfig
     _DefaultName = "PsfWcsSelectImages"
 
+    def __init__(self, *args, **kwargs):
+        WcsSelectImagesTask.__init__(self, *args, **kwargs)
+        self._psfQuality = {}
+
+    def getPsfQuality(self, dataRef):
+        """Return the PSF quality summary for an exposure
+
+        The summary recorded in the calexp header by CalibrateTask is used if
+        available; otherwise it is computed from the src catalog (read without
+        footprints). Summaries are retained, so each exposure is only read
+        once however many patches it overlaps.
+
+        @param dataRef: Data reference for calexp
+        @return PSF quality summary, from computePsfQuality
+        """
+        key = tuple(sorted(dataRef.dataId.items()))
+        quality = self._psfQuality.get(key)
+        if quality is not None:
+            return quality
+        butler = dataRef.butlerSubset.butler
+        columns = (self.config.starSelection, self.config.starShape, self.config.psfShape)
+        try:
+            metadata = butler.get("calexp_md", dataRef.dataId, immediate=True)
+            quality = getPsfQualityFromMetadata(metadata, *columns)
+        except Exception as e:
+            self.log.debug("Unable to read PSF quality summary for %s: %s", dataRef.dataId, e)
+        if quality is None:
+            srcCatalog = butler.get('src', dataRef.dataId, flags=afwTable.SOURCE_IO_NO_FOOTPRINTS)
+            quality = computePsfQuality(srcCatalog, *columns)
+        self._psfQuality[key] = quality
+        return quality
+
     def runDataRef(self, dataRef, coordList, makeDataRefList=True, selectDataList=[]):
         """Select images in the selectDataList that overlap the patch and satisfy PSF quality critera.
 
@@ -277,6 +662,8 @@ class PsfWcsSelectImagesTask(WcsSelectImagesTask):
           - the robust scatter of the size residuals scaled by the square of
             the median size
 
+        The residuals are summarised per exposure by getPsfQuality.
+
         @param dataRef: Data reference for coadd/tempExp (with tract, patch)
         @param coordList: List of ICRS coordinates (lsst.afw.geom.SpherePoint) specifying boundary of patch
         @param makeDataRefList: Construct a list of data references?
@@ -288,32 +675,10 @@ class PsfWcsSelectImagesTask(WcsSelectImagesTask):
         dataRefList = []
         exposureInfoList = []
         for dataRef, exposureInfo in zip(result.dataRefList, result.exposureInfoList):
-            butler = dataRef.butlerSubset.butler
-            srcCatalog = butler.get('src', dataRef.dataId)
-            mask = srcCatalog[self.config.starSelection]
-
-            starXX = srcCatalog[self.config.starShape+'_xx'][mask]
-            starYY = srcCatalog[self.config.starShape+'_yy'][mask]
-            starXY = srcCatalog[self.config.starShape+'_xy'][mask]
-            psfXX = srcCatalog[self.config.psfShape+'_xx'][mask]
-            psfYY = srcCatalog[self.config.psfShape+'_yy'][mask]
-            psfXY = srcCatalog[self.config.psfShape+'_xy'][mask]
-
-            starSize = np.power(starXX*starYY - starXY**2, 0.25)
-            starE1 = (starXX - starYY)/(starXX + starYY)
-            starE2 = 2*starXY/(starXX + starYY)
-            medianSize = np.median(starSize)
-
-            psfSize = np.power(psfXX*psfYY - psfXY**2, 0.25)
-            psfE1 = (psfXX - psfYY)/(psfXX + psfYY)
-            psfE2 = 2*psfXY/(psfXX + psfYY)
-
-            medianE1 = np.abs(np.median(starE1 - psfE1))
-            medianE2 = np.abs(np.median(starE2 - psfE2))
-            medianE = np.sqrt(medianE1**2 + medianE2**2)
-
-            scatterSize = sigmaMad(starSize - psfSize)
-            scaledScatterSize = scatterSize/medianSize**2
+            quality = self.getPsfQuality(dataRef)
+            medianE = quality.medianE
+            scatterSize = quality.scatterSize
+            scaledScatterSize = quality.scaledScatterSize
 
             valid = True
             if self.config.maxEllipResidual and medianE > self.config.maxEllipResidual:
@@ -365,6 +730,36 @@ class BestSeeingWcsSelectImagesTask(WcsSelectImagesTask):
     """
     ConfigClass = BestSeeingWcsSelectImageConfig
 
+    def __init__(self, *args, **kwargs):
+        WcsSelectImagesTask.__init__(self, *args, **kwargs)
+        self._psfSizes = {}
+
+    def getPsfSize(self, dataRef):
+        """Return the size of the PSF model of an exposure
+
+        The size recorded in the calexp header by CalibrateTask is used if
+        available; otherwise the PSF is read along with a single pixel of the
+        calexp. Sizes are retained, so each exposure is only read once however
+        many patches it overlaps.
+
+        @param dataRef: Data reference for calexp (lsst.daf.persistence.ButlerDataRef)
+        @return determinant radius of the PSF model (pixels)
+        """
+        key = tuple(sorted(dataRef.dataId.items()))
+        psfSize = self._psfSizes.get(key)
+        if psfSize is not None:
+            return psfSize
+        try:
+            psfSize = getPsfSizeFromMetadata(dataRef.get("calexp_md", immediate=True))
+        except Exception as e:
+            self.log.debug("Unable to read PSF size for %s: %s" % (dataRef.dataId, e))
+        if psfSize is None:
+            bbox = afwGeom.Box2I(afwGeom.Point2I(0, 0), afwGeom.Extent2I(1, 1))
+            cal = dataRef.get("calexp_sub", bbox=bbox, immediate=True)
+            psfSize = cal.getPsf().computeShape().getDeterminantRadius()
+        self._psfSizes[key] = psfSize
+        return psfSize
+
     def runDataRef(self, dataRef, coordList, makeDataRefList=True,
                    selectDataList=None):
         """Select the best-seeing images in the selectDataList that overlap the patch.
@@ -403,10 +798,8 @@ class BestSeeingWcsSelectImagesTask(WcsSelectImagesTask):
         result = super().runDataRef(dataRef, coordList, makeDataRefList, selectDataList)
 
         for dataRef, exposureInfo in zip(result.dataRefList, result.exposureInfoList):
-            cal = dataRef.get("calexp", immediate=True)
-
             # if min/max PSF values are defined, remove images out of bounds
-            psfSize = cal.getPsf().computeShape().getDeterminantRadius()
+            psfSize = self.getPsfSize(dataRef)
             sizeFwhm = psfSize * np.sqrt(8.*np.log(2.))
             if self.config.maxPsfFwhm and sizeFwhm > self.config.maxPsfFwhm:
                 continue
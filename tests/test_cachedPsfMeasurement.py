@@ -0,0 +1,203 @@
+#
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+import unittest
+
+import numpy
+
+import lsst.utils.tests
+import lsst.afw.geom as afwGeom
+import lsst.afw.math as afwMath
+import lsst.afw.table as afwTable
+import lsst.afw.detection as afwDetect
+import lsst.meas.base.tests
+from lsst.meas.algorithms import CoaddPsf, KernelPsf
+from lsst.pipe.tasks.cachedPsfMeasurement import PsfImageCache, CachedPsfMeasurementTask
+
+
+class PsfImageCacheTestCase(lsst.utils.tests.TestCase):
+    """Test the cache of PSF images at positions snapped to a grid
+
+    The PSF is a CoaddPsf with two inputs of different widths, which leave a gap without coverage
+    between them.
+    """
+
+    def setUp(self):
+        self.wcs = afwGeom.makeSkyWcs(
+            crpix=afwGeom.Point2D(100, 50),
+            crval=afwGeom.SpherePoint(10, 45, afwGeom.degrees),
+            cdMatrix=afwGeom.makeCdMatrix(scale=5.1e-5*afwGeom.degrees),
+        )
+        schema = afwTable.ExposureTable.makeMinimalSchema()
+        weightKey = schema.addField("weight", type="D", doc="Weight of input")
+        inputs = afwTable.ExposureCatalog(schema)
+        for box, sigma in ((afwGeom.Box2I(afwGeom.Point2I(0, 0), afwGeom.Point2I(79, 99)), 2.0),
+                           (afwGeom.Box2I(afwGeom.Point2I(120, 0), afwGeom.Point2I(199, 99)), 3.0)):
+            kernel = afwMath.FixedKernel(afwDetect.GaussianPsf(25, 25, sigma).computeKernelImage())
+            record = inputs.addNew()
+            record.setPsf(KernelPsf(kernel, afwGeom.Box2D(box).getCenter()))
+            record.setWcs(self.wcs)
+            record.setBBox(box)
+            record.setValidPolygon(afwGeom.polygon.Polygon(afwGeom.Box2D(box)))
+            record.set(weightKey, 1.0)
+        self.psf = CoaddPsf(inputs, self.wcs)
+        self.gridSize = 20.0
+
+    def tearDown(self):
+        del self.psf
+
+    def assertKernelImagesEqual(self, image1, image2):
+        self.assertEqual(image1.getBBox(), image2.getBBox())
+        self.assertFloatsAlmostEqual(image1.getArray(), image2.getArray(), atol=1.0e-12, rtol=0.0)
+
+    def testTolerance(self):
+        """The cached PSF is the PSF at a grid point within half the grid spacing"""
+        cache = PsfImageCache(self.psf, self.gridSize, 100)
+        rng = numpy.random.RandomState(12345)
+        for x, y in zip(rng.uniform(0, 69, size=50), rng.uniform(0, 89, size=50)):
+            position = afwGeom.Point2D(x, y)
+            center = cache.getCenter(cache.getKey(position))
+            self.assertLessEqual(abs(center.getX() - position.getX()), 0.5*self.gridSize)
+            self.assertLessEqual(abs(center.getY() - position.getY()), 0.5*self.gridSize)
+            cached = cache.get(position)
+            self.assertKernelImagesEqual(cached.computeKernelImage(position),
+                                         self.psf.computeKernelImage(center))
+            # The PSF is constant within each input, so the cached PSF matches direct evaluation
+            self.assertKernelImagesEqual(cached.computeKernelImage(position),
+                                         self.psf.computeKernelImage(position))
+            self.assertFloatsAlmostEqual(cached.computeShape(position).getDeterminantRadius(),
+                                         self.psf.computeShape(position).getDeterminantRadius(), rtol=1.0e-6)
+        self.assertEqual(cache.hits + cache.misses, 50)
+        self.assertEqual(cache.misses, len(cache))
+        self.assertLessEqual(cache.misses, 4*5)
+        self.assertEqual(cache.evictions, 0)
+
+    def testBoundary(self):
+        """A position half way between grid points uses the upper grid point alone"""
+        cache = PsfImageCache(self.psf, self.gridSize, 100)
+        boundary = afwGeom.Point2D(50.0, 30.0)
+        self.assertEqual(cache.getKey(boundary), (3, 2))
+        self.assertEqual(cache.getKey(afwGeom.Point2D(49.999, 29.999)), (2, 1))
+        self.assertKernelImagesEqual(cache.get(boundary).computeKernelImage(boundary),
+                                     self.psf.computeKernelImage(afwGeom.Point2D(60.0, 40.0)))
+        # Positions on either side of the boundary use different images, but never a combination of them
+        inner = afwGeom.Point2D(130.0, 50.0)
+        outer = afwGeom.Point2D(129.999, 50.0)
+        self.assertKernelImagesEqual(cache.get(inner).computeKernelImage(inner),
+                                     self.psf.computeKernelImage(afwGeom.Point2D(140.0, 60.0)))
+        self.assertKernelImagesEqual(cache.get(outer).computeKernelImage(outer),
+                                     self.psf.computeKernelImage(afwGeom.Point2D(120.0, 60.0)))
+        self.assertEqual((cache.hits, cache.misses), (0, 3))
+
+    def testUncovered(self):
+        """Where the PSF cannot be evaluated at the grid point, the original PSF is used"""
+        cache = PsfImageCache(self.psf, self.gridSize, 100)
+        position = afwGeom.Point2D(75.0, 50.0)
+        center = cache.getCenter(cache.getKey(position))
+        self.assertEqual((center.getX(), center.getY()), (80.0, 60.0))
+        self.assertIs(cache.get(position), self.psf)
+        self.assertKernelImagesEqual(cache.get(position).computeKernelImage(position),
+                                     self.psf.computeKernelImage(position))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def testEviction(self):
+        """The least-recently used image is evicted when the cache is full"""
+        cache = PsfImageCache(self.psf, self.gridSize, 2)
+        first, second, third = (afwGeom.Point2D(x, 50.0) for x in (10.0, 30.0, 50.0))
+        cache.get(first)
+        cache.get(second)
+        cache.get(first)
+        cache.get(third)  # Evicts second
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (1, 3, 1))
+        cache.get(first)
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (2, 3, 1))
+        cache.get(second)
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (2, 4, 2))
+        stats = cache.getStats()
+        self.assertEqual((stats.hits, stats.misses, stats.evictions), (2, 4, 2))
+
+
+class CachedPsfMeasurementTestCase(lsst.utils.tests.TestCase):
+    """Test measurement with the PSF taken from the cache"""
+
+    def setUp(self):
+        self.dataset = lsst.meas.base.tests.TestDataset(afwGeom.Box2I(afwGeom.Point2I(0, 0),
+                                                                      afwGeom.Extent2I(120, 120)))
+        self.dataset.addSource(100000.0, afwGeom.Point2D(15.0, 20.0))
+        self.dataset.addSource(60000.0, afwGeom.Point2D(100.0, 25.0))
+        self.dataset.addSource(70000.0, afwGeom.Point2D(20.0, 27.0))
+        with self.dataset.addBlend() as family:
+            family.addChild(70000.0, afwGeom.Point2D(40.0, 60.0))
+            family.addChild(50000.0, afwGeom.Point2D(47.0, 62.0))
+        self.dataset.addSource(80000.0, afwGeom.Point2D(20.0, 100.0))
+
+    def tearDown(self):
+        del self.dataset
+
+    def measure(self, psfCacheGridSize):
+        """Measure the sources of the dataset
+
+        @param psfCacheGridSize: Spacing of the grid for caching the PSF; 0 for no cache
+        @return the measurement task, the exposure and the catalog of measured sources
+        """
+        config = CachedPsfMeasurementTask.ConfigClass()
+        config.plugins.names = ["base_SdssCentroid", "base_SdssShape", "base_PsfFlux", "base_GaussianFlux",
+                                "base_CircularApertureFlux"]
+        config.psfCacheGridSize = psfCacheGridSize
+        task = CachedPsfMeasurementTask(schema=lsst.meas.base.tests.TestDataset.makeMinimalSchema(),
+                                        config=config)
+        exposure, sources = self.dataset.realize(10.0, task.schema, randomSeed=12345)
+        task.run(sources, exposure, exposureId=123)
+        return task, exposure, sources
+
+    def testMeasure(self):
+        exactTask, _, exact = self.measure(0.0)
+        self.assertIsNone(exactTask.psfCacheStats)
+        self.assertFalse(exactTask.metadata.exists("psfCacheHits"))
+
+        task, exposure, cached = self.measure(30.0)
+        self.assertIsInstance(exposure.getPsf(), afwDetect.GaussianPsf)
+        self.assertEqual(task.psfCacheStats.hits + task.psfCacheStats.misses, len(cached))
+        self.assertGreater(task.psfCacheStats.hits, 0)
+        self.assertEqual(task.metadata.get("psfCacheHits"), task.psfCacheStats.hits)
+        self.assertEqual(task.metadata.get("psfCacheMisses"), task.psfCacheStats.misses)
+        self.assertEqual(task.metadata.get("psfCacheEvictions"), 0)
+
+        # The PSF is the same everywhere, so the cached images differ from it only by interpolation
+        self.assertEqual([source.getId() for source in cached], [source.getId() for source in exact])
+        for name in ("base_PsfFlux_flux", "base_SdssShape_psf_xx", "base_SdssShape_psf_yy"):
+            key = exact.schema.find(name).key
+            self.assertFloatsAlmostEqual(numpy.array([source.get(key) for source in cached]),
+                                         numpy.array([source.get(key) for source in exact]), rtol=1.0e-3)
+
+
+class MyMemoryTestCase(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,643 @@
+#
+# LSST Data Management System
+# Copyright 2008-2018 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+import csv
+import glob
+import os
+import shutil
+import sqlite3
+import tempfile
+import types
+import unittest
+
+import lsst.utils.tests
+from lsst.pipe.base import Struct
+from lsst.pipe.tasks.ingest import IngestTask, ParseTask, RegisterTask, iterRecursiveGlob
+from lsst.pipe.tasks.ingestCalibs import CalibsRegisterTask
+from lsst.pipe.tasks.ingestPgsql import PgsqlRegisterTask
+
+
+def makeInfo(visit, ccd, filterName="r"):
+    """Make the properties of a file, as from ParseTask.getInfo"""
+    return dict(object="field", visit=visit, ccd=ccd, filter=filterName, date="2018-01-01",
+                taiObs="2018-01-01T00:00:00", expTime=30.0)
+
+
+def writeFitsHeader(fd, cards):
+    """Write a FITS header, padded to a whole block
+
+    @param fd: File to write
+    @param cards: List of (keyword, value) tuples
+    """
+    header = ""
+    for key, value in cards:
+        if isinstance(value, bool):
+            value = "%20s" % ("T" if value else "F")
+        elif isinstance(value, int):
+            value = "%20d" % value
+        else:
+            value = "'%-8s'" % value
+        header += ("%-8s= %s" % (key, value)).ljust(80)
+    header += "END".ljust(80)
+    header += " "*(-len(header) % 2880)
+    fd.write(header.encode("ascii"))
+
+
+def writeMef(filename, extnames):
+    """Write a multi-extension FITS file with empty extensions of the provided names"""
+    with open(filename, "wb") as fd:
+        writeFitsHeader(fd, [("SIMPLE", True), ("BITPIX", 8), ("NAXIS", 0), ("EXTEND", True)])
+        for extname in extnames:
+            writeFitsHeader(fd, [("XTENSION", "IMAGE"), ("BITPIX", 8), ("NAXIS", 0), ("PCOUNT", 0),
+                                 ("GCOUNT", 1), ("EXTNAME", extname)])
+
+
+class ExtensionParseTask(ParseTask):
+    """ParseTask that identifies extensions by the full value of EXTNAME"""
+
+    @staticmethod
+    def getExtensionName(md):
+        return md.get("EXTNAME").strip() if md.exists("EXTNAME") else None
+
+
+class ReadExtensionMetadataTestCase(unittest.TestCase):
+    """Test reading the headers of the extensions of a multi-extension FITS file"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "mef.fits")
+        writeMef(self.filename, ["CCD1", "CCD2", "CCD3", "CCD4"])
+        self.task = ExtensionParseTask(name="parse")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def testRead(self):
+        """The requested extensions are returned in HDU order"""
+        found = self.task.readExtensionMetadata(self.filename, ["CCD3", "CCD1"])
+        self.assertEqual([(extnum, self.task.getExtensionName(md)) for extnum, md in found],
+                         [(1, "CCD1"), (3, "CCD3")])
+
+    def testMissing(self):
+        """A missing extension does not prevent the others from being returned"""
+        found = self.task.readExtensionMetadata(self.filename, ["CCD4", "MISSING", "CCD2"])
+        self.assertEqual([(extnum, self.task.getExtensionName(md)) for extnum, md in found],
+                         [(2, "CCD2"), (4, "CCD4")])
+
+
+class RegisterTestCase(unittest.TestCase):
+    """Test the registry operations of RegisterTask"""
+
+    def setUp(self):
+        self.config = RegisterTask.ConfigClass()
+        self.conn = sqlite3.connect(":memory:")
+
+    def tearDown(self):
+        self.conn.close()
+
+    def makeTask(self):
+        task = RegisterTask(config=self.config, name="register")
+        task.createTable(self.conn)
+        return task
+
+    def count(self, table="raw"):
+        return self.conn.execute("SELECT COUNT(*) FROM %s" % table).fetchone()[0]
+
+    def testAddRows(self):
+        """Adding rows in bulk is equivalent to adding them one at a time"""
+        task = self.makeTask()
+        infoList = [makeInfo(visit, ccd) for visit in (1, 2) for ccd in range(3)]
+        task.addRows(self.conn, infoList[:4])
+        for info in infoList[4:]:
+            task.addRow(self.conn, info)
+        self.assertEqual(self.count(), len(infoList))
+        self.assertTrue(task.check(self.conn, makeInfo(2, 1)))
+        self.assertFalse(task.check(self.conn, makeInfo(3, 1)))
+        task.addVisits(self.conn)
+        self.assertEqual(self.count("raw_visit"), 2)
+
+    def testAddVisits(self):
+        """The visit table may be updated for only the visits touched"""
+        task = self.makeTask()
+        task.addRows(self.conn, [makeInfo(visit, 0) for visit in (1, 2, 3)])
+        task.addVisits(self.conn, visits=["2", 3, 4])
+        visits = [row[0] for row in self.conn.execute("SELECT visit FROM raw_visit ORDER BY visit")]
+        self.assertEqual(visits, [2, 3])
+        task.addVisits(self.conn)
+        self.assertEqual(self.count("raw_visit"), 3)
+
+    def testIndexes(self):
+        """Indexes are created with the tables, and added to existing registries"""
+        def getIndexes():
+            sql = "SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL"
+            return set(row[0] for row in self.conn.execute(sql))
+
+        task = self.makeTask()
+        self.assertEqual(getIndexes(), {"raw_visit_idx"})
+        self.conn.execute("DROP INDEX raw_visit_idx")
+        self.conn.execute("DROP TABLE raw_manifest")
+        self.assertEqual(getIndexes(), set())
+        task.updateTables(self.conn)
+        task.updateTables(self.conn)
+        self.assertEqual(getIndexes(), {"raw_visit_idx"})
+        self.assertEqual(task.readManifest(self.conn), {})
+
+    def testManifest(self):
+        """Files recorded in the manifest are skipped unless modified"""
+        task = self.makeTask()
+        directory = tempfile.mkdtemp()
+        try:
+            filenames = [os.path.join(directory, "file%d.fits" % ii) for ii in range(3)]
+            for filename in filenames:
+                with open(filename, "w") as fd:
+                    fd.write("data")
+            entries = []
+            for filename in filenames[:2]:
+                stat = os.stat(filename)
+                entries.append((filename, stat.st_size, stat.st_mtime))
+            task.addManifest(self.conn, entries)
+            task.addManifest(self.conn, entries[:1])
+            manifest = task.readManifest(self.conn)
+            self.assertEqual(len(manifest), 2)
+
+            with open(filenames[1], "a") as fd:
+                fd.write("more data")
+            ingest = IngestTask(name="ingest")
+            self.assertEqual(list(ingest.skipIngested(filenames, manifest)), filenames[1:])
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def testIgnore(self):
+        """Duplicate rows are skipped when the 'ignore' option is set"""
+        self.config.ignore = True
+        task = self.makeTask()
+        task.addRows(self.conn, [makeInfo(1, 0), makeInfo(1, 1)])
+        task.addRows(self.conn, [makeInfo(1, 1), makeInfo(1, 2), makeInfo(1, 2)])
+        task.addRow(self.conn, makeInfo(1, 0))
+        self.assertEqual(self.count(), 3)
+
+    def testDuplicate(self):
+        """Duplicate rows are an error when the 'ignore' option is not set"""
+        task = self.makeTask()
+        task.addRows(self.conn, [makeInfo(1, 0)])
+        with self.assertRaises(sqlite3.IntegrityError):
+            task.addRows(self.conn, [makeInfo(1, 1), makeInfo(1, 0)])
+
+
+class RegistryContextTestCase(unittest.TestCase):
+    """Test updating a registry on disk"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.registryName = os.path.join(self.directory, "registry.sqlite3")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def count(self):
+        conn = sqlite3.connect(self.registryName)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM raw").fetchone()[0]
+        finally:
+            conn.close()
+
+    def checkUpdate(self, inPlace):
+        config = RegisterTask.ConfigClass()
+        config.inPlace = inPlace
+        task = RegisterTask(config=config, name="register")
+        with task.openRegistry(self.directory) as registry:
+            task.addRows(registry, [makeInfo(1, 0), makeInfo(1, 1)])
+        self.assertEqual(self.count(), 2)
+
+        with task.openRegistry(self.directory) as registry:
+            task.addRows(registry, [makeInfo(2, 0)])
+        self.assertEqual(self.count(), 3)
+
+        with self.assertRaises(RuntimeError):
+            with task.openRegistry(self.directory) as registry:
+                task.addRows(registry, [makeInfo(3, 0)])
+                raise RuntimeError("Failed ingest")
+        self.assertEqual(self.count(), 3)
+
+    def testCopy(self):
+        """Update a copy of the registry and rename it over the original"""
+        self.checkUpdate(False)
+
+    def testInPlace(self):
+        """Update the registry in place, rolling back on failure"""
+        self.checkUpdate(True)
+        self.assertEqual(os.listdir(self.directory), ["registry.sqlite3"])
+
+
+class ExpandFilesTestCase(unittest.TestCase):
+    """Test the expansion of file names and glob patterns"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for path in ["a.fits", "b.txt", ".hidden.fits", "x/c.fits", "x/y/d.fits", "x/y/e.txt",
+                     "x/.h/f.fits", "z/y/g.fits", "z/bad.fits"]:
+            filename = os.path.join(self.directory, path)
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, "w"):
+                pass
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def testRecursiveGlob(self):
+        """Recursive patterns match the files glob would match"""
+        for pattern in ["**/*.fits", "**", "x/**/*.fits", "**/y/*", "*/**/y/*.fits", "**/**/*.txt",
+                        "x/y/**"]:
+            fullPattern = os.path.join(self.directory, pattern)
+            expected = sorted(set(filename for filename in glob.glob(fullPattern, recursive=True) if
+                                  not os.path.isdir(filename)))  # glob may repeat matches for "**/**"
+            self.assertEqual(sorted(iterRecursiveGlob(fullPattern)), expected, msg=pattern)
+        self.assertEqual(list(iterRecursiveGlob(os.path.join(self.directory, "none/**"))), [])
+
+    def testExpandFiles(self):
+        """Files are expanded lazily, skipping bad files"""
+        task = IngestTask(name="ingest")
+        patterns = [os.path.join(self.directory, pattern) for pattern in ["*.fits", "**/*.fits", "*.none"]]
+        files = task.expandFiles(patterns, badFileList=["bad*"])
+        self.assertEqual(next(files), os.path.join(self.directory, "a.fits"))
+        self.assertEqual([os.path.relpath(filename, self.directory) for filename in files],
+                         ["a.fits", "x/c.fits", "x/y/d.fits", "z/y/g.fits"])
+
+
+class DeliverFilesTestCase(unittest.TestCase):
+    """Test the delivery of files to the repository"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def checkDeliver(self, transferThreads):
+        config = IngestTask.ConfigClass()
+        config.transferThreads = transferThreads
+        task = IngestTask(config=config, name="ingest")
+        args = types.SimpleNamespace(mode="copy", dryrun=False, ignoreIngested=False)
+        preparedList = []
+        for ii in range(10):
+            infile = os.path.join(self.directory, "in%d.fits" % ii)
+            outfile = os.path.join(self.directory, "out%d" % transferThreads, "%d.fits" % ii)
+            with open(infile, "w") as fd:
+                fd.write("data %d" % ii)
+            prepared = Struct(infile=infile, outfile=outfile, fileInfo={}, hduInfoList=[ii])
+            preparedList.append((infile, prepared, None))
+        preparedList[3] = (preparedList[3][0], None, "bad file")
+        os.makedirs(os.path.dirname(preparedList[5][1].outfile))
+        with open(preparedList[5][1].outfile, "w") as fd:
+            fd.write("existing")
+
+        results = list(task.deliverFiles(iter(preparedList), None, args))
+        self.assertEqual([infile for infile, _, _, _ in results], [infile for infile, _, _ in preparedList])
+        for ii, (infile, prepared, hduInfoList, error) in enumerate(results):
+            if ii == 3:
+                self.assertEqual(error, "bad file")
+            elif ii == 5:
+                self.assertIsNone(hduInfoList)
+                self.assertIn("already exists", error)
+            else:
+                self.assertIsNone(error)
+                self.assertEqual(hduInfoList, [ii])
+                with open(prepared.outfile) as fd:
+                    self.assertEqual(fd.read(), "data %d" % ii)
+
+    def testSerial(self):
+        """Files are delivered as they are examined"""
+        self.checkDeliver(1)
+
+    def testThreads(self):
+        """Files are delivered by a pool of threads, but results are in order"""
+        self.checkDeliver(3)
+
+
+class FakeParseTask:
+    """Stand-in for ParseTask, reading the visit and ccd from the contents of the file"""
+
+    def __init__(self, outputDir):
+        self.outputDir = outputDir
+
+    def getInfo(self, filename):
+        with open(filename) as fd:
+            visit, ccd = [int(value) for value in fd.read().split()]
+        info = makeInfo(visit, ccd)
+        return info, [info]
+
+    def getDestination(self, butler, info, filename):
+        return os.path.join(self.outputDir, os.path.basename(filename))
+
+
+class RecordingLog:
+    """Stand-in for a task's log, recording the warnings"""
+
+    def __init__(self):
+        self.warnings = []
+
+    def warn(self, message, *args):
+        self.warnings.append(message % args if args else message)
+
+    def info(self, message, *args):
+        pass
+
+
+class PrepareFilesTestCase(unittest.TestCase):
+    """Test the examination of files in worker processes"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filenames = []
+        for ii in range(40):
+            filename = os.path.join(self.directory, "%02d.fits" % ii)
+            with open(filename, "w") as fd:
+                fd.write("%d 0" % ii)
+            self.filenames.append(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def testStreaming(self):
+        """Files are drawn from the iterable only as the workers need them, and results are in order"""
+        task = IngestTask(name="ingest")
+        task.parse = FakeParseTask(os.path.join(self.directory, "output"))
+        args = types.SimpleNamespace(badFile=None, badId=types.SimpleNamespace(idList=[]), butler=None,
+                                     processes=2)
+        drawn = []
+
+        def generateFiles():
+            for filename in self.filenames:
+                drawn.append(filename)
+                yield filename
+
+        results = task.prepareFiles(generateFiles(), args)
+        first = next(results)
+        self.assertLessEqual(len(drawn), 4*2 + 1)
+        results = [first] + list(results)
+        self.assertEqual(drawn, self.filenames)
+        self.assertEqual([infile for infile, _, _ in results], self.filenames)
+        for ii, (infile, prepared, error) in enumerate(results):
+            self.assertIsNone(error)
+            self.assertEqual(prepared.fileInfo["visit"], ii)
+
+
+class IngestRunTestCase(unittest.TestCase):
+    """Test ingesting files into a registry with IngestTask.run"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.inputDir = os.path.join(self.directory, "input")
+        os.makedirs(self.inputDir)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def writeFile(self, name, contents):
+        with open(os.path.join(self.inputDir, name), "w") as fd:
+            fd.write(contents)
+
+    def runIngest(self, name, processes=1, transferThreads=1, ignoreIngested=False, log=None):
+        """Ingest all the input files into a new repository
+
+        @return rows of the registry file table, without the ids
+        """
+        config = IngestTask.ConfigClass()
+        config.transferThreads = transferThreads
+        task = IngestTask(config=config, name="ingest")
+        root = os.path.join(self.directory, name)
+        os.makedirs(root)
+        task.parse = FakeParseTask(root)
+        if log is not None:
+            task.log = log
+        args = types.SimpleNamespace(files=[os.path.join(self.inputDir, "*.fits")], input=root, create=True,
+                                     dryrun=False, mode="copy", badFile=None,
+                                     badId=types.SimpleNamespace(idList=[]), butler=None,
+                                     ignoreIngested=ignoreIngested, processes=processes)
+        task.run(args)
+        columns = list(config.register.columns)
+        conn = sqlite3.connect(os.path.join(root, "registry.sqlite3"))
+        try:
+            return conn.execute("SELECT %s FROM raw ORDER BY visit, ccd" % ",".join(columns)).fetchall()
+        finally:
+            conn.close()
+
+    def testDuplicateInRun(self):
+        """Files with the same unique key in one run are registered once, without aborting the run"""
+        self.writeFile("a.fits", "1 0")
+        self.writeFile("b.fits", "1 0")
+        self.writeFile("c.fits", "2 0")
+        for ignoreIngested in (False, True):
+            rows = self.runIngest("repo%s" % ignoreIngested, ignoreIngested=ignoreIngested)
+            self.assertEqual([(row[1], row[2]) for row in rows], [(1, 0), (2, 0)])
+
+    def testDuplicateManifest(self):
+        """Files whose rows were all dropped as duplicates in the run are not recorded in the manifest"""
+        self.writeFile("a.fits", "1 0")
+        self.writeFile("b.fits", "1 0")
+        self.writeFile("c.fits", "2 0")
+        rows = self.runIngest("repo")
+        self.assertEqual([(row[1], row[2]) for row in rows], [(1, 0), (2, 0)])
+        conn = sqlite3.connect(os.path.join(self.directory, "repo", "registry.sqlite3"))
+        try:
+            manifest = [os.path.basename(row[0]) for row in conn.execute("SELECT path FROM raw_manifest")]
+        finally:
+            conn.close()
+        self.assertEqual(len(manifest), 2)
+        self.assertIn("c.fits", manifest)
+        self.assertEqual(len(set(manifest) & {"a.fits", "b.fits"}), 1)
+
+    def testDuplicateInFlight(self):
+        """Files with the same unique key as a file being delivered on another thread are not delivered"""
+        for ii in range(8):
+            self.writeFile("%02d.fits" % ii, "%d 0" % (ii//2))
+        rows = self.runIngest("repo", transferThreads=4, ignoreIngested=True)
+        self.assertEqual([(row[1], row[2]) for row in rows], [(0, 0), (1, 0), (2, 0), (3, 0)])
+        # The files are found in directory order, so either of each pair may be delivered, but not both
+        delivered = glob.glob(os.path.join(self.directory, "repo", "*.fits"))
+        self.assertEqual(sorted(int(os.path.basename(filename)[:2])//2 for filename in delivered),
+                         [0, 1, 2, 3])
+
+    def testParallel(self):
+        """Examining files in worker processes and delivering them on threads registers the same rows"""
+        for ii in range(12):
+            self.writeFile("%02d.fits" % ii, "%d %d" % (ii//4, ii % 4))
+        expected = self.runIngest("serial")
+        self.assertEqual(len(expected), 12)
+        self.assertEqual(self.runIngest("processes", processes=3), expected)
+        self.assertEqual(self.runIngest("threads", transferThreads=3), expected)
+        self.assertEqual(self.runIngest("both", processes=3, transferThreads=3), expected)
+
+    def testWorkerFailure(self):
+        """A file that cannot be examined by a worker is reported, and the other files are ingested"""
+        for ii in range(6):
+            self.writeFile("%02d.fits" % ii, "%d 0" % ii)
+        self.writeFile("03.fits", "unparseable")
+        log = RecordingLog()
+        rows = self.runIngest("repo", processes=2, log=log)
+        self.assertEqual([row[1] for row in rows], [0, 1, 2, 4, 5])
+        failures = [message for message in log.warnings if "Failed to ingest" in message]
+        self.assertEqual(len(failures), 1)
+        self.assertIn("03.fits", failures[0])
+
+
+class FakePgsqlCursor:
+    """Stand-in for a psycopg2 cursor, translating to sqlite
+
+    Supports just the statements used by PgsqlRegisterTask.addRows.
+    """
+
+    def __init__(self, conn):
+        self.cursor = conn.cursor()
+
+    def execute(self, sql, values=()):
+        sql = sql.replace(" WITH NO DATA", " LIMIT 0")
+        sql = sql.replace(" ON CONFLICT", " WHERE true ON CONFLICT")  # sqlite's syntax for INSERT ... SELECT
+        self.cursor.execute(sql, values)
+
+    def copy_expert(self, sql, stream):
+        table = sql.split()[1]
+        numColumns = len(sql[sql.index("(") + 1:sql.index(")")].split(","))
+        rows = list(csv.reader(stream))  # column affinity restores the types
+        self.cursor.executemany("INSERT INTO %s VALUES (%s)" % (table, ",".join(["?"]*numColumns)), rows)
+
+
+class FakePgsqlConnection:
+    """Stand-in for a psycopg2 connection, backed by sqlite"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self):
+        return FakePgsqlCursor(self.conn)
+
+
+class PgsqlRegisterTestCase(unittest.TestCase):
+    """Test the bulk loading of PgsqlRegisterTask, with a stand-in for PostgreSQL"""
+
+    def setUp(self):
+        self.config = PgsqlRegisterTask.ConfigClass()
+        self.conn = sqlite3.connect(":memory:")
+        RegisterTask(config=self.config, name="register").createTable(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def testAddRows(self):
+        """Rows are copied to a staging table and merged into the file table"""
+        self.config.ignore = True
+        task = PgsqlRegisterTask(config=self.config, name="register")
+        infoList = [makeInfo(visit, ccd) for visit in (1, 2) for ccd in range(3)]
+        task.addRows(FakePgsqlConnection(self.conn), infoList[:4])
+        task.addRows(FakePgsqlConnection(self.conn), infoList[2:])
+        columns = list(self.config.columns)
+        rows = self.conn.execute("SELECT %s FROM raw ORDER BY visit, ccd" % ",".join(columns)).fetchall()
+        expected = [tuple(info[col] for col in columns) for info in infoList]
+        self.assertEqual(rows, expected)
+        tables = self.conn.execute("SELECT name FROM sqlite_temp_master WHERE type='table'").fetchall()
+        self.assertEqual(tables, [])
+
+    def testDuplicate(self):
+        """Duplicate rows are an error when the 'ignore' option is not set"""
+        task = PgsqlRegisterTask(config=self.config, name="register")
+        task.addRows(FakePgsqlConnection(self.conn), [makeInfo(1, 0)])
+        with self.assertRaises(sqlite3.IntegrityError):
+            task.addRows(FakePgsqlConnection(self.conn), [makeInfo(1, 1), makeInfo(1, 0)])
+
+
+class CalibsRegisterTestCase(unittest.TestCase):
+    """Test the validity range updates of CalibsRegisterTask"""
+
+    def setUp(self):
+        config = CalibsRegisterTask.ConfigClass()
+        config.columns = {"filter": "text", "ccd": "int", "calibDate": "text",
+                          "validStart": "text", "validEnd": "text"}
+        config.unique = ["filter", "ccd", "calibDate"]
+        config.visit = ["calibDate"]
+        config.tables = ["flat", "defect"]
+        self.task = CalibsRegisterTask(config=config, name="register")
+        self.conn = sqlite3.connect(":memory:")
+        self.task.createTable(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def addCalibs(self, table, ccd, dates):
+        self.task.addRows(self.conn, [dict(filter="r", ccd=ccd, calibDate=date) for date in dates],
+                          table=table)
+
+    def getValidity(self, table, ccd):
+        sql = "SELECT calibDate, validStart, validEnd FROM %s WHERE ccd=? ORDER BY calibDate" % table
+        return [tuple(row) for row in self.conn.execute(sql, (ccd,))]
+
+    def testValidity(self):
+        """Validity ranges are trimmed at midpoints, or run until superseded"""
+        self.addCalibs("flat", 0, ["2018-01-01", "2018-01-05", "2018-02-01"])
+        self.addCalibs("defect", 0, ["2018-01-01", "2018-03-01"])
+        self.task.updateValidityRanges(self.conn, 10)
+        self.assertEqual(self.getValidity("flat", 0),
+                         [("2018-01-01", "2017-12-22", "2018-01-03"),
+                          ("2018-01-05", "2018-01-04", "2018-01-15"),
+                          ("2018-02-01", "2018-01-22", "2018-02-11")])
+        self.assertEqual(self.getValidity("defect", 0),
+                         [("2018-01-01", "2018-01-01", "2018-02-28"),
+                          ("2018-03-01", "2018-03-01", "2037-12-31")])
+
+    def testTouched(self):
+        """Only the detectors touched are updated"""
+        self.addCalibs("flat", 0, ["2018-01-01"])
+        self.addCalibs("flat", 1, ["2018-01-01"])
+        self.task.updateValidityRanges(self.conn, 10, detectors={"flat": {("r", 1)}})
+        self.assertEqual(self.getValidity("flat", 0), [("2018-01-01", "None", "None")])
+        self.assertEqual(self.getValidity("flat", 1), [("2018-01-01", "2017-12-22", "2018-01-11")])
+
+        self.addCalibs("flat", 1, ["2018-01-03"])
+        self.task.updateValidityRanges(self.conn, 10, detectors={"flat": [("r", 1)]})
+        self.assertEqual(self.getValidity("flat", 1), [("2018-01-01", "2017-12-22", "2018-01-02"),
+                                                       ("2018-01-03", "2018-01-03", "2018-01-13")])
+
+    def testMissingTable(self):
+        """Opening a registry without some of the configured tables adds indexes to those present"""
+        conn = sqlite3.connect(":memory:")
+        try:
+            RegisterTask.createTable(self.task, conn, table="flat")
+            conn.execute("DROP INDEX flat_calibDate_idx")
+            self.task.updateTables(conn)
+            sql = "SELECT name FROM sqlite_master WHERE type='index' AND name LIKE '%_idx'"
+            indexes = [row[0] for row in conn.execute(sql)]
+            self.assertEqual(indexes, ["flat_calibDate_idx"])
+        finally:
+            conn.close()
+
+
+class MyMemoryTestCase(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
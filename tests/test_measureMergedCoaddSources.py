@@ -0,0 +1,230 @@
+#
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+import unittest
+
+import numpy
+
+import lsst.utils.tests
+import lsst.afw.geom as afwGeom
+import lsst.afw.table as afwTable
+import lsst.afw.detection as afwDetect
+import lsst.meas.base.tests
+from lsst.pipe.tasks.multiBand import (MeasureMergedCoaddSourcesConfig, MeasureMergedCoaddSourcesTask,
+                                       partitionFamilies)
+
+
+class PartitionFamiliesTestCase(lsst.utils.tests.TestCase):
+    """Test the division of families of sources among worker processes"""
+
+    def checkPartitions(self, partitions, numFamilies):
+        """Check that the partitions are contiguous and cover all families"""
+        self.assertEqual(partitions[0][0], 0)
+        self.assertEqual(partitions[-1][1], numFamilies)
+        for (start1, stop1), (start2, stop2) in zip(partitions[:-1], partitions[1:]):
+            self.assertLess(start1, stop1)
+            self.assertEqual(stop1, start2)
+
+    def testEqualWeights(self):
+        partitions = partitionFamilies([1]*10, 4)
+        self.checkPartitions(partitions, 10)
+        self.assertEqual(partitions, [(0, 3), (3, 5), (5, 8), (8, 10)])
+
+    def testHeavyFamily(self):
+        """A heavy family gets a group of its own"""
+        partitions = partitionFamilies([100, 1, 1, 1], 4)
+        self.checkPartitions(partitions, 4)
+        self.assertEqual(partitions, [(0, 1), (1, 4)])
+
+    def testFewFamilies(self):
+        """There are never more groups than families"""
+        self.assertEqual(partitionFamilies([5], 8), [(0, 1)])
+        self.assertEqual(partitionFamilies([], 8), [])
+
+
+class DeblendFamiliesTestCase(lsst.utils.tests.TestCase):
+    """Test that deblending in worker processes matches deblending in a single process"""
+
+    def setUp(self):
+        self.dataset = lsst.meas.base.tests.TestDataset(afwGeom.Box2I(afwGeom.Point2I(0, 0),
+                                                                      afwGeom.Extent2I(120, 120)))
+        self.dataset.addSource(100000.0, afwGeom.Point2D(15.0, 20.0))
+        with self.dataset.addBlend() as family:
+            family.addChild(70000.0, afwGeom.Point2D(40.0, 60.0))
+            family.addChild(50000.0, afwGeom.Point2D(47.0, 62.0))
+        self.dataset.addSource(80000.0, afwGeom.Point2D(20.0, 100.0))
+        with self.dataset.addBlend() as family:
+            family.addChild(90000.0, afwGeom.Point2D(90.0, 90.0))
+            family.addChild(40000.0, afwGeom.Point2D(96.0, 94.0))
+            family.addChild(30000.0, afwGeom.Point2D(88.0, 98.0))
+        with self.dataset.addBlend() as family:
+            family.addChild(60000.0, afwGeom.Point2D(95.0, 20.0))
+            family.addChild(45000.0, afwGeom.Point2D(101.0, 24.0))
+
+        self.config = MeasureMergedCoaddSourcesConfig()
+        self.config.numPartitionsPerProcess = 2
+
+    def tearDown(self):
+        del self.dataset
+        del self.config
+
+    def deblend(self, numProcesses):
+        """Deblend the parents of the dataset
+
+        The parents are copied, with copies of their footprints, into a new catalog, so that the IDs of the
+        children are drawn from a fresh IdFactory, as for the merged detections.
+
+        @param numProcesses: Number of processes with which to deblend
+        @return Catalog of the parents and their children
+        """
+        self.config.numProcesses = numProcesses
+        task = MeasureMergedCoaddSourcesTask(schema=lsst.meas.base.tests.TestDataset.makeMinimalSchema(),
+                                             config=self.config)
+        exposure, truth = self.dataset.realize(10.0, self.dataset.schema, randomSeed=12345)
+        sources = afwTable.SourceCatalog(task.schema)
+        for source in truth:
+            if source.getParent() == 0:
+                original = source.getFootprint()
+                footprint = afwDetect.Footprint(original.spans, original.getPeaks().getSchema(),
+                                                original.getRegion())
+                footprint.getPeaks().extend(original.getPeaks(), deep=True)
+                sources.addNew().setFootprint(footprint)
+        if numProcesses > 1:
+            task.deblendFamilies(exposure, sources)
+        else:
+            task.deblend.run(exposure, sources)
+        return sources
+
+    def testDeblend(self):
+        serial = self.deblend(1)
+        parallel = self.deblend(3)
+        self.assertEqual(len(serial), 12)
+        self.assertEqual([source.getId() for source in parallel], [source.getId() for source in serial])
+        self.assertEqual([source.getParent() for source in parallel],
+                         [source.getParent() for source in serial])
+        nChildKey = serial.schema.find("deblend_nChild").key
+        self.assertEqual([source.get(nChildKey) for source in parallel],
+                         [source.get(nChildKey) for source in serial])
+        for source1, source2 in zip(parallel, serial):
+            footprint1 = source1.getFootprint()
+            footprint2 = source2.getFootprint()
+            self.assertEqual(footprint1.getSpans(), footprint2.getSpans())
+            self.assertEqual([(peak.getIx(), peak.getIy()) for peak in footprint1.getPeaks()],
+                             [(peak.getIx(), peak.getIy()) for peak in footprint2.getPeaks()])
+            self.assertEqual(footprint1.isHeavy(), footprint2.isHeavy())
+            if footprint2.isHeavy():
+                numpy.testing.assert_array_equal(footprint1.getImageArray(), footprint2.getImageArray())
+
+
+class MeasureFamiliesTestCase(lsst.utils.tests.TestCase):
+    """Test that measuring families in worker processes matches measuring in a single process"""
+
+    def setUp(self):
+        self.dataset = lsst.meas.base.tests.TestDataset(afwGeom.Box2I(afwGeom.Point2I(0, 0),
+                                                                      afwGeom.Extent2I(120, 120)))
+        self.dataset.addSource(100000.0, afwGeom.Point2D(15.0, 20.0))
+        self.dataset.addSource(60000.0, afwGeom.Point2D(100.0, 25.0))
+        with self.dataset.addBlend() as family:
+            family.addChild(70000.0, afwGeom.Point2D(40.0, 60.0))
+            family.addChild(50000.0, afwGeom.Point2D(47.0, 62.0))
+        self.dataset.addSource(80000.0, afwGeom.Point2D(20.0, 100.0))
+        with self.dataset.addBlend() as family:
+            family.addChild(90000.0, afwGeom.Point2D(90.0, 90.0))
+            family.addChild(40000.0, afwGeom.Point2D(96.0, 94.0))
+            family.addChild(30000.0, afwGeom.Point2D(88.0, 98.0))
+
+        self.config = MeasureMergedCoaddSourcesConfig()
+        self.config.doDeblend = False
+        self.config.doMatchSources = False
+        self.config.doPropagateFlags = False
+        self.config.doApCorr = False
+        self.config.doRunCatalogCalculation = False
+        self.config.measurement.plugins.names = ["base_SdssCentroid", "base_SdssShape", "base_PsfFlux",
+                                                 "base_GaussianFlux", "base_CircularApertureFlux"]
+        self.config.measurement.undeblended.names = ["base_PsfFlux"]
+        self.config.numPartitionsPerProcess = 2
+
+    def tearDown(self):
+        del self.dataset
+        del self.config
+        if hasattr(self, "task"):
+            del self.task
+
+    def measure(self, numProcesses):
+        """Measure the sources of the dataset
+
+        The task is retained as self.task.
+
+        @param numProcesses: Number of processes with which to measure
+        @return Catalog of the measured sources
+        """
+        self.config.numProcesses = numProcesses
+        task = MeasureMergedCoaddSourcesTask(schema=lsst.meas.base.tests.TestDataset.makeMinimalSchema(),
+                                             config=self.config)
+        self.task = task
+        exposure, sources = self.dataset.realize(10.0, task.schema, randomSeed=12345)
+        sources.sort(afwTable.SourceTable.getParentKey())
+        if numProcesses > 1:
+            task.measureFamilies(sources, exposure, exposureId=123)
+        else:
+            task.measurement.run(sources, exposure, exposureId=123)
+        return sources
+
+    def testMeasure(self):
+        serial = self.measure(1)
+        parallel = self.measure(3)
+        self.assertEqual(len(serial), 10)
+        self.assertEqual([source.getId() for source in parallel], [source.getId() for source in serial])
+        self.assertEqual(parallel.schema.getNames(), serial.schema.getNames())
+        for item in serial.schema:
+            values = numpy.array([source.get(item.key) for source in serial])
+            parallelValues = numpy.array([source.get(item.key) for source in parallel])
+            numpy.testing.assert_array_equal(parallelValues, values, err_msg=item.field.getName())
+        fluxKey = serial.schema.find("base_GaussianFlux_flux").key
+        self.assertTrue(numpy.isfinite([source.get(fluxKey) for source in serial]).all())
+
+    def testPsfCache(self):
+        """The PSF cache gives the same measurements in worker processes, and its statistics are combined"""
+        self.config.measurement.psfCacheGridSize = 30.0
+        serial = self.measure(1)
+        serialStats = self.task.measurement.psfCacheStats
+        parallel = self.measure(3)
+        metadata = self.task.measurement.metadata
+        self.assertEqual(serialStats.hits + serialStats.misses, len(serial))
+        self.assertEqual(metadata.get("psfCacheHits") + metadata.get("psfCacheMisses"), len(parallel))
+        self.assertGreaterEqual(metadata.get("psfCacheMisses"), serialStats.misses)
+        for item in serial.schema:
+            values = numpy.array([source.get(item.key) for source in serial])
+            parallelValues = numpy.array([source.get(item.key) for source in parallel])
+            numpy.testing.assert_array_equal(parallelValues, values, err_msg=item.field.getName())
+
+
+class MyMemoryTestCase(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
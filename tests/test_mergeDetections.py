@@ -0,0 +1,137 @@
+#
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+import time
+import unittest
+
+import lsst.utils.tests
+import lsst.afw.detection as afwDetect
+import lsst.afw.geom as afwGeom
+import lsst.afw.image.utils as afwImageUtils
+import lsst.afw.table as afwTable
+from lsst.pipe.tasks.multiBand import MergeDetectionsTask
+
+
+class CullPeaksTestCase(lsst.utils.tests.TestCase):
+    """Test the culling of peaks by MergeDetectionsTask"""
+
+    def setUp(self):
+        afwImageUtils.defineFilter("g", 470.0)
+        afwImageUtils.defineFilter("r", 620.0)
+        config = MergeDetectionsTask.ConfigClass()
+        config.priorityList = ["g", "r"]
+        config.cullPeaks.nBandsSufficient = 2
+        config.cullPeaks.rankSufficient = 4
+        config.cullPeaks.rankConsidered = 6
+        config.cullPeaks.rankNormalizedConsidered = 0.5
+        self.task = MergeDetectionsTask(schema=afwTable.SourceTable.makeMinimalSchema(), config=config)
+        self.peakSchema = self.task.merged.getPeakSchema()
+
+    def tearDown(self):
+        afwImageUtils.resetFilters()
+        del self.task
+
+    def makeSource(self, catalog, bandsList):
+        """Add a source with a peak for each entry in a list of the bands in which each peak is detected"""
+        footprint = afwDetect.Footprint(afwGeom.SpanSet(afwGeom.Box2I(afwGeom.Point2I(0, 0),
+                                                                      afwGeom.Extent2I(20, 20))),
+                                        self.peakSchema)
+        for ii, bands in enumerate(bandsList):
+            peak = footprint.addPeak(ii, ii, float(len(bandsList) - ii))
+            for band in bands:
+                peak.set("merge_peak_%s" % band, True)
+        source = catalog.addNew()
+        source.setFootprint(footprint)
+        return source
+
+    def testCull(self):
+        """Faint peaks detected in a single band are culled from large families"""
+        catalog = afwTable.SourceCatalog(self.task.schema)
+        small = self.makeSource(catalog, [["g"]]*4)
+        large = self.makeSource(catalog, [["g"]]*8 + [["g", "r"], ["r"]])
+        self.task.cullPeaks(catalog)
+        self.assertEqual([peak.getIx() for peak in small.getFootprint().getPeaks()], [0, 1, 2, 3])
+        # Ranks 0-3 are always kept; rank 4 is kept as it is less than 0.5*10; rank 8 is kept as it is
+        # detected in two bands
+        self.assertEqual([peak.getIx() for peak in large.getFootprint().getPeaks()], [0, 1, 2, 3, 4, 8])
+
+
+class DummyDataRef:
+    """Quacks like a lsst.daf.persistence.ButlerDataRef for reading a catalog slowly"""
+
+    def __init__(self, dataId, catalog, delay):
+        self.dataId = dataId
+        self.catalog = catalog
+        self.delay = delay
+
+    def get(self, datasetType, immediate=True, **kwargs):
+        time.sleep(self.delay)
+        return self.catalog
+
+
+class ReadCatalogsTestCase(lsst.utils.tests.TestCase):
+    """Test the reading of the catalogs to merge"""
+
+    def setUp(self):
+        afwImageUtils.defineFilter("g", 470.0)
+        afwImageUtils.defineFilter("r", 620.0)
+        afwImageUtils.defineFilter("i", 750.0)
+
+    def tearDown(self):
+        afwImageUtils.resetFilters()
+
+    def testOrder(self):
+        """Catalogs read with several threads are returned in the order of the data references"""
+        config = MergeDetectionsTask.ConfigClass()
+        config.priorityList = ["g", "r", "i"]
+        config.readThreads = 3
+        task = MergeDetectionsTask(schema=afwTable.SourceTable.makeMinimalSchema(), config=config)
+        filterNames = ["i", "g", "r", "g", "i", "r"]
+        catalogs = [afwTable.SourceCatalog(afwTable.SourceTable.makeMinimalSchema()) for _ in filterNames]
+        # The first data references are the slowest to read, so they finish last
+        patchRefList = [DummyDataRef(dict(tract=0, patch="1,1", filter=filterName), catalog,
+                                     0.05*(len(filterNames) - ii)) for
+                        ii, (filterName, catalog) in enumerate(zip(filterNames, catalogs))]
+        results = task.readCatalogs(patchRefList)
+        self.assertEqual([filterName for filterName, _ in results], filterNames)
+        for (_, catalog), expected in zip(results, catalogs):
+            self.assertIs(catalog, expected)
+
+    def testValidateFootprints(self):
+        """Footprints are required to merge detections"""
+        config = MergeDetectionsTask.ConfigClass()
+        config.validate()
+        config.readFootprints = False
+        with self.assertRaises(RuntimeError):
+            config.validate()
+
+
+class MyMemoryTestCase(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
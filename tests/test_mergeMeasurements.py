@@ -0,0 +1,127 @@
+#
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+import unittest
+
+import lsst.utils.tests
+import lsst.afw.image.utils as afwImageUtils
+import lsst.afw.table as afwTable
+from lsst.pipe.tasks.multiBand import MergeMeasurementsTask
+
+
+class MergeMeasurementsTestCase(lsst.utils.tests.TestCase):
+    """Test the choice of reference band by MergeMeasurementsTask"""
+
+    def setUp(self):
+        afwImageUtils.defineFilter("g", 470.0)
+        afwImageUtils.defineFilter("r", 620.0)
+        self.bands = ["g", "r"]
+        schema = afwTable.SourceTable.makeMinimalSchema()
+        for band in self.bands + ["sky"]:
+            schema.addField("merge_footprint_%s" % band, type="Flag", doc="Detected in %s" % band)
+            schema.addField("merge_peak_%s" % band, type="Flag", doc="Peak detected in %s" % band)
+        self.fluxKey = schema.addField("base_PsfFlux_flux", type="D", doc="Flux")
+        self.fluxErrKey = schema.addField("base_PsfFlux_fluxSigma", type="D", doc="Flux error")
+        self.fluxFlagKey = schema.addField("base_PsfFlux_flag", type="Flag", doc="Flux failure")
+        self.inputSchema = schema
+
+        config = MergeMeasurementsTask.ConfigClass()
+        config.priorityList = self.bands
+        self.task = MergeMeasurementsTask(schema=schema, config=config)
+
+    def tearDown(self):
+        afwImageUtils.resetFilters()
+        del self.task
+
+    def makeCatalogs(self, sources):
+        """Make input catalogs
+
+        @param sources: List of (parent, {band: (merge flag, sky flag, S/N, flux flag)})
+        @return Dict of band: catalog
+        """
+        catalogs = {}
+        for band in self.bands:
+            catalog = afwTable.SourceCatalog(self.inputSchema)
+            for ii, (parent, values) in enumerate(sources):
+                detected, sky, sn, fluxFlag = values[band]
+                record = catalog.addNew()
+                record.setId(ii + 1)
+                record.setParent(parent)
+                flagName = "merge_footprint_%s" if parent == 0 else "merge_peak_%s"
+                record.set(flagName % band, detected)
+                record.set("merge_peak_sky", sky)
+                record.set(self.fluxKey, sn*2.0)
+                record.set(self.fluxErrKey, 2.0)
+                record.set(self.fluxFlagKey, fluxFlag)
+            catalogs[band] = catalog
+        return catalogs
+
+    def testMerge(self):
+        """The priority band is chosen unless its S/N is poor, or for pseudo-filter detections"""
+        sources = [
+            (0, {"g": (True, False, 20.0, False), "r": (True, False, 50.0, False)}),  # g: priority
+            (0, {"g": (True, False, 2.0, False), "r": (True, False, 50.0, False)}),  # r: higher S/N
+            (0, {"g": (True, False, 2.0, False), "r": (True, False, 4.0, False)}),  # g: S/N not better
+            (0, {"g": (False, False, 0.0, False), "r": (True, False, 1.0, False)}),  # r: only detection
+            (0, {"g": (False, True, 0.0, False), "r": (True, False, 50.0, False)}),  # g: pseudo-filter
+            (1, {"g": (False, False, 0.0, False), "r": (True, False, 1.0, False)}),  # r: child
+            (0, {"g": (True, False, 200.0, True), "r": (True, False, 50.0, False)}),  # r: g flux failed
+            (0, {"g": (True, False, -20.0, False), "r": (True, False, 5.0, False)}),  # r: negative g S/N
+        ]
+        expected = ["g", "r", "g", "r", "g", "r", "r", "r"]
+        catalogs = self.makeCatalogs(sources)
+        merged = self.task.mergeCatalogs(catalogs, None)
+        self.assertEqual(len(merged), len(sources))
+        for record, band in zip(merged, expected):
+            inputRecord = catalogs[band][int(record.getId()) - 1]
+            self.assertEqual(record.getId(), inputRecord.getId())
+            self.assertEqual(record.getParent(), inputRecord.getParent())
+            self.assertEqual(record.get("base_PsfFlux_flux"), inputRecord.get(self.fluxKey))
+            for other in self.bands:
+                self.assertEqual(record.get("merge_measurement_%s" % other), other == band)
+
+    def testNoReference(self):
+        """A source that was not detected in any band is an error"""
+        catalogs = self.makeCatalogs([(0, {"g": (False, False, 20.0, False),
+                                           "r": (False, False, 20.0, False)})])
+        with self.assertRaises(ValueError):
+            self.task.mergeCatalogs(catalogs, None)
+
+    def testMismatch(self):
+        """Input catalogs must have the same sources"""
+        catalogs = self.makeCatalogs([(0, {"g": (True, False, 20.0, False),
+                                           "r": (True, False, 20.0, False)})])
+        catalogs["r"][0].setId(5)
+        with self.assertRaises(ValueError):
+            self.task.mergeCatalogs(catalogs, None)
+
+
+class MyMemoryTestCase(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,247 @@
+#
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+import lsst.utils.tests
+import lsst.afw.geom as afwGeom
+import lsst.afw.image.utils as afwImageUtils
+import lsst.afw.table as afwTable
+import lsst.meas.base.tests
+from lsst.meas.algorithms import SourceDetectionTask
+from lsst.skymap import DiscreteSkyMap
+from lsst.pipe.tasks.multiBand import (DetectCoaddSourcesTask, MergeDetectionsTask,
+                                       MeasureMergedCoaddSourcesTask, MergeMeasurementsTask,
+                                       MultiBandPatchTask)
+
+# Datasets that are the same for all filters of a patch
+MERGED_DATASETS = ("deepCoadd_skyMap", "deepMergedCoaddId", "deepMergedCoaddId_bits",
+                   "deepCoadd_mergeDet", "deepCoadd_ref")
+
+
+class MockDataRef(object):
+    """Data reference to datasets held in a dict, keyed by dataset type and filter
+
+    Catalogs are written to FITS files and read back, so that each read returns a new catalog,
+    as for a real butler.
+    """
+
+    def __init__(self, dataId, datasets, directory):
+        self.dataId = dataId
+        self.datasets = datasets
+        self.directory = directory
+
+    def getKey(self, datasetType):
+        return (datasetType, None if datasetType in MERGED_DATASETS else self.dataId["filter"])
+
+    def get(self, datasetType, immediate=True, flags=0):
+        value = self.datasets[self.getKey(datasetType)]
+        if isinstance(value, str):
+            return afwTable.SourceCatalog.readFits(value, flags=flags)
+        return value
+
+    def put(self, value, datasetType):
+        key = self.getKey(datasetType)
+        if isinstance(value, afwTable.SourceCatalog):
+            filename = os.path.join(self.directory, "%s-%s.fits" % key)
+            value.writeFits(filename)
+            value = filename
+        self.datasets[key] = value
+
+    def getButler(self):
+        return None
+
+
+class MultiBandPatchTestCase(lsst.utils.tests.TestCase):
+    """Test that processing a patch in memory matches running the separate tasks"""
+
+    def setUp(self):
+        afwImageUtils.defineFilter("g", 470.0)
+        afwImageUtils.defineFilter("r", 620.0)
+        self.directory = tempfile.mkdtemp()
+
+        skyMapConfig = DiscreteSkyMap.ConfigClass()
+        skyMapConfig.raList = [10.0]
+        skyMapConfig.decList = [45.0]
+        skyMapConfig.radiusList = [0.005]
+        skyMapConfig.pixelScale = 0.2
+        skyMapConfig.patchInnerDimensions = [400, 400]
+        skyMapConfig.patchBorder = 10
+        self.skyMap = DiscreteSkyMap(skyMapConfig)
+        tractInfo = self.skyMap[0]
+        bbox = tractInfo.getPatchInfo((0, 0)).getOuterBBox()
+        x0, y0 = bbox.getMinX(), bbox.getMinY()
+
+        self.datasets = {}
+        for filterName, scale in (("g", 1.0), ("r", 0.6)):
+            dataset = lsst.meas.base.tests.TestDataset(bbox, wcs=tractInfo.getWcs())
+            dataset.addSource(scale*100000.0, afwGeom.Point2D(x0 + 40.0, y0 + 50.0))
+            dataset.addSource(scale*60000.0, afwGeom.Point2D(x0 + 130.0, y0 + 40.0))
+            dataset.addSource(scale*80000.0, afwGeom.Point2D(x0 + 70.0, y0 + 80.0))
+            dataset.addSource(scale*50000.0, afwGeom.Point2D(x0 + 76.0, y0 + 84.0))
+            dataset.addSource(scale*70000.0, afwGeom.Point2D(x0 + 120.0, y0 + 130.0))
+            self.datasets[filterName] = dataset
+
+        self.config = MultiBandPatchTask.ConfigClass()
+        detectConfig = self.config.detectCoaddSources
+        detectConfig.doScaleVariance = False
+        detectConfig.detection.retarget(SourceDetectionTask)
+        detectConfig.detection.reEstimateBackground = False
+        self.config.mergeCoaddDetections.priorityList = ["g", "r"]
+        self.config.mergeCoaddDetections.skyObjects.nSources = 5
+        measureConfig = self.config.measureCoaddSources
+        measureConfig.doMatchSources = False
+        measureConfig.doPropagateFlags = False
+        measureConfig.doApCorr = False
+        measureConfig.doRunCatalogCalculation = False
+        measureConfig.measurement.plugins.names = ["base_SdssCentroid", "base_SdssShape", "base_PsfFlux",
+                                                   "base_GaussianFlux", "base_CircularApertureFlux"]
+        self.config.mergeCoaddMeasurements.priorityList = ["g", "r"]
+
+    def tearDown(self):
+        afwImageUtils.resetFilters()
+        shutil.rmtree(self.directory, ignore_errors=True)
+        del self.skyMap
+        del self.datasets
+        del self.config
+
+    def makeDataRefs(self, name):
+        """Make data references to new copies of the coadds
+
+        @param name: Name of the subdirectory in which to write catalogs
+        @return list of data references, one for each filter
+        """
+        directory = os.path.join(self.directory, name)
+        os.makedirs(directory)
+        datasets = {("deepCoadd_skyMap", None): self.skyMap,
+                    ("deepMergedCoaddId", None): 123,
+                    ("deepMergedCoaddId_bits", None): 16}
+        dataRefs = []
+        for index, filterName in enumerate(sorted(self.datasets)):
+            exposure, _ = self.datasets[filterName].realize(10.0, self.datasets[filterName].schema,
+                                                            randomSeed=index)
+            datasets[("deepCoadd", filterName)] = exposure
+            datasets[("deepCoaddId", filterName)] = 1230 + index
+            datasets[("deepCoaddId_bits", filterName)] = 16
+            dataRefs.append(MockDataRef(dict(tract=0, patch="0,0", filter=filterName), datasets, directory))
+        return dataRefs
+
+    def runSeparately(self):
+        """Run the separate tasks for each step, writing and reading the outputs of each
+
+        @return dict of datasets
+        """
+        dataRefs = self.makeDataRefs("separate")
+        detect = DetectCoaddSourcesTask(config=self.config.detectCoaddSources)
+        for dataRef in dataRefs:
+            detect.run(dataRef)
+        mergeDetections = MergeDetectionsTask(schema=afwTable.Schema(detect.schema),
+                                              config=self.config.mergeCoaddDetections)
+        mergeDetections.run(dataRefs)
+        measure = MeasureMergedCoaddSourcesTask(schema=mergeDetections.schema,
+                                                peakSchema=mergeDetections.merged.getPeakSchema(),
+                                                config=self.config.measureCoaddSources)
+        for dataRef in dataRefs:
+            measure.run(dataRef)
+        mergeMeasurements = MergeMeasurementsTask(schema=measure.schema,
+                                                  config=self.config.mergeCoaddMeasurements)
+        mergeMeasurements.run(dataRefs)
+        return dataRefs[0].datasets
+
+    def runPatch(self, doWriteCheckpoints):
+        """Run MultiBandPatchTask
+
+        @param doWriteCheckpoints: Write the intermediate catalogs?
+        @return dict of datasets
+        """
+        self.config.doWriteCheckpoints = doWriteCheckpoints
+        dataRefs = self.makeDataRefs("checkpoints" if doWriteCheckpoints else "patch")
+        MultiBandPatchTask(config=self.config).run(dataRefs)
+        return dataRefs[0].datasets
+
+    def assertCatalogsEqual(self, filename1, filename2):
+        """Assert that two catalogs, written to the provided files, are identical"""
+        catalog1 = afwTable.SourceCatalog.readFits(filename1)
+        catalog2 = afwTable.SourceCatalog.readFits(filename2)
+        self.assertGreater(len(catalog1), 0)
+        self.assertEqual(len(catalog1), len(catalog2))
+        self.assertEqual(catalog1.schema.getNames(), catalog2.schema.getNames())
+        for item in catalog1.schema:
+            numpy.testing.assert_array_equal(catalog1[item.key], catalog2[item.key],
+                                             err_msg=item.field.getName())
+        for source1, source2 in zip(catalog1, catalog2):
+            footprint1 = source1.getFootprint()
+            footprint2 = source2.getFootprint()
+            self.assertEqual(footprint1.getArea(), footprint2.getArea())
+            self.assertEqual([(peak.getIx(), peak.getIy()) for peak in footprint1.getPeaks()],
+                             [(peak.getIx(), peak.getIy()) for peak in footprint2.getPeaks()])
+
+    def testMatchesSeparateTasks(self):
+        """The outputs for each band are those of running the separate tasks"""
+        separate = self.runSeparately()
+        patch = self.runPatch(doWriteCheckpoints=False)
+        for filterName in ("g", "r"):
+            self.assertCatalogsEqual(patch[("deepCoadd_meas", filterName)],
+                                     separate[("deepCoadd_meas", filterName)])
+            self.assertIn(("deepCoadd_calexp", filterName), patch)
+            self.assertIn(("deepCoadd_calexp_background", filterName), patch)
+        self.assertCatalogsEqual(patch[("deepCoadd_ref", None)], separate[("deepCoadd_ref", None)])
+
+    def testCheckpoints(self):
+        """The intermediate catalogs are written only if doWriteCheckpoints"""
+        patch = self.runPatch(doWriteCheckpoints=False)
+        self.assertNotIn(("deepCoadd_mergeDet", None), patch)
+        for filterName in ("g", "r"):
+            self.assertNotIn(("deepCoadd_det", filterName), patch)
+
+        separate = self.runSeparately()
+        checkpoints = self.runPatch(doWriteCheckpoints=True)
+        self.assertCatalogsEqual(checkpoints[("deepCoadd_mergeDet", None)],
+                                 separate[("deepCoadd_mergeDet", None)])
+        for filterName in ("g", "r"):
+            self.assertCatalogsEqual(checkpoints[("deepCoadd_det", filterName)],
+                                     separate[("deepCoadd_det", filterName)])
+            self.assertCatalogsEqual(checkpoints[("deepCoadd_meas", filterName)],
+                                     separate[("deepCoadd_meas", filterName)])
+
+    def testPersistenceNames(self):
+        """No config or metadata is written, as no mapper defines datasets for them"""
+        task = MultiBandPatchTask(config=self.config)
+        self.assertIsNone(task._getConfigName())
+        self.assertIsNone(task._getMetadataName())
+
+
+class MyMemoryTestCase(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,318 @@
+#
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+import time
+import unittest
+
+import numpy
+
+import lsst.utils.tests
+import lsst.afw.geom as afwGeom
+import lsst.afw.table as afwTable
+from lsst.pipe.tasks.propagateVisitFlags import CoaddSourceIndex, PropagateVisitFlagsTask, polygonContains
+
+
+def makeWcs(crpix, orientation=0.0*afwGeom.degrees):
+    """Make a TAN Wcs with a pixel scale of 0.2 arcsec
+
+    @param crpix: Reference pixel (lsst.afw.geom.Point2D)
+    @param orientation: Position angle of the y axis
+    @return lsst.afw.geom.SkyWcs
+    """
+    return afwGeom.makeSkyWcs(
+        crpix=crpix,
+        crval=afwGeom.SpherePoint(10, 45, afwGeom.degrees),
+        cdMatrix=afwGeom.makeCdMatrix(scale=0.2*afwGeom.arcseconds, orientation=orientation),
+    )
+
+
+def makeCoaddWcs():
+    """Make the Wcs of a coadd to which the CCDs of makeCcdInputs contribute"""
+    return makeWcs(afwGeom.Point2D(250, 250))
+
+
+def makeCcdInputs():
+    """Make a table of overlapping CCD inputs to a coadd, as recorded by CoaddInputRecorderTask
+
+    The first CCD has no valid polygon, the second a valid polygon that is
+    smaller than its bbox, and the third is rotated and has a valid polygon
+    that is its bbox.
+
+    @return lsst.afw.table.ExposureCatalog
+    """
+    schema = afwTable.ExposureTable.makeMinimalSchema()
+    schema.addField("visit", type="L", doc="Visit identifier")
+    schema.addField("ccd", type="I", doc="CCD identifier")
+    ccdInputs = afwTable.ExposureCatalog(schema)
+    bbox = afwGeom.Box2I(afwGeom.Point2I(0, 0), afwGeom.Extent2I(200, 400))
+    # All the Wcs share a reference position on the sky, so the CCDs are offset from the coadd (see
+    # makeCoaddWcs) by the differences in their reference pixels
+    inputs = ((afwGeom.Point2D(250, 250), 0.0*afwGeom.degrees, None),
+              (afwGeom.Point2D(100, 200), 0.0*afwGeom.degrees,
+               [(10.0, 10.0), (190.0, 30.0), (150.0, 380.0), (20.0, 300.0)]),
+              (afwGeom.Box2D(bbox).getCenter(), 30.0*afwGeom.degrees,
+               [(corner.getX(), corner.getY()) for corner in afwGeom.Box2D(bbox).getCorners()]))
+    for ii, (crpix, orientation, vertices) in enumerate(inputs):
+        record = ccdInputs.addNew()
+        record.setId(ii)
+        record.set("visit", 1000 + ii)
+        record.set("ccd", ii)
+        record.setWcs(makeWcs(crpix, orientation))
+        record.setBBox(bbox)
+        if vertices is not None:
+            record.setValidPolygon(afwGeom.Polygon([afwGeom.Point2D(x, y) for x, y in vertices]))
+    return ccdInputs
+
+
+class CoaddSourceIndexTestCase(lsst.utils.tests.TestCase):
+    """Test the matching of input sources to coadd sources"""
+
+    def setUp(self):
+        self.rng = numpy.random.RandomState(12345)
+        self.radius = 1.0*afwGeom.arcseconds
+        size = 30.0*self.radius.asRadians()
+        self.ra = 1.0 + size*self.rng.uniform(size=2000)
+        self.dec = -0.5 + size*self.rng.uniform(size=2000)
+
+    def bruteForce(self, ra, dec):
+        """Return the sorted indices of the matching coadd sources, by comparing all pairs"""
+        coadd = CoaddSourceIndex.toUnitVectors(self.ra, self.dec)
+        matched = []
+        for vector in CoaddSourceIndex.toUnitVectors(ra, dec):
+            cosDistance = numpy.clip((coadd*vector).sum(axis=1), -1.0, 1.0)
+            matched.extend(numpy.flatnonzero(numpy.arccos(cosDistance) <= self.radius.asRadians()))
+        return sorted(matched)
+
+    def testMatch(self):
+        index = CoaddSourceIndex(self.ra, self.dec, self.radius)
+        offset = 0.7*self.radius.asRadians()*self.rng.normal(size=(2, 500))
+        ra = self.ra[:500] + offset[0]/numpy.cos(self.dec[:500])
+        dec = self.dec[:500] + offset[1]
+        matched = index.match(ra, dec)
+        self.assertGreater(len(matched), 0)
+        self.assertEqual(sorted(matched), self.bruteForce(ra, dec))
+
+    def testNoMatch(self):
+        index = CoaddSourceIndex(self.ra, self.dec, self.radius)
+        self.assertEqual(len(index.match([3.0], [0.5])), 0)
+        self.assertEqual(len(index.match([], [])), 0)
+
+
+class PolygonContainsTestCase(lsst.utils.tests.TestCase):
+    """Test the vectorised test of points in a polygon"""
+
+    def testSquare(self):
+        vertices = [(0.0, 0.0), (10.0, 0.0), (10.0, 10.0), (0.0, 10.0)]
+        x = numpy.array([5.0, -1.0, 11.0, 5.0, 5.0, 9.9])
+        y = numpy.array([5.0, 5.0, 5.0, -1.0, 11.0, 0.1])
+        self.assertEqual(list(polygonContains(vertices, x, y)), [True, False, False, False, False, True])
+
+    def testConcave(self):
+        """An L-shaped polygon excludes the corner that is cut out"""
+        vertices = [(0.0, 0.0), (10.0, 0.0), (10.0, 5.0), (5.0, 5.0), (5.0, 10.0), (0.0, 10.0)]
+        x = numpy.array([2.0, 8.0, 2.0, 8.0])
+        y = numpy.array([2.0, 2.0, 8.0, 8.0])
+        self.assertEqual(list(polygonContains(vertices, x, y)), [True, True, True, False])
+
+
+class CountOverlapsTestCase(lsst.utils.tests.TestCase):
+    """Test the counting of the CCDs that overlap each coadd source"""
+
+    def setUp(self):
+        self.rng = numpy.random.RandomState(12345)
+        self.coaddWcs = makeCoaddWcs()
+        self.ccdInputs = makeCcdInputs()
+
+        # Random positions around the CCDs, and positions on the edges of the bbox of each CCD
+        points = [afwGeom.Point2D(x, y) for x, y in
+                  zip(self.rng.uniform(-100, 500, size=500), self.rng.uniform(-100, 500, size=500))]
+        for ccdRecord in self.ccdInputs:
+            box = afwGeom.Box2D(ccdRecord.getBBox())
+            edges = box.getCorners()
+            edges += [afwGeom.Point2D(box.getCenterX(), box.getMinY()),
+                      afwGeom.Point2D(box.getCenterX(), box.getMaxY()),
+                      afwGeom.Point2D(box.getMinX(), box.getCenterY()),
+                      afwGeom.Point2D(box.getMaxX(), box.getCenterY())]
+            points += [self.coaddWcs.skyToPixel(ccdRecord.getWcs().pixelToSky(point)) for point in edges]
+
+        schema = afwTable.SourceTable.makeMinimalSchema()
+        centroidKey = afwTable.Point2DKey.addFields(schema, "centroid", "centroid", "pixel")
+        schema.getAliasMap().set("slot_Centroid", "centroid")
+        self.task = PropagateVisitFlagsTask(schema)
+        self.sources = afwTable.SourceCatalog(schema)
+        self.sources.reserve(len(points))
+        for point in points:
+            self.sources.addNew().set(centroidKey, point)
+
+    def tearDown(self):
+        del self.ccdInputs
+        del self.sources
+        del self.task
+
+    def testSubsetContaining(self):
+        """The counts are the numbers of CCDs containing each source, including the valid polygons"""
+        self.assertTrue(self.sources.isContiguous())
+        numOverlaps = self.task.countOverlaps(self.sources, self.ccdInputs, self.coaddWcs)
+        expected = [len(self.ccdInputs.subsetContaining(source.getCentroid(), self.coaddWcs, True)) for
+                    source in self.sources]
+        self.assertEqual(list(numOverlaps), expected)
+        self.assertEqual(set(expected), {0, 1, 2, 3})
+
+    def testNonContiguous(self):
+        """The counts do not depend on the contiguity of the catalog"""
+        numOverlaps = self.task.countOverlaps(self.sources, self.ccdInputs, self.coaddWcs)
+        subset = self.sources[::2]
+        self.assertFalse(subset.isContiguous())
+        self.assertEqual(list(self.task.countOverlaps(subset, self.ccdInputs, self.coaddWcs)),
+                         list(numOverlaps[::2]))
+
+
+class MockButler:
+    """Quacks like a lsst.daf.persistence.Butler for reading src catalogs, slowly"""
+
+    def __init__(self, catalogs, delays):
+        """Construct
+
+        @param catalogs: Dict of (visit, ccd): src catalog
+        @param delays: Dict of (visit, ccd): time (sec) to read
+        """
+        self.catalogs = catalogs
+        self.delays = delays
+        self.calls = []
+
+    def get(self, datasetType, visit, ccd, flags=0, immediate=True):
+        self.calls.append((datasetType, visit, ccd, flags))
+        time.sleep(self.delays[(visit, ccd)])
+        return self.catalogs[(visit, ccd)]
+
+
+class ReadInputsTestCase(lsst.utils.tests.TestCase):
+    """Test the reading of the input src catalogs and the propagation of their flags"""
+
+    def setUp(self):
+        self.rng = numpy.random.RandomState(12345)
+        self.coaddWcs = makeCoaddWcs()
+        self.ccdInputs = makeCcdInputs()
+
+        coaddSchema = afwTable.SourceTable.makeMinimalSchema()
+        coaddCentroidKey = afwTable.Point2DKey.addFields(coaddSchema, "centroid", "centroid", "pixel")
+        coaddSchema.getAliasMap().set("slot_Centroid", "centroid")
+        self.task = PropagateVisitFlagsTask(coaddSchema)
+        self.coaddSources = afwTable.SourceCatalog(coaddSchema)
+        self.coaddSources.reserve(300)
+        for x, y in zip(self.rng.uniform(-50, 450, size=300), self.rng.uniform(-50, 450, size=300)):
+            record = self.coaddSources.addNew()
+            record.set(coaddCentroidKey, afwGeom.Point2D(x, y))
+            record.updateCoord(self.coaddWcs)
+
+        # Each CCD has a source, with random flags, for each coadd source it contains, and some more
+        srcSchema = afwTable.SourceTable.makeMinimalSchema()
+        centroidKey = afwTable.Point2DKey.addFields(srcSchema, "centroid", "centroid", "pixel")
+        srcSchema.getAliasMap().set("slot_Centroid", "centroid")
+        flagKeys = [srcSchema.addField(flag, type="Flag", doc="Flag to propagate") for
+                    flag in ("calib_psfCandidate", "calib_psfUsed")]
+        self.catalogs = {}
+        self.delays = {}
+        for ccdRecord in self.ccdInputs:
+            ccdWcs = ccdRecord.getWcs()
+            points = [ccdWcs.skyToPixel(source.getCoord()) for source in self.coaddSources if
+                      ccdRecord.contains(source.getCoord(), True)]
+            points += [afwGeom.Point2D(x, y) for x, y in
+                       zip(self.rng.uniform(0, 200, size=20), self.rng.uniform(0, 400, size=20))]
+            catalog = afwTable.SourceCatalog(srcSchema)
+            catalog.reserve(len(points))
+            for point in points:
+                record = catalog.addNew()
+                record.set(centroidKey, point + afwGeom.Extent2D(*self.rng.normal(scale=0.1, size=2)))
+                record.setFlag(flagKeys[0], bool(self.rng.uniform() < 0.7))
+                record.setFlag(flagKeys[1], bool(self.rng.uniform() < 0.4))
+            key = (int(ccdRecord.get("visit")), int(ccdRecord.get("ccd")))
+            self.catalogs[key] = catalog
+            # The first CCDs are the slowest to read, so they finish last
+            self.delays[key] = 0.05*(len(self.ccdInputs) - len(self.delays))
+
+    def tearDown(self):
+        del self.ccdInputs
+        del self.coaddSources
+        del self.catalogs
+        del self.task
+
+    def readInputs(self, readThreads):
+        """Read the inputs with the provided number of threads
+
+        @param readThreads: Number of threads with which to read
+        @return list of results of PropagateVisitFlagsTask.readInput, and the butler
+        """
+        self.task.config.readThreads = readThreads
+        butler = MockButler(self.catalogs, self.delays)
+        return list(self.task.readInputs(butler, self.ccdInputs)), butler
+
+    def testUpdateCoord(self):
+        """The coordinates transformed in bulk match those from updateCoord"""
+        results, butler = self.readInputs(1)
+        self.assertEqual(len(results), len(self.ccdInputs))
+        for ccdRecord, inputs, call in zip(self.ccdInputs, results, butler.calls):
+            key = (int(ccdRecord.get("visit")), int(ccdRecord.get("ccd")))
+            self.assertEqual(call, ("src",) + key + (afwTable.SOURCE_IO_NO_FOOTPRINTS,))
+            expected = self.catalogs[key].copy(deep=True)
+            for record in expected:
+                record.updateCoord(ccdRecord.getWcs())
+            self.assertFloatsAlmostEqual(inputs.ra, expected["coord_ra"], atol=1.0e-12, rtol=0.0)
+            self.assertFloatsAlmostEqual(inputs.dec, expected["coord_dec"], atol=1.0e-12, rtol=0.0)
+            for flag in ("calib_psfCandidate", "calib_psfUsed"):
+                self.assertEqual(list(inputs.flags[flag]), list(expected[flag]))
+
+    def testThreads(self):
+        """Reading with several threads gives the same inputs and propagated flags as reading serially"""
+        serial, _ = self.readInputs(1)
+        threaded, butler = self.readInputs(3)
+        self.assertEqual(len(butler.calls), len(self.ccdInputs))
+        for serialInputs, threadedInputs in zip(serial, threaded):
+            self.assertFloatsEqual(threadedInputs.ra, serialInputs.ra)
+            self.assertFloatsEqual(threadedInputs.dec, serialInputs.dec)
+            for flag in ("calib_psfCandidate", "calib_psfUsed"):
+                self.assertEqual(list(threadedInputs.flags[flag]), list(serialInputs.flags[flag]))
+
+        propagated = {}
+        for readThreads in (1, 3):
+            self.task.config.readThreads = readThreads
+            coaddSources = self.coaddSources.copy(deep=True)
+            self.task.run(MockButler(self.catalogs, self.delays), coaddSources, self.ccdInputs,
+                          self.coaddWcs)
+            propagated[readThreads] = {flag: coaddSources[flag].copy() for
+                                       flag in ("calib_psfCandidate", "calib_psfUsed")}
+        for flag in ("calib_psfCandidate", "calib_psfUsed"):
+            self.assertGreater(propagated[1][flag].sum(), 0)
+            self.assertLess(propagated[1][flag].sum(), len(self.coaddSources))
+            self.assertEqual(list(propagated[3][flag]), list(propagated[1][flag]))
+
+
+class MyMemoryTestCase(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,171 @@
+#
+# LSST Data Management System
+# Copyright 2018 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+import lsst.utils.tests
+import lsst.log
+import lsst.afw.geom as afwGeom
+from lsst.pipe.base import Struct
+from lsst.pipe.tasks.coaddBase import CoaddBaseTask, SelectDataIdContainer
+
+
+class DummyDataRef:
+
+    """Quacks like a lsst.daf.persistence.ButlerDataRef for reading the header of a calexp"""
+
+    def __init__(self, dataId, filename, metadata, reads):
+        self.dataId = dataId
+        self.filename = filename
+        self.metadata = metadata
+        self.reads = reads
+
+    def get(self, datasetType, immediate=True):
+        if datasetType == "calexp_filename":
+            return [self.filename]
+        if datasetType == "calexp_md":
+            self.reads.append(self.dataId["ccd"])
+            return self.metadata.deepCopy()
+        raise KeyError("Unknown dataset type: %s" % (datasetType,))
+
+
+def makeMetadata(ccd, offset=0.0):
+    """Make the header of a calexp
+
+    @param ccd: CCD number, which sets the position of the image
+    @param offset: Offset (degrees) of the image in declination
+    @return header (lsst.daf.base.PropertyList)
+    """
+    wcs = afwGeom.makeSkyWcs(
+        crpix=afwGeom.Point2D(1000, 2000),
+        crval=afwGeom.SpherePoint(10 + 0.1*ccd, 45 + offset, afwGeom.degrees),
+        cdMatrix=afwGeom.makeCdMatrix(scale=0.2*afwGeom.arcseconds),
+    )
+    metadata = wcs.getFitsMetadata()
+    metadata.set("NAXIS1", 2000)
+    metadata.set("NAXIS2", 4000 + ccd)
+    return metadata
+
+
+class SelectDataIdContainerTestCase(unittest.TestCase):
+    """Test the reading and caching of the headers of the inputs to select"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.numCcds = 8
+        self.metadata = {}
+        self.filenames = {}
+        for ccd in range(self.numCcds):
+            self.metadata[ccd] = makeMetadata(ccd)
+            self.filenames[ccd] = os.path.join(self.directory, "calexp-%d.fits" % ccd)
+            with open(self.filenames[ccd], "w"):
+                pass
+        self.config = CoaddBaseTask.ConfigClass()
+        self.reads = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def makeDataList(self):
+        """Run SelectDataIdContainer.makeDataRefList on data references for each CCD
+
+        @return list of SelectStruct
+        """
+        container = SelectDataIdContainer()
+        container.setDatasetType("calexp")
+        container.refList = [DummyDataRef(dict(visit=1, ccd=ccd), self.filenames[ccd], self.metadata[ccd],
+                                          self.reads) for ccd in range(self.numCcds)]
+        namespace = Struct(config=self.config, butler=None, log=lsst.log.Log.getDefaultLogger())
+        container.makeDataRefList(namespace)
+        return container.dataList
+
+    def assertDataListsEqual(self, dataList1, dataList2):
+        """Assert that two lists of SelectStruct have the same dataIds, bboxes and Wcs"""
+        self.assertEqual([data.dataRef.dataId for data in dataList1],
+                         [data.dataRef.dataId for data in dataList2])
+        point = afwGeom.Point2D(123.0, 456.0)
+        for data1, data2 in zip(dataList1, dataList2):
+            self.assertEqual(data1.bbox, data2.bbox)
+            sky1 = data1.wcs.pixelToSky(point)
+            sky2 = data2.wcs.pixelToSky(point)
+            self.assertAlmostEqual(sky1.separation(sky2).asArcseconds(), 0.0, places=9)
+
+    def assertMatchesMetadata(self, dataList):
+        """Assert that a list of SelectStruct has the Wcs and bbox in the headers"""
+        expected = [Struct(dataRef=Struct(dataId=dict(visit=1, ccd=ccd)),
+                           wcs=afwGeom.makeSkyWcs(self.metadata[ccd].deepCopy()),
+                           bbox=afwGeom.Box2I(afwGeom.Point2I(0, 0), afwGeom.Extent2I(2000, 4000 + ccd)))
+                    for ccd in range(self.numCcds)]
+        self.assertDataListsEqual(dataList, expected)
+
+    def testThreads(self):
+        """Reading the headers with multiple threads gives the same results as reading serially"""
+        serial = self.makeDataList()
+        self.assertMatchesMetadata(serial)
+        self.config.numSelectHeaderThreads = 4
+        threaded = self.makeDataList()
+        self.assertDataListsEqual(threaded, serial)
+        self.assertEqual(sorted(self.reads), sorted(2*list(range(self.numCcds))))
+
+    def testCache(self):
+        """Cached headers are used until the calexp is modified"""
+        self.config.selectHeaderCache = os.path.join(self.directory, "selectHeaders.pickle")
+        first = self.makeDataList()
+        self.assertMatchesMetadata(first)
+        self.assertEqual(sorted(self.reads), list(range(self.numCcds)))
+        self.assertTrue(os.path.exists(self.config.selectHeaderCache))
+
+        # Cache hit: no headers are read
+        del self.reads[:]
+        second = self.makeDataList()
+        self.assertEqual(self.reads, [])
+        self.assertDataListsEqual(second, first)
+
+        # Modifying a calexp invalidates its entry only
+        self.metadata[3] = makeMetadata(3, offset=1.0)
+        stat = os.stat(self.filenames[3])
+        os.utime(self.filenames[3], (stat.st_atime, stat.st_mtime + 10))
+        third = self.makeDataList()
+        self.assertEqual(self.reads, [3])
+        self.assertMatchesMetadata(third)
+
+        # The updated entry is cached
+        del self.reads[:]
+        self.config.numSelectHeaderThreads = 4
+        fourth = self.makeDataList()
+        self.assertEqual(self.reads, [])
+        self.assertDataListsEqual(fourth, third)
+
+
+class MyMemoryTestCase(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,225 @@
+#
+# LSST Data Management System
+# Copyright 2008-2018 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import lsst.utils.tests
+from lsst.pipe.base import Struct
+from lsst.pipe.tasks.coaddHelpers import WarpManifest, writeFileAtomically
+from lsst.pipe.tasks.makeCoaddTempExp import MakeCoaddTempExpTask
+
+
+class WarpManifestTestCase(unittest.TestCase):
+    """Test the manifest of completed warps used by MakeCoaddTempExpTask"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "deepCoadd_directWarp-manifest-0-1,1.json")
+        self.warpId = dict(visit=1234, tract=0, patch="1,1", filter="r")
+        self.inputs = WarpManifest.makeInputs([Struct(dataId=dict(visit=1234, ccd=ccd)) for ccd in (2, 1)])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def testMissing(self):
+        """A missing manifest is empty"""
+        manifest = WarpManifest.read(self.filename)
+        self.assertEqual(manifest.entries, {})
+        self.assertFalse(manifest.isComplete(self.warpId, self.inputs, "abc"))
+
+    def testRoundTrip(self):
+        """Entries survive a write/read cycle, and stale entries are not complete"""
+        manifest = WarpManifest.read(self.filename)
+        manifest.add(self.warpId, self.inputs, "abc", ["deepCoadd_directWarp"])
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(self.filename)])
+
+        manifest = WarpManifest.read(self.filename)
+        self.assertTrue(manifest.isComplete(dict(reversed(list(self.warpId.items()))), self.inputs, "abc"))
+        self.assertFalse(manifest.isComplete(self.warpId, self.inputs, "def"))
+        self.assertFalse(manifest.isComplete(self.warpId, self.inputs[:1], "abc"))
+        self.assertFalse(manifest.isComplete(dict(self.warpId, visit=5678), self.inputs, "abc"))
+
+    def testTruncated(self):
+        """A corrupted manifest is treated as empty"""
+        with open(self.filename, "w") as fd:
+            fd.write('{"partial": ')
+        self.assertEqual(WarpManifest.read(self.filename).entries, {})
+
+
+class WriteFileAtomicallyTestCase(unittest.TestCase):
+    """Test writing a file atomically"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "subdir", "file.dat")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def testWrite(self):
+        """The file is written, creating its directory, and replaced"""
+        writeFileAtomically(self.filename, lambda fd: fd.write(b"first"))
+        writeFileAtomically(self.filename, lambda fd: fd.write("second"), binary=False)
+        with open(self.filename) as fd:
+            self.assertEqual(fd.read(), "second")
+        self.assertEqual(os.listdir(os.path.dirname(self.filename)), ["file.dat"])
+
+    def testFailure(self):
+        """A failed write leaves the original file, and no temporary file"""
+        writeFileAtomically(self.filename, lambda fd: fd.write(b"original"))
+
+        def fail(fd):
+            fd.write(b"partial")
+            raise RuntimeError("Failed to write")
+
+        with self.assertRaises(RuntimeError):
+            writeFileAtomically(self.filename, fail)
+        with open(self.filename, "rb") as fd:
+            self.assertEqual(fd.read(), b"original")
+        self.assertEqual(os.listdir(os.path.dirname(self.filename)), ["file.dat"])
+
+
+class DummyWarpRef:
+    """Quacks like a lsst.daf.persistence.ButlerDataRef for a warp, with the datasets held in a dict"""
+
+    def __init__(self, dataId, datasets, directory):
+        self.dataId = dataId
+        self.datasets = datasets
+        self.directory = directory
+
+    def datasetExists(self, datasetType, write=False):
+        return (datasetType, self.dataId["visit"]) in self.datasets
+
+    def get(self, datasetType, immediate=True):
+        if datasetType.endswith("_filename"):
+            datasetType = datasetType[:-len("_filename")]
+            return [os.path.join(self.directory, "%s-%d.fits" % (datasetType, self.dataId["visit"]))]
+        return self.datasets[(datasetType, self.dataId["visit"])]
+
+    def put(self, value, datasetType):
+        self.datasets[(datasetType, self.dataId["visit"])] = value
+
+
+class DummyButler:
+    """Quacks like a lsst.daf.persistence.Butler for making references to warps"""
+
+    def __init__(self, datasets, directory):
+        self.datasets = datasets
+        self.directory = directory
+
+    def getKeys(self, datasetType):
+        keys = dict(tract=int, patch=str, filter=str)
+        if datasetType.endswith("Warp"):
+            keys["visit"] = int
+        return keys
+
+    def dataRef(self, datasetType, dataId):
+        return DummyWarpRef(dataId, self.datasets, self.directory)
+
+
+class DummyPatchRef:
+    """Quacks like a lsst.daf.persistence.ButlerDataRef for a patch"""
+
+    def __init__(self, butler):
+        self.butler = butler
+        self.dataId = dict(tract=0, patch="1,1", filter="r")
+
+    def getButler(self):
+        return self.butler
+
+
+class DummyCalexpRef:
+    """Quacks like a lsst.daf.persistence.ButlerDataRef for a calexp"""
+
+    def __init__(self, visit, ccd):
+        self.dataId = dict(visit=visit, ccd=ccd, filter="r")
+
+    def datasetExists(self, datasetType, write=False):
+        return True
+
+
+class MakeCoaddTempExpManifestTestCase(unittest.TestCase):
+    """Test the use of the manifest by MakeCoaddTempExpTask when reusing warps"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.datasets = {}
+        self.calexpRefList = [DummyCalexpRef(visit, ccd) for visit in (1, 2, 3) for ccd in (0, 1)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def runTask(self):
+        """Run MakeCoaddTempExpTask with reuse, recording the warps created
+
+        @return list of visits of the warps created
+        """
+        task = MakeCoaddTempExpTask(reuse=True)
+        created = []
+
+        def createTempExp(calexpRefList, skyInfo, visitId=0):
+            created.append(visitId)
+            return Struct(exposures={"direct": "warp %d" % visitId})
+
+        task.getSkyInfo = lambda patchRef: None
+        task.selectExposures = lambda patchRef, skyInfo, selectDataList=[]: self.calexpRefList
+        task.createTempExp = createTempExp
+        dataRefList = task.run(DummyPatchRef(DummyButler(self.datasets, self.directory)))
+        self.assertEqual(sorted(dataRef.dataId["visit"] for dataRef in dataRefList), [1, 2, 3])
+        return created
+
+    def testExistingWarps(self):
+        """Warps written before the manifest are recorded in it when skipped, and are not redone"""
+        for visit in (1, 2):
+            self.datasets[("deepCoadd_directWarp", visit)] = "old warp %d" % visit
+        self.assertEqual(self.runTask(), [3])
+        filename = os.path.join(self.directory, "deepCoadd_directWarp-manifest-r-1,1-0.json")
+        manifest = WarpManifest.read(filename)
+        self.assertEqual(len(manifest.entries), 3)
+        for entry in manifest.entries.values():
+            self.assertEqual(entry["datasets"], ["deepCoadd_directWarp"])
+
+        self.assertEqual(self.runTask(), [])
+        self.assertEqual(self.datasets[("deepCoadd_directWarp", 1)], "old warp 1")
+        self.assertEqual(self.datasets[("deepCoadd_directWarp", 3)], "warp 3")
+
+    def testStale(self):
+        """Warps whose inputs have changed since they were recorded are redone"""
+        self.assertEqual(self.runTask(), [1, 2, 3])
+        self.calexpRefList.append(DummyCalexpRef(2, 2))
+        self.assertEqual(self.runTask(), [2])
+
+
+class MyMemoryTestCase(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
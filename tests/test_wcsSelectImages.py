@@ -20,11 +20,25 @@
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
 
+import os
+import shutil
+import tempfile
 import unittest
+import unittest.mock
+
+import numpy as np
 
 import lsst.utils.tests
+import lsst.daf.base as dafBase
 import lsst.afw.geom as afwGeom
-from lsst.pipe.tasks.selectImages import WcsSelectImagesTask, SelectStruct
+import lsst.afw.table as afwTable
+import lsst.afw.image as afwImage
+from lsst.afw.detection import GaussianPsf
+import lsst.pipe.tasks.selectImages
+from lsst.pipe.tasks.selectImages import (WcsSelectImagesTask, SelectStruct, SkyPolygonIndex,
+                                          BestSeeingWcsSelectImagesTask, computePsfQuality,
+                                          setPsfQualityMetadata, getPsfQualityFromMetadata,
+                                          setPsfSizeMetadata, projectCorners)
 from lsst.pipe.tasks.coaddBase import CoaddBaseTask
 
 
@@ -157,6 +171,160 @@ class WcsSelectImagesTestCase(unittest.TestCase):
                    True)
 
 
+class SkyPolygonIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.patchRef = createPatch()
+        step = 0.25*afwGeom.Extent2D(DIMS).computeNorm()*SCALE
+        self.selectDataList = [createImage(dataId={"name": "image%d" % i}, rotateAngle=i*step)
+                               for i in range(12)]
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def select(self, config, selectDataList):
+        task = CoaddBaseTask(config=config, name="CoaddBase")
+        return [dataRef.dataId["name"] for dataRef in
+                task.selectExposures(self.patchRef, selectDataList=selectDataList)]
+
+    def testMultiple(self):
+        """Selection with the index agrees with testing each image in turn"""
+        config = CoaddBaseTask.ConfigClass()
+        expected = [name for data in self.selectDataList for name in self.select(config, [data])]
+        self.assertGreater(len(expected), 0)
+        self.assertLess(len(expected), len(self.selectDataList))
+        self.assertEqual(self.select(config, self.selectDataList), expected)
+
+    def testProjectCorners(self):
+        """Bulk projection of corners agrees with projecting each corner in turn"""
+        projected = projectCorners([data.wcs for data in self.selectDataList],
+                                   [data.bbox for data in self.selectDataList])
+        self.assertTrue(projected.valid.all())
+        for i, data in enumerate(self.selectDataList):
+            for j, corner in enumerate(afwGeom.Box2D(data.bbox).getCorners()):
+                coord = data.wcs.pixelToSky(corner)
+                self.assertAlmostEqual(projected.ra[i, j], coord.getRa().asRadians())
+                self.assertAlmostEqual(projected.dec[i, j], coord.getDec().asRadians())
+                np.testing.assert_allclose(projected.vectors[i, j], list(coord.getVector()), atol=1e-12)
+
+    def testPersistence(self):
+        """The index can be written, and is reused only for matching inputs"""
+        config = CoaddBaseTask.ConfigClass()
+        expected = self.select(config, self.selectDataList)
+        config.select.indexFile = os.path.join(self.directory, "selectIndex.pickle")
+        self.assertEqual(self.select(config, self.selectDataList), expected)
+        skyIndex = SkyPolygonIndex.read(config.select.indexFile)
+        self.assertEqual(len(skyIndex.corners), len(self.selectDataList))
+        self.assertEqual(self.select(config, self.selectDataList), expected)
+        self.assertEqual(self.select(config, self.selectDataList[:1]), expected[:1])
+        self.assertEqual(len(SkyPolygonIndex.read(config.select.indexFile).corners), 1)
+
+    def testPersistenceChangedWcs(self):
+        """A persisted index is not reused for the same dataIds with a different Wcs"""
+        config = CoaddBaseTask.ConfigClass()
+        step = 0.25*afwGeom.Extent2D(DIMS).computeNorm()*SCALE
+        moved = [createImage(dataId={"name": "image%d" % i}, rotateAngle=(i + 4)*step) for i in range(12)]
+        expected = self.select(config, moved)
+        self.assertNotEqual(expected, self.select(config, self.selectDataList))
+        config.select.indexFile = os.path.join(self.directory, "selectIndex.pickle")
+        self.select(config, self.selectDataList)
+        self.assertEqual(self.select(config, moved), expected)
+
+    def testKeyCachedByList(self):
+        """The key identifying the inputs is only computed for a new list"""
+        task = WcsSelectImagesTask(name="select")
+        with unittest.mock.patch.object(lsst.pipe.tasks.selectImages, "_makeIndexKey",
+                                        wraps=lsst.pipe.tasks.selectImages._makeIndexKey) as makeIndexKey:
+            index = task.getIndex(self.selectDataList)
+            self.assertIs(task.getIndex(self.selectDataList), index)
+            self.assertEqual(makeIndexKey.call_count, 1)
+            self.assertIs(task.getIndex(list(self.selectDataList)), index)
+            self.assertEqual(makeIndexKey.call_count, 2)
+
+
+class PsfQualityTestCase(unittest.TestCase):
+
+    def setUp(self):
+        schema = afwTable.SourceTable.makeMinimalSchema()
+        schema.addField("calib_psfUsed", type="Flag", doc="used for PSF")
+        for name in ("base_SdssShape", "base_SdssShape_psf"):
+            afwTable.QuadrupoleKey.addFields(schema, name, "shape", afwTable.CoordinateType.PIXEL)
+        self.catalog = afwTable.SourceCatalog(schema)
+        rng = np.random.RandomState(12345)
+        for i in range(100):
+            record = self.catalog.addNew()
+            record.set("calib_psfUsed", i % 3 != 0)
+            record.set("base_SdssShape_xx", 4.0 + rng.normal(scale=0.1))
+            record.set("base_SdssShape_yy", 4.0 + rng.normal(scale=0.1))
+            record.set("base_SdssShape_xy", rng.normal(scale=0.1))
+            record.set("base_SdssShape_psf_xx", 4.0)
+            record.set("base_SdssShape_psf_yy", 4.1)
+            record.set("base_SdssShape_psf_xy", 0.0)
+        self.catalog = self.catalog.copy(deep=True)
+        self.columns = ("calib_psfUsed", "base_SdssShape", "base_SdssShape_psf")
+
+    def testMetadata(self):
+        """The summary recorded in metadata matches the computed summary"""
+        quality = computePsfQuality(self.catalog, *self.columns)
+        self.assertGreater(quality.medianE, 0.0)
+        self.assertGreater(quality.scatterSize, 0.0)
+        metadata = dafBase.PropertyList()
+        self.assertIsNone(getPsfQualityFromMetadata(metadata, *self.columns))
+        setPsfQualityMetadata(metadata, quality, *self.columns)
+        fromMetadata = getPsfQualityFromMetadata(metadata, *self.columns)
+        self.assertAlmostEqual(fromMetadata.medianE, quality.medianE)
+        self.assertAlmostEqual(fromMetadata.scatterSize, quality.scatterSize)
+        self.assertAlmostEqual(fromMetadata.scaledScatterSize, quality.scaledScatterSize)
+        self.assertIsNone(getPsfQualityFromMetadata(metadata, "calib_psfCandidate", *self.columns[1:]))
+
+
+class DummyCalexpRef:
+
+    """Quacks like a lsst.daf.persistence.ButlerDataRef for reading the header and a subimage of a calexp"""
+
+    def __init__(self, dataId, metadata, exposure):
+        self.dataId = dataId
+        self.metadata = metadata
+        self.exposure = exposure
+        self.bboxes = []
+
+    def get(self, dataType, bbox=None, immediate=True):
+        if dataType == "calexp_md":
+            return self.metadata
+        if dataType == "calexp_sub":
+            self.bboxes.append(bbox)
+            return self.exposure
+        raise KeyError("Unknown dataset type: %s" % (dataType,))
+
+
+class PsfSizeTestCase(unittest.TestCase):
+    """Test the reading of the size of the PSF for selecting the best-seeing images"""
+
+    def setUp(self):
+        self.psf = GaussianPsf(21, 21, 2.5)
+        self.exposure = afwImage.ExposureF(1, 1)
+        self.exposure.setPsf(self.psf)
+        self.task = BestSeeingWcsSelectImagesTask(name="select")
+
+    def testMetadata(self):
+        """The size recorded in the header is used without reading the calexp"""
+        metadata = dafBase.PropertyList()
+        setPsfSizeMetadata(metadata, GaussianPsf(21, 21, 3.0))
+        dataRef = DummyCalexpRef(dict(visit=1, ccd=2), metadata, self.exposure)
+        self.assertAlmostEqual(self.task.getPsfSize(dataRef), 3.0)
+        self.assertEqual(dataRef.bboxes, [])
+
+    def testFallback(self):
+        """Without a size in the header, the PSF is read with a single pixel of the calexp, once"""
+        dataRef = DummyCalexpRef(dict(visit=1, ccd=3), dafBase.PropertyList(), self.exposure)
+        self.assertAlmostEqual(self.task.getPsfSize(dataRef),
+                               self.psf.computeShape().getDeterminantRadius())
+        self.assertEqual(dataRef.bboxes, [afwGeom.Box2I(afwGeom.Point2I(0, 0), afwGeom.Extent2I(1, 1))])
+        self.assertAlmostEqual(self.task.getPsfSize(dataRef), 2.5)
+        self.assertEqual(len(dataRef.bboxes), 1)
+
+
 class MyMemoryTestCase(lsst.utils.tests.MemoryTestCase):
     pass
 